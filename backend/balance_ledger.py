@@ -0,0 +1,80 @@
+"""
+### This module books the transfers of a league onto the balances of its managers.
+
+`BalanceLedger` walks the transfer ledger once, oldest first. Every transfer moves
+its price from the buyer to the seller, both resolved through a UserDirectory, so all
+balances are built up at the same time. The balance every manager had at the end of each
+day with a transfer is kept on the way, which is the per-day balance timeline.
+
+Only transfers count. The daily login bonus and money from achievements are not in the
+feed and are not considered.
+"""
+
+from backend import miscellaneous
+from backend.user_directory import UserDirectory
+
+### -------------------------------------------------------------------
+
+### The activity feed type of a transfer
+TRANSFER_TYPE = 15
+
+
+class BalanceLedger:
+    """
+    ### The running balances of the managers of a league.
+
+    Args:
+        directory (UserDirectory): The managers of the league.
+        initial_balance (float): The balance every manager starts with.
+    """
+    __slots__ = ("directory", "balances", "_timeline")
+
+    def __init__(self, directory: UserDirectory, initial_balance: float):
+        self.directory: UserDirectory = directory
+        ### {user_id: balance}
+        self.balances: dict = {user_id: initial_balance for user_id in directory}
+        ### {user_id: {"YYYY-MM-DD": balance at the end of that day}}
+        self._timeline: dict = {user_id: {} for user_id in directory}
+
+    def _book(self, user_id: str, amount: float, day: str) -> None:
+        balance = self.balances[user_id] + amount
+        self.balances[user_id] = balance
+        self._timeline[user_id][day] = balance
+
+    def apply(self, transfers: list) -> "BalanceLedger":
+        """### Book transfers onto the balances.
+
+        Args:
+            transfers (list): Activity feed items, oldest first, as in the transfer ledger.
+                Items of other types and managers not in the league are skipped.
+
+        Returns:
+            BalanceLedger: The ledger itself.
+        """
+        for item in transfers:
+            if item["t"] != TRANSFER_TYPE:
+                continue
+
+            data = item["data"]
+            buyer_id = self.directory.id_of(data["byr"]) if "byr" in data else None
+            seller_id = self.directory.id_of(data["slr"]) if "slr" in data else None
+            day = miscellaneous.parse_feed_timestamp(item["dt"]).date().isoformat()
+
+            if buyer_id is not None:
+                self._book(buyer_id, -data["trp"], day)
+            ### A transfer only ever counts once per manager, as the buy
+            if seller_id is not None and seller_id != buyer_id:
+                self._book(seller_id, data["trp"], day)
+
+        return self
+
+    def timeline(self, user_id: str) -> list:
+        """### Get the balance of a manager at the end of every day they had a transfer.
+
+        Args:
+            user_id (str): The user ID.
+
+        Returns:
+            list: [("YYYY-MM-DD", balance), ...], oldest first.
+        """
+        return sorted(self._timeline[user_id].items())
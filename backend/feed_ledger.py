@@ -0,0 +1,164 @@
+"""
+### This module keeps the ledger of all transfers in a league.
+
+The Kickbase activity feed is paged newest first and can only be read from the start.
+Every transfer ever seen is kept in `all_transfers.json` (keyed by the feed item id
+"i"), so a run only has to page the feed until it reaches transfers that are already
+in there. `turnovers()`, `balances()` and `taken_free_players()` in `main.py` all read
+the merged ledger instead of the live feed.
+
+Feed items carry more than the stages read. Only TRANSFER_FIELDS and TRANSFER_DATA_FIELDS
+are kept in the ledger.
+"""
+
+import json
+import logging
+import threading
+
+from os import getenv, path
+
+from backend import exceptions, miscellaneous
+from backend.kickbase.client import KickbaseClient
+from backend.kickbase.v4 import leagues
+from backend.paths import data_dir
+
+### -------------------------------------------------------------------
+
+LEDGER_FILE = "all_transfers.json"
+
+### What the stages read from a transfer feed item and from its "data"
+TRANSFER_FIELDS = ("i", "t", "dt")
+TRANSFER_DATA_FIELDS = ("byr", "slr", "pi", "trp", "tid")
+
+### The merged ledger, once per league and run
+_ledger_cache = {}
+### {league_id: threading.Lock}, so a league's ledger is only synced by one thread at a time
+_league_locks = {}
+_lock = threading.Lock()
+
+
+def clear_cache() -> None:
+    """### Forget the ledgers synced during this run."""
+    _ledger_cache.clear()
+
+
+def compact_transfer(item: dict) -> dict:
+    """### Reduce a transfer feed item to the fields the stages read."""
+    data = item.get("data") or {}
+    compact = {key: item[key] for key in TRANSFER_FIELDS if key in item}
+    compact["data"] = {key: data[key] for key in TRANSFER_DATA_FIELDS if key in data}
+    return compact
+
+
+def load_ledger() -> list:
+    """### Load the transfers saved in earlier runs.
+
+    Returns:
+        list: The saved transfers, oldest first. Empty if there are none yet.
+    """
+    ledger_path = path.join(data_dir(), LEDGER_FILE)
+
+    if not path.exists(ledger_path):
+        logging.debug(f"The file {ledger_path} does not exist. Starting with an empty ledger.")
+        return []
+
+    try:
+        with open(ledger_path, "r") as f:
+            ledger = [compact_transfer(item) for item in json.load(f)]
+        logging.debug(f"Loaded {len(ledger)} existing transfers from {LEDGER_FILE}")
+        return ledger
+    except json.JSONDecodeError:
+        logging.warning(f"The file {ledger_path} is empty or contains invalid JSON. Starting with an empty ledger.")
+        return []
+
+
+def sync_transfers(client: KickbaseClient, league_id: str, full_resync: bool = False) -> list:
+    """### Bring the transfer ledger up to date with the activity feed.
+
+    Pages the feed only until it reaches known transfers, merges the new ones into the
+    ledger, drops everything from before START_DATE and saves the result. A full
+    resync pages the whole feed instead, in pages of FEED_RESYNC_PAGE_SIZE, or of
+    FEED_PAGE_SIZE if the server rejects those. It happens when there is no ledger yet,
+    when `full_resync` is set or when the FEED_FULL_RESYNC environment variable is "true".
+
+    Args:
+        client (KickbaseClient): The logged in API client.
+        league_id (str): The league ID.
+        full_resync (bool): Page the whole feed instead of stopping at known transfers.
+
+    Returns:
+        list: All transfers from START_DATE on, oldest first.
+    """
+    with _lock:
+        league_lock = _league_locks.setdefault(league_id, threading.Lock())
+
+    ### A prefetch still running past its deadline may be syncing the same ledger
+    with league_lock:
+        if league_id not in _ledger_cache:
+            _ledger_cache[league_id] = _sync_transfers(client, league_id, full_resync)
+        return _ledger_cache[league_id]
+
+
+def _sync_transfers(client: KickbaseClient, league_id: str, full_resync: bool) -> list:
+    ledger = load_ledger()
+    start_datetime = miscellaneous.get_start_datetime()
+
+    full_resync = full_resync or getenv("FEED_FULL_RESYNC", "false").lower() == "true" or not ledger
+    known_ids = {item["i"] for item in ledger}
+
+    if full_resync:
+        logging.info("Reading the whole activity feed...")
+        try:
+            new_transfers = leagues.transfers(client, league_id, cutoff=start_datetime,
+                                              page_size=leagues.FEED_RESYNC_PAGE_SIZE)
+        except exceptions.NotificatonException as e:
+            logging.warning(f"Reading the feed in pages of {leagues.FEED_RESYNC_PAGE_SIZE} failed ({e}), "
+                            f"falling back to {leagues.FEED_PAGE_SIZE}.")
+            new_transfers = leagues.transfers(client, league_id, cutoff=start_datetime)
+    else:
+        new_transfers = leagues.transfers(client, league_id, known_ids=known_ids, cutoff=start_datetime)
+    logging.debug(f"Found {len(new_transfers)} current transfers from the API")
+
+    ### Append only new transfers (ignoring duplicates)
+    for transfer in new_transfers:
+        if transfer["i"] not in known_ids:
+            ledger.append(compact_transfer(transfer))
+            known_ids.add(transfer["i"])
+
+    ### Sort transfers by date after appending new ones
+    ledger.sort(key=lambda item: miscellaneous.parse_feed_timestamp(item["dt"]))
+    logging.debug(f"Total transfers after appending new ones: {len(ledger)}")
+
+    ### Drop everything from before the season start or league reset
+    transfer_count = len(ledger)
+    ledger = miscellaneous.filter_transfers_from(ledger, start_datetime)
+
+    dropped = transfer_count - len(ledger)
+    if dropped:
+        logging.info(f"Ignored {dropped} transfer(s) from before START_DATE ({start_datetime.isoformat()}).")
+
+    ### Save updated transfers back to all_transfers.json
+    miscellaneous.write_json_to_file(ledger, LEDGER_FILE)
+    logging.debug(f"Updated {LEDGER_FILE} with new transfers")
+
+    return ledger
+
+
+def last_buy_prices(transfers: list, directory) -> dict:
+    """### Index what every manager last paid for every player they bought.
+
+    Args:
+        transfers (list): The transfers, oldest first, as returned by sync_transfers().
+        directory (UserDirectory): The managers of the league, to resolve the buyers' names.
+
+    Returns:
+        dict: {(user_id, player_id): price of the user's last buy of the player}. Buyers
+            who are no manager of the league are filed under the user ID None.
+    """
+    prices = {}
+    for transfer in transfers:
+        data = transfer["data"]
+        if "byr" in data:
+            ### Later buys overwrite earlier ones, the last one is what the current owner paid
+            prices[(directory.id_of(data["byr"]), data["pi"])] = data["trp"]
+    return prices
@@ -0,0 +1,125 @@
+"""
+### This module remembers what the output files of the last run were computed from.
+
+Most runs, e.g. overnight, see exactly the same data as the run before. Each stage
+hashes the data it computes its output files from into a fingerprint. If the
+fingerprint matches the one recorded when the files were last written, and the files
+are still there, the stage skips computing and writing them.
+
+FORCE_RECOMPUTE=true ignores the recorded fingerprints for a run.
+"""
+
+import json
+import logging
+import hashlib
+import threading
+
+from os import getenv, path
+from datetime import datetime
+
+from backend import miscellaneous
+from backend.paths import data_dir
+
+### -------------------------------------------------------------------
+
+FINGERPRINTS_FILE = "fingerprints.json"
+
+### {"league_id:stage": fingerprint}, loaded on first use
+_fingerprints = None
+### The stages that wrote their outputs since clear_cache()
+_recorded = set()
+_lock = threading.Lock()
+
+
+def clear_cache() -> None:
+    """### Start a new run. The recorded fingerprints are kept."""
+    _recorded.clear()
+
+
+def changed() -> bool:
+    """### Check whether any stage wrote its outputs since clear_cache(), i.e. the data changed."""
+    return bool(_recorded)
+
+
+def of(*inputs) -> str:
+    """### Hash the data an output is computed from.
+
+    Args:
+        *inputs: JSON serializable data. Anything else, like datetimes, is hashed by its str().
+
+    Returns:
+        str: The fingerprint.
+    """
+    serialized = json.dumps(inputs, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def _load() -> dict:
+    global _fingerprints
+
+    with _lock:
+        if _fingerprints is None:
+            _fingerprints = miscellaneous.read_cache_file(FINGERPRINTS_FILE, {})
+    return _fingerprints
+
+
+def unchanged(league_id: str, stage: str, fingerprint: str, outputs: tuple) -> bool:
+    """### Check whether a stage's output files were already computed from the same data.
+
+    Args:
+        league_id (str): The league ID.
+        stage (str): The stage name.
+        fingerprint (str): The fingerprint of the stage's current inputs, see of().
+        outputs (tuple): The file names the stage writes to the data directory.
+
+    Returns:
+        bool: True if the stage can skip computing and writing its outputs.
+    """
+    if getenv("FORCE_RECOMPUTE", "false").lower() == "true":
+        return False
+
+    if _load().get(f"{league_id}:{stage}") != fingerprint:
+        return False
+
+    return all(path.exists(path.join(data_dir(), output)) for output in outputs)
+
+
+def skip_unchanged(league_id: str, stage: str, fingerprint: str, outputs: tuple) -> bool:
+    """### Check unchanged() and, if a stage can skip its work, refresh the timestamps of its outputs.
+
+    The output files stay as they are, but they are confirmed current, so the frontend
+    shows the time of this run.
+
+    Args:
+        league_id (str): The league ID.
+        stage (str): The stage name.
+        fingerprint (str): The fingerprint of the stage's current inputs, see of().
+        outputs (tuple): The file names the stage writes to the data directory.
+
+    Returns:
+        bool: True if the stage should return right away.
+    """
+    if not unchanged(league_id, stage, fingerprint, outputs):
+        return False
+
+    logging.info(f"The data behind {', '.join(outputs)} didn't change since the last run. Keeping the file(s).")
+    for output in outputs:
+        miscellaneous.write_json_to_file({"time": datetime.now().isoformat()}, f"ts_{output}")
+    return True
+
+
+def record(league_id: str, stage: str, fingerprint: str) -> None:
+    """### Remember the fingerprint a stage's output files were just written from.
+
+    Args:
+        league_id (str): The league ID.
+        stage (str): The stage name.
+        fingerprint (str): The fingerprint of the stage's inputs, see of().
+    """
+    fingerprints = _load()
+
+    ### Written under the lock, so an older snapshot never overwrites a newer one
+    with _lock:
+        fingerprints[f"{league_id}:{stage}"] = fingerprint
+        _recorded.add(f"{league_id}:{stage}")
+        miscellaneous.write_cache_file(dict(fingerprints), FINGERPRINTS_FILE)
@@ -0,0 +1,238 @@
+"""
+### This module holds the HTTP client every Kickbase API call goes through.
+
+A full run sends well over a thousand requests to the same host. Opening a fresh
+connection for each of them costs more than the payloads themselves, so one client
+keeps a pool of keep-alive connections, the token and the default headers for the
+whole run.
+"""
+
+import time
+import asyncio
+import requests
+import contextvars
+
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from backend import profiling
+from backend.kickbase.http_cache import ResponseCache
+
+### -------------------------------------------------------------------
+
+API_BASE_URL = "https://api.kickbase.com"
+
+### Connections kept alive per host. Should be at least the number of worker threads
+## sending requests at the same time, otherwise connections get dropped and reopened.
+DEFAULT_POOL_SIZE = 8
+
+### How many calls of one endpoint function AsyncKickbaseClient lets run at once
+## Keyed by the function name. Anything not listed gets DEFAULT_ENDPOINT_LIMIT.
+ENDPOINT_LIMITS = {
+    "player_statistics": 6,
+    "player_marketvalue": 6,
+    "history": 6,
+    "user_stats": 4,
+    "battles": 5,
+    "ranking": 4,
+}
+DEFAULT_ENDPOINT_LIMIT = 2
+
+
+class KickbaseClient:
+    """
+    ### A pooled HTTP session for the Kickbase API.
+
+    Holds the user's kkstrauth token, the default headers and the base URL, so the
+    endpoint functions only pass the path and whatever is specific to their call.
+    With a ResponseCache, GET requests to the paths it has a policy for are answered
+    from disk while fresh and revalidated once they expire.
+
+    Example:
+    ```python
+    client = KickbaseClient(pool_size=8)
+    user_info, token = user.login(client, email, password, discord_webhook)
+    league_list = leagues.get_league_list(client)
+    ```
+    """
+    def __init__(self, token: str = None, base_url: str = API_BASE_URL, pool_size: int = DEFAULT_POOL_SIZE,
+                 cache: ResponseCache = None):
+        self.base_url: str = base_url.rstrip("/")
+        self.pool_size: int = pool_size
+        self.cache: ResponseCache = cache
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        })
+
+        ### One pool per host, sized so every worker thread can hold its own connection
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.token = token
+
+    @property
+    def token(self) -> str:
+        """The user's kkstrauth token, or None before logging in."""
+        return self._token
+
+    @token.setter
+    def token(self, token: str) -> None:
+        self._token = token
+
+        if token:
+            self.session.headers["Cookie"] = f"kkstrauth={token};"
+        else:
+            self.session.headers.pop("Cookie", None)
+
+    def url(self, path: str) -> str:
+        """### Build the full URL for an API path, e.g. `/v4/leagues/selection`."""
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        """### Send a GET request to the given API path.
+
+        Args:
+            path (str): The API path, including any query string.
+            **kwargs: Passed on to `requests.Session.get`, e.g. extra `headers`.
+
+        Returns:
+            requests.Response: The response.
+        """
+        started = time.perf_counter()
+
+        ttl = self.cache.policy_for(path) if self.cache else None
+        if ttl is None:
+            response = self.session.get(self.url(path), **kwargs)
+            profiling.record_request("GET", path, time.perf_counter() - started, response)
+            return response
+
+        url = self.url(path)
+        entry = self.cache.lookup(url)
+        if entry and entry.fresh:
+            profiling.record_request("GET", path, time.perf_counter() - started, cached="hit")
+            return entry.to_response()
+
+        ### Ask the server whether the expired entry is still current
+        if entry:
+            kwargs["headers"] = {**(kwargs.get("headers") or {}), **entry.validators()}
+
+        response = self.session.get(url, **kwargs)
+
+        if response.status_code == 304 and entry:
+            self.cache.refresh(url, self.cache.expiry_for(ttl))
+            profiling.record_request("GET", path, time.perf_counter() - started, response, cached="revalidated")
+            return entry.to_response()
+        if response.status_code == 200 and response.content:
+            self.cache.store(url, response, self.cache.expiry_for(ttl))
+
+        profiling.record_request("GET", path, time.perf_counter() - started, response)
+        return response
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        """### Send a POST request to the given API path.
+
+        Args:
+            path (str): The API path.
+            **kwargs: Passed on to `requests.Session.post`, e.g. `json`.
+
+        Returns:
+            requests.Response: The response.
+        """
+        started = time.perf_counter()
+        response = self.session.post(self.url(path), **kwargs)
+        profiling.record_request("POST", path, time.perf_counter() - started, response)
+        return response
+
+    def set_market_value_update(self, mvud: str) -> None:
+        """### Pass the next daily market value update on to the response cache, if there is one.
+
+        Args:
+            mvud (str): The "mvud" timestamp from the market response.
+        """
+        if self.cache:
+            self.cache.set_market_value_update(mvud)
+
+    def close(self) -> None:
+        """### Close all pooled connections and the response cache."""
+        self.session.close()
+
+        if self.cache:
+            self.cache.close()
+
+
+class AsyncKickbaseClient:
+    """
+    ### An asyncio front end for a KickbaseClient.
+
+    Runs the regular endpoint functions on a thread pool sized to the client's
+    connection pool, so they keep their caches and error handling while many of them
+    overlap on one event loop. Every endpoint function has its own concurrency limit
+    (see ENDPOINT_LIMITS), and the same call with the same arguments is only sent once
+    per client: later callers await the first one. A call that failed is sent again the
+    next time it is asked for.
+
+    Example:
+    ```python
+    async def fetch(client):
+        aclient = AsyncKickbaseClient(client)
+        stats = await aclient.call(leagues.player_statistics, league_id, player_id)
+    ```
+    """
+    def __init__(self, client: KickbaseClient, max_workers: int = None, limits: dict = None):
+        self.client: KickbaseClient = client
+        self.limits: dict = {**ENDPOINT_LIMITS, **(limits or {})}
+
+        ### Never more threads than pooled connections, or they would just queue for one
+        self._executor = ThreadPoolExecutor(max_workers=min(max_workers or client.pool_size, client.pool_size),
+                                            thread_name_prefix="kickbase")
+        self._semaphores = {}
+        self._calls = {}
+
+    def _semaphore(self, endpoint: str) -> asyncio.Semaphore:
+        if endpoint not in self._semaphores:
+            self._semaphores[endpoint] = asyncio.Semaphore(self.limits.get(endpoint, DEFAULT_ENDPOINT_LIMIT))
+        return self._semaphores[endpoint]
+
+    async def _run(self, func, *args):
+        async with self._semaphore(func.__name__):
+            loop = asyncio.get_running_loop()
+            ### Carry the context over to the worker thread, it holds e.g. the league's data directory
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self._executor, partial(context.run, func, self.client, *args))
+
+    async def call(self, func, *args):
+        """### Await an endpoint function without blocking the event loop.
+
+        Args:
+            func (callable): An endpoint function taking the client as first argument,
+                e.g. `leagues.player_statistics`.
+            *args: The remaining arguments of the endpoint function.
+
+        Returns:
+            any: Whatever the endpoint function returns.
+        """
+        key = (func, args)
+        if key not in self._calls:
+            future = asyncio.ensure_future(self._run(func, *args))
+            future.add_done_callback(partial(self._forget_failed, key))
+            self._calls[key] = future
+        return await self._calls[key]
+
+    def _forget_failed(self, key: tuple, future: asyncio.Future) -> None:
+        """### Drop a failed or cancelled call, so it isn't answered with the same error forever."""
+        if (future.cancelled() or future.exception() is not None) and self._calls.get(key) is future:
+            del self._calls[key]
+
+    def close(self, wait: bool = True) -> None:
+        """### Shut the thread pool down. Calls still queued are dropped. The wrapped client stays open.
+
+        Args:
+            wait (bool): Wait for the calls already running. Without waiting they finish in
+                the background and still fill the endpoint caches, e.g. after a deadline.
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=True)
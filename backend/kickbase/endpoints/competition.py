@@ -5,6 +5,9 @@
 `/vX/competition/...`
 """
 
+from backend import miscellaneous
+
+
 class Player:
     """
     ### Create an object for a player with all its attributes.
@@ -12,6 +15,9 @@ class Player:
     Used for endpoint URL:
     `/competition/teams/[team_id]/players` -> get all players of a given team
     """
+    __slots__ = ("id", "teamId", "teamName", "teamSymbol", "firstName", "lastName", "profile", "profileBig", "team",
+                 "teamCover", "status", "position", "number", "averagePoints", "totalPoints", "marketValue",
+                 "marketValueTrend")
 
     def __init__(self, p_dict: dict):
         self.id: str = p_dict.get("id", None)
@@ -30,4 +36,46 @@ class Player:
         self.averagePoints: int = p_dict.get("averagePoints", None)
         self.totalPoints: int = p_dict.get("totalPoints", None)
         self.marketValue: float = p_dict.get("marketValue", None)
-        self.marketValueTrend: int = p_dict.get("marketValueTrend", None)
\ No newline at end of file
+        self.marketValueTrend: int = p_dict.get("marketValueTrend", None)
+
+
+class Player_Profile:
+    """
+    ### Create a compact object for a player's profile, holding only what the stages use.
+
+    Used for endpoint URL:
+    `/v4/competitions/1/players/{player_id}?leagueId={league_id}` -> get a player's profile
+
+    The response also holds the player's owner in every league they are owned in ("opl")
+    and many fields no stage reads. Only the owner in the requested league is kept.
+    """
+    __slots__ = ("leagueId", "id", "firstName", "lastName", "teamId", "position", "marketValue", "totalPoints",
+                 "statusText", "owner")
+
+    def __init__(self, profile_dict: dict, league_id: str):
+        self.leagueId: str = league_id
+        self.id: str = profile_dict.get("i", None)
+        self.firstName: str = profile_dict.get("fn", None)
+        self.lastName: str = profile_dict.get("ln", None)
+        self.teamId: str = profile_dict.get("tid", None)
+        self.position: int = profile_dict.get("pos", None)
+        self.marketValue: float = profile_dict.get("mv", None)
+        self.totalPoints: int = profile_dict.get("tp", None)
+        self.statusText: str = profile_dict.get("stxt", None)  ### Localized status note, e.g. the injury
+        ### The owner in this league as {"oui": owner ID, "onm": owner name}, None if nobody owns the player
+        owner = miscellaneous.get_player_owner(profile_dict, league_id)
+        self.owner: dict = {"oui": owner["oui"], "onm": owner.get("onm", None)} if owner else None
+
+    def to_dict(self) -> dict:
+        """### The profile in the shape of the response, to store it as JSON. Player_Profile(to_dict(), leagueId) rebuilds it."""
+        return {
+            "i": self.id,
+            "fn": self.firstName,
+            "ln": self.lastName,
+            "tid": self.teamId,
+            "pos": self.position,
+            "mv": self.marketValue,
+            "tp": self.totalPoints,
+            "stxt": self.statusText,
+            "opl": [{"li": self.leagueId, **self.owner}] if self.owner else [],
+        }
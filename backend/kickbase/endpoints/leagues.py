@@ -12,6 +12,8 @@ class League_Info:
     Used for endpoint URL:
     `/leagues/selection` -> get all leagues the user is in
     """
+    __slots__ = ("id", "name", "cpi", "b", "un", "f", "lpc", "bs", "vr", "adm", "pl", "tv")
+
     def __init__(self, league_dict: dict):
         self.id: str = league_dict.get("i", None)  ### League ID
         self.name: str = league_dict.get("n", None)  ### League name
@@ -48,6 +50,9 @@ class League_User_Info:
     Used for endpoint URL:
     `/leagues/{league_id}/me` -> get user's stats in the given league
     """
+    __slots__ = ("budget", "teamValue", "placement", "points", "ttm", "cmd", "flags", "perms", "se", "csid", "nt",
+                 "ntv", "nb", "ga", "un")
+
     def __init__(self, league_user_info_dict: dict):
         self.budget: float = league_user_info_dict.get("budget", None)
         self.teamValue: float = league_user_info_dict.get("teamValue", None)
@@ -100,6 +105,8 @@ class Meta:
     Everything that is stored directly under "items" is handled by the League_Feed class.
     Everything under "meta" is handled by this class.
     """
+    __slots__ = ("si", "sn", "sid", "bi", "bid", "bn", "p", "pid", "tid", "pfn", "pln", "pi")
+
     def __init__(self, meta_dict: dict, type: int):
         ### Meta attributes for Type 2 SPECIFIC
         self.si: str = meta_dict.get("si", None)  # Sellers profile pic
@@ -164,6 +171,8 @@ class League_Feed:
         print(f"First name: {feed_entry.meta.pfn}
     ```
     """
+    __slots__ = ("id", "comments", "date", "age", "type", "source", "meta", "seasonId")
+
     def __init__(self, league_feed_dict: dict):
         self.id: str = league_feed_dict.get("id", None)
         self.comments: int = league_feed_dict.get("comments", None)
@@ -187,6 +196,10 @@ class Market_Players:
     Used for endpoint URL:
     `/leagues/{league_id}/market` -> get the whole market
     """
+    __slots__ = ("id", "firstName", "lastName", "teamId", "position", "status", "marketValueTrend", "marketValue",
+                 "totalPoints", "averagePoints", "ofc", "expiry", "userId", "username", "price", "isn", "offers",
+                 "ownOfferUserId", "ownOfferPrice", "iposl", "listedsince")
+
     def __init__(self, market_players_dict: dict):
         self.id: str = market_players_dict.get("i", None)
         self.firstName: str = market_players_dict.get("fn", None)
@@ -214,6 +227,10 @@ class Market_Players:
         # self.number: int = market_players_dict.get("number", None)
         # self.lus: int = market_players_dict.get("lus", None)
 
+    def to_dict(self) -> dict:
+        """### All attributes as a dict, e.g. to fingerprint the entry."""
+        return {attribute: getattr(self, attribute) for attribute in self.__slots__}
+
     def own_offer(self, own_user_id: str) -> float:
         """### What the logged in user currently bids for this player, if anything.
 
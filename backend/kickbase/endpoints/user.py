@@ -12,6 +12,8 @@ class User:
     Used for endpoint URL:
     `/user/login` -> get all user data
     """
+    __slots__ = ("email", "cover", "flags", "vemail", "id", "name", "profile")
+
     def __init__(self, user_dict: dict):
         self.email: str = user_dict.get("email", None)
         self.cover: str = user_dict.get("cover", None)
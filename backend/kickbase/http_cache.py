@@ -0,0 +1,243 @@
+"""
+### This module holds the persistent HTTP response cache of the Kickbase client.
+
+The per-run caches in the v4 modules are emptied at the start of every run, yet most
+of what a run downloads (365 days of market values per player, team profiles) only
+changes once a day, at the daily market value update. This cache keeps
+those responses on disk between runs, in one SQLite file with zlib compressed bodies.
+
+Which paths are cached and for how long is decided by CACHE_POLICIES. An expired entry
+is revalidated with If-None-Match/If-Modified-Since if the server sent an ETag or
+Last-Modified header, so an unchanged response costs a 304 instead of the full body.
+The least recently used entries are evicted once the file grows past its size limit.
+"""
+
+import re
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+import requests
+
+from os import makedirs, path
+from datetime import datetime, timedelta, timezone
+
+### -------------------------------------------------------------------
+
+### Special time to live: the entry is valid until the next daily market value update
+MARKET_VALUE_UPDATE = "mvud"
+
+### (path pattern, time to live). Paths not matching any pattern are never cached.
+## Market value histories only change at the update, and no time to live reaches past it
+## (see ResponseCache.expiry_for()). Player profiles are not cached here:
+## they carry the per-league ownership ("opl"), which backend.ownership needs live, and
+## backend.player_profiles already decides when a stored profile can be reused.
+CACHE_POLICIES = (
+    (re.compile(r"^/v4/competitions/\d+/players/\w+/marketValue/\d+$"), MARKET_VALUE_UPDATE),
+    (re.compile(r"^/v4/competitions/\d+/teams/\d+/teamprofile$"), timedelta(hours=1)),
+    (re.compile(r"^/v4/competitions/\d+/matchdays$"), timedelta(hours=6)),
+)
+
+### Used for MARKET_VALUE_UPDATE entries as long as the update time was never seen
+FALLBACK_TTL = timedelta(hours=6)
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+### Entries that expired this long ago are dropped when the cache is opened
+STALE_AFTER = timedelta(days=7)
+
+
+class CachedEntry:
+    """
+    ### One cached response as stored in the cache file.
+    """
+    __slots__ = ("url", "body", "etag", "last_modified", "expires")
+
+    def __init__(self, url: str, body: bytes, etag: str, last_modified: str, expires: float):
+        self.url: str = url
+        self.body: bytes = body
+        self.etag: str = etag
+        self.last_modified: str = last_modified
+        self.expires: float = expires
+
+    @property
+    def fresh(self) -> bool:
+        """Whether the entry can be used without asking the server."""
+        return time.time() < self.expires
+
+    def validators(self) -> dict:
+        """### The conditional request headers for revalidating this entry."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_response(self) -> requests.Response:
+        """### Rebuild a response object, so callers can't tell a hit from a real request."""
+        response = requests.Response()
+        response.status_code = 200
+        response.url = self.url
+        response.encoding = "utf-8"
+        response._content = self.body
+        response.headers["Content-Type"] = "application/json"
+        response.headers["X-Cache"] = "HIT"
+        return response
+
+
+class ResponseCache:
+    """
+    ### A size bounded, persistent cache for GET responses of the Kickbase API.
+
+    Safe to use from several threads at once.
+
+    Args:
+        file_path (str): The SQLite file to keep the cache in. Created if missing.
+        max_bytes (int): The compressed size the cache is trimmed back to.
+    """
+    def __init__(self, file_path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.file_path: str = file_path
+        self.max_bytes: int = max_bytes
+
+        makedirs(path.dirname(file_path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(file_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                expires REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL
+            )""")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute("DELETE FROM responses WHERE expires < ?", (time.time() - STALE_AFTER.total_seconds(),))
+        self._db.commit()
+
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'mvud'").fetchone()
+        self._market_value_update = datetime.fromisoformat(row[0]) if row else None
+
+    ### -------------------------------------------------------------------
+    ### Policies
+
+    @staticmethod
+    def policy_for(api_path: str):
+        """### The time to live for an API path, or None if it is not cached."""
+        for pattern, ttl in CACHE_POLICIES:
+            if pattern.match(api_path):
+                return ttl
+        return None
+
+    def set_market_value_update(self, mvud: str) -> None:
+        """### Remember when the next daily market value update happens.
+
+        Args:
+            mvud (str): The "mvud" timestamp from the market response, e.g. "2023-11-24T21:00:00Z".
+        """
+        if not mvud:
+            return
+
+        update = datetime.fromisoformat(mvud.replace("Z", "+00:00")).astimezone(timezone.utc)
+        with self._lock:
+            self._market_value_update = update
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('mvud', ?)", (update.isoformat(),))
+            self._db.commit()
+
+    def next_market_value_update(self) -> datetime:
+        """### The next market value update after now, or None if it was never seen.
+
+        The update happens once a day, so a remembered update that already passed is
+        moved forward in steps of a day.
+        """
+        update = self._market_value_update
+        if update is None:
+            return None
+
+        now = datetime.now(timezone.utc)
+        if update <= now:
+            update += timedelta(days=(now - update).days + 1)
+        return update
+
+    def expiry_for(self, ttl) -> float:
+        """### The UNIX time an entry stored now with the given time to live expires at.
+
+        No entry outlives the next market value update, since team profiles list the
+        market values, status and trends it changes.
+        """
+        update = self.next_market_value_update()
+        if ttl == MARKET_VALUE_UPDATE:
+            if update is not None:
+                return update.timestamp()
+            ttl = FALLBACK_TTL
+
+        expires = time.time() + ttl.total_seconds()
+        return min(expires, update.timestamp()) if update is not None else expires
+
+    ### -------------------------------------------------------------------
+    ### Entries
+
+    def lookup(self, url: str) -> CachedEntry:
+        """### Get the cached entry for a URL, fresh or not. None if there is none."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT body, etag, last_modified, expires FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE responses SET last_access = ? WHERE url = ?", (time.time(), url))
+
+        body, etag, last_modified, expires = row
+        return CachedEntry(url, zlib.decompress(body), etag, last_modified, expires)
+
+    def store(self, url: str, response: requests.Response, expires: float) -> None:
+        """### Cache a successful response."""
+        body = zlib.compress(response.content)
+
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, body, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                 expires, time.time(), len(body)),
+            )
+            self._size += len(body) - (old[0] if old else 0)
+
+            if self._size > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def refresh(self, url: str, expires: float) -> None:
+        """### Extend a revalidated entry after the server answered 304 Not Modified."""
+        with self._lock:
+            self._db.execute("UPDATE responses SET expires = ?, last_access = ? WHERE url = ?",
+                             (expires, time.time(), url))
+            self._db.commit()
+
+    def _evict(self) -> None:
+        """### Drop the least recently used entries until the cache is back under 90% of its limit."""
+        target = self.max_bytes * 0.9
+        evicted = 0
+
+        for url, size in self._db.execute("SELECT url, size FROM responses ORDER BY last_access").fetchall():
+            if self._size <= target:
+                break
+            self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self._size -= size
+            evicted += 1
+
+        logging.debug(f"Evicted {evicted} response(s) from the HTTP cache.")
+
+    def close(self) -> None:
+        """### Write the last access times to disk and close the cache file."""
+        with self._lock:
+            self._db.commit()
+            self._db.close()
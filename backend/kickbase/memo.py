@@ -0,0 +1,266 @@
+"""
+### This module holds the in-memory cache the endpoint functions keep their responses in.
+
+A `MemoCache` is a thread-safe dict with limits. The endpoint functions are called from
+thread pools, so two threads missing the same key at the same time would both send the
+request. Instead the first one loads the value and the others wait for it (single-flight).
+An entry can expire after a time to live, and the least recently used entries are
+evicted once the cache holds more than `max_entries` entries or more than `max_bytes`
+bytes, so a long-running process doesn't grow without bound.
+
+`memoize()` puts an endpoint function in front of a cache:
+
+```python
+_ranking_cache = memo.MemoCache("ranking", max_entries=256)
+
+@memo.memoize(_ranking_cache)
+def ranking(client, league_id, match_day): ...
+```
+
+Every cache counts its hits, misses, evictions and expirations, see stats().
+"""
+
+import sys
+import time
+import logging
+import threading
+
+from functools import wraps
+from collections import OrderedDict
+
+### -------------------------------------------------------------------
+
+### Every MemoCache created, for stats()
+_caches = []
+_caches_lock = threading.Lock()
+
+
+def approximate_size(value) -> int:
+    """### Estimate the memory held by a decoded JSON value, in bytes.
+
+    sys.getsizeof() only counts the outer container, so dicts, lists, tuples and the
+    attributes of slotted records are walked.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(key) + approximate_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(approximate_size(item) for item in value)
+    elif hasattr(type(value), "__slots__"):
+        size += sum(approximate_size(getattr(value, slot, None)) for slot in type(value).__slots__)
+    return size
+
+
+class _Flight:
+    """
+    ### A load in progress, which later callers of the same key wait for.
+    """
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class MemoCache:
+    """
+    ### A thread-safe, bounded cache with single-flight loading.
+
+    Args:
+        name (str): The name the cache is reported under.
+        max_entries (int): Evict the least recently used entries beyond this many. None for no limit.
+        max_bytes (int): Evict the least recently used entries once their approximate size,
+            see approximate_size(), is beyond this. None for no limit.
+        ttl (float or callable): Seconds an entry is valid for, or a function getting the
+            value and returning them, so every entry can have its own. None never expires.
+    """
+    def __init__(self, name: str, max_entries: int = None, max_bytes: int = None, ttl=None):
+        self.name: str = name
+        self.max_entries: int = max_entries
+        self.max_bytes: int = max_bytes
+        self.ttl = ttl
+
+        ### {key: (value, expires or None, size)}, least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        ### {key: _Flight} of the loads in progress
+        self._flights = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        with _caches_lock:
+            _caches.append(self)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        """### Whether the key has a valid entry. Neither counts as a hit nor marks it as used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(entry)
+
+    def _expired(self, entry: tuple) -> bool:
+        return entry[1] is not None and time.monotonic() >= entry[1]
+
+    def _drop(self, key) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _lookup(self, key):
+        """### Get the entry of a key and mark it as used, or None. The lock must be held."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            self._drop(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key, default=None):
+        """### Get the value of a key, or `default` if it isn't cached (anymore)."""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value) -> None:
+        """### Cache a value, evicting the least recently used entries if the cache is full."""
+        ttl = self.ttl(value) if callable(self.ttl) else self.ttl
+        size = approximate_size(value) if self.max_bytes is not None else 0
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, time.monotonic() + ttl if ttl is not None else None, size)
+            self._bytes += size
+
+            while self._entries and ((self.max_entries is not None and len(self._entries) > self.max_entries)
+                                     or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def discard(self, key) -> None:
+        """### Forget a key, if it is cached."""
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def get_or_load(self, key, load):
+        """### Get the value of a key, loading and caching it on a miss.
+
+        If another thread is loading the same key already, this waits for its result
+        instead of loading it a second time. An exception raised by `load` reaches
+        every caller waiting for it and nothing is cached.
+
+        Args:
+            key (hashable): The key.
+            load (callable): Gets the value, called without arguments.
+
+        Returns:
+            any: The cached or loaded value.
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._flights[key] = _Flight()
+            else:
+                ### Served by the load in progress, without a request of its own
+                self.hits += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = load()
+            self.put(key, flight.value)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def clear(self) -> None:
+        """### Forget every entry and reset the counters. Loads in progress still finish for their callers."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def stats(self) -> dict:
+        """### Get the counters and the current size of the cache."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes if self.max_bytes is not None else None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+def memoize(cache: MemoCache, key=None):
+    """### Cache the results of an endpoint function in a MemoCache.
+
+    Args:
+        cache (MemoCache): The cache to keep the results in.
+        key (callable): Gets the function's arguments and returns the cache key. By default
+            the positional arguments after the first one, the client, are the key, followed
+            by the keyword arguments sorted by name.
+
+    Returns:
+        callable: The decorator. The decorated function has the cache as `.cache`.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if key is not None:
+                cache_key = key(*args, **kwargs)
+            else:
+                cache_key = args[1:] + tuple(sorted(kwargs.items()))
+            return cache.get_or_load(cache_key, lambda: func(*args, **kwargs))
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+def stats() -> dict:
+    """### Get the stats of every cache by name, see MemoCache.stats()."""
+    with _caches_lock:
+        caches = list(_caches)
+    return {cache.name: cache.stats() for cache in caches}
+
+
+def log_stats() -> None:
+    """### Log the stats of every cache that was used, at debug level."""
+    for name, cache_stats in stats().items():
+        if cache_stats["hits"] or cache_stats["misses"]:
+            logging.debug(f"Cache {name}: {cache_stats['entries']} entries, {cache_stats['hits']} hit(s), "
+                          f"{cache_stats['misses']} miss(es), {cache_stats['evictions']} eviction(s), "
+                          f"{cache_stats['expirations']} expiration(s).")
@@ -9,41 +9,182 @@ import logging
 import json
 
 from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
-from backend import miscellaneous
+from backend import miscellaneous, player_profiles
+from backend.kickbase import memo
+from backend.kickbase.client import KickbaseClient
+from backend.paths import data_dir
 
 ### -------------------------------------------------------------------
 
 ### How many team ids to probe at once
 MAX_TEAM_WORKERS = 8
 
+### The team ids probed when the valid ones are unknown (loop from ID 2 to 100)
+TEAM_ID_RANGE = range(2, 101)
+### How often all of TEAM_ID_RANGE is probed, even if every known team still answers
+## Roughly once per match day, which also catches teams joining at the start of a season
+TEAM_RESCAN_INTERVAL = timedelta(days=7)
+TEAM_REGISTRY_FILE = "team_ids.json"
 
-def get_team_overview(token: str) -> dict:
+### Per-run caches
+## Neither the teams nor the match days change during a run, but several stages of every
+## league need them. Leagues run at the same time, so the caches are single-flight
+_team_overview_cache = memo.MemoCache("team_overview", max_entries=1)
+_match_days_cache = memo.MemoCache("match_days", max_entries=8)
+### (data directory, file name) of the files written from the caches above
+## Teams and match days are the same for every league, but each league's data directory needs its own copy
+_written_files = set()
+### The team id registry, loaded once per process. Unlike the caches above it stays valid between runs
+_team_registry = None
+
+
+def clear_caches() -> None:
+    """### Empty the per-run API caches."""
+    _team_overview_cache.clear()
+    _match_days_cache.clear()
+    _written_files.clear()
+
+
+def _write_to_data_dir(data, file_name: str) -> None:
+    """### Write a competition file to the current league's data directory, once per run."""
+    key = (data_dir(), file_name)
+    if key in _written_files:
+        return
+
+    miscellaneous.write_json_to_file(data, file_name)
+    _written_files.add(key)
+
+
+def get_team_overview(client: KickbaseClient, rescan: bool = False) -> dict:
     """### Get all team names + ID and their players.
 
+    There is no endpoint listing the teams of a competition, so their ids have to be
+    probed. The ids that turned out to be valid are kept in a registry between runs,
+    and usually only those are fetched. All possible ids are probed again when the
+    registry is empty or older than TEAM_RESCAN_INTERVAL, when a known team stops
+    answering, or when `rescan` is set.
+
     Args:
-        token (str): The user's kkstrauth token.
+        client (KickbaseClient): The logged in API client.
+        rescan (bool): Probe every possible team id, regardless of the registry.
 
     Returns:
         dict: A dictionary containing all team ids + names and players.
     """
+    if rescan:
+        _team_overview_cache.discard("teams")
+
+    all_teams = _team_overview_cache.get_or_load("teams", lambda: _load_team_overview(client, rescan))
+    _write_to_data_dir(all_teams, "STATIC_teams.json")
+
+    return all_teams
+
+
+def _load_team_overview(client: KickbaseClient, rescan: bool) -> list:
     logging.info("Getting team overview...")
 
-    url = "https://api.kickbase.com/v4/competitions/1/teams/{team_id}/teamprofile"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Cookie": f"kkstrauth={token};",
+    registry = load_team_registry()
+    known_ids = registry.get("ids") or []
+
+    if rescan:
+        logging.info("Rescanning all team ids on request.")
+    elif not known_ids:
+        logging.info("No known team ids yet, probing all of them.")
+        rescan = True
+    elif _registry_outdated(registry):
+        logging.info(f"Team ids were last probed on {registry['lastFullScan']}, probing all of them again.")
+        rescan = True
+
+    all_teams = None
+    if not rescan:
+        all_teams = _fetch_teams(client, known_ids)
+
+        ### A team that vanished means the competition changed, e.g. a new season started
+        if any(team is None for team in all_teams):
+            missing = [team_id for team_id, team in zip(known_ids, all_teams) if team is None]
+            logging.info(f"Known team id(s) {missing} did not answer, probing all team ids again.")
+            all_teams = None
+
+    if all_teams is None:
+        ### Team IDs 33 and 38 are skipped cuz they are leading to "500 Internal Server Error"
+        probe_ids = [team_id for team_id in TEAM_ID_RANGE if team_id not in (33, 38)]
+        all_teams = _fetch_teams(client, probe_ids)
+
+        _save_team_registry([team["teamId"] for team in all_teams if team])
+
+    all_teams = [team for team in all_teams if team]
+
+    ### The player profiles are only fetched again for players whose entry here changed
+    player_profiles.observe(player for team in all_teams for player in team["players"])
+
+    logging.info("Got all teams.")
+
+    ### The teams may have changed, so the file is written again
+    _written_files.discard((data_dir(), "STATIC_teams.json"))
+
+    return all_teams
+
+
+def rescan_teams(client: KickbaseClient) -> dict:
+    """### Probe every possible team id and rebuild the team id registry.
+
+    Args:
+        client (KickbaseClient): The logged in API client.
+
+    Returns:
+        dict: A dictionary containing all team ids + names and players.
+    """
+    return get_team_overview(client, rescan=True)
+
+
+def load_team_registry() -> dict:
+    """### Load the registry of valid team ids.
+
+    Returns:
+        dict: "ids" with the valid team ids and "lastFullScan" with the ISO timestamp of
+            the last time all team ids were probed. Empty if there is no registry yet.
+    """
+    global _team_registry
+
+    if _team_registry is None:
+        _team_registry = miscellaneous.read_cache_file(TEAM_REGISTRY_FILE, {})
+    return _team_registry
+
+
+def _save_team_registry(team_ids: list) -> None:
+    global _team_registry
+
+    _team_registry = {
+        "ids": sorted(int(team_id) for team_id in team_ids),
+        "lastFullScan": datetime.now(timezone.utc).isoformat(),
     }
+    miscellaneous.write_cache_file(_team_registry, TEAM_REGISTRY_FILE)
 
-    ### There is no endpoint listing the teams of a competition, so the ids are probed (loop from ID 2 to 100)
-    ## Team IDs 33 and 38 are skipped cuz they are leading to "500 Internal Server Error"
-    team_ids = [team_id for team_id in range(2, 101) if team_id not in (33, 38)]
+
+def _registry_outdated(registry: dict) -> bool:
+    """### Whether the last full probe is older than TEAM_RESCAN_INTERVAL."""
+    try:
+        last_full_scan = datetime.fromisoformat(registry["lastFullScan"])
+    except (KeyError, TypeError, ValueError):
+        return True
+
+    return datetime.now(timezone.utc) - last_full_scan > TEAM_RESCAN_INTERVAL
+
+
+def _fetch_teams(client: KickbaseClient, team_ids: list) -> list:
+    """### Fetch the team profiles of the given ids.
+
+    Returns:
+        list: The team info of every id, in the given order. None for ids without a team.
+    """
+    url = "/v4/competitions/1/teams/{team_id}/teamprofile"
 
     def fetch_team(team_id):
         """Probe one team id. Returns the team info, or None if there is no such team."""
         try:
-            response = requests.get(url.format(team_id=team_id), headers=headers)
+            response = client.get(url.format(team_id=team_id))
             response.raise_for_status()  # Raise an HTTPError for bad responses (4xx and 5xx)
             if not response.content:  # Check if the response is not empty
                 logging.warning(f"Empty response for team id {team_id}")
@@ -68,45 +209,42 @@ def get_team_overview(token: str) -> dict:
             "players": json_response["it"],
         }
 
-    ### Most of these ids do not exist, and each probe is almost entirely spent waiting,
-    ## so they run concurrently. 'map' keeps the results in team id order, which keeps
-    ## STATIC_teams.json stable between runs.
+    ### Each request is almost entirely spent waiting, so they run concurrently.
+    ## 'map' keeps the results in team id order, which keeps STATIC_teams.json stable between runs.
     with ThreadPoolExecutor(max_workers=MAX_TEAM_WORKERS) as executor:
-        results = list(executor.map(fetch_team, team_ids))
-
-    all_teams = [team for team in results if team]
-
-    logging.info("Got all teams.")
-
-    ### Save to file
-    miscellaneous.write_json_to_file(all_teams, "STATIC_teams.json")
-
-    return all_teams
+        return list(executor.map(fetch_team, team_ids))
 
 
-def match_days(token: str, competition_id: int = 1) -> tuple:
+def match_days(client: KickbaseClient, competition_id: int = 1) -> tuple:
     """### Fetch all matches for every match day in the current season and save to JSON
 
     Args:
-        token (str): The user's kkstrauth token
+        client (KickbaseClient): The logged in API client
         competition_id (int): The competition ID (default: 1 which is the Bundesliga)
     
     Returns:
         tuple: A tuple containing the current match day number and a list of dictionaries. Each dictionary contains the match day number, the start date & time of the first match, and the start date & time of the last match.
     """
-    url = f"https://api.kickbase.com/v4/competitions/{competition_id}/matchdays"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Cookie": f"kkstrauth={token};",
-    }
+    current_match_day, match_days_list = _match_days_cache.get_or_load(
+        competition_id, lambda: _load_match_days(client, competition_id))
+
+    ### Save to file
+    _write_to_data_dir(match_days_list, "match_days.json")
+
+    ### TODO: Timestamp needed here?
+
+    return current_match_day, match_days_list
+
+
+def _load_match_days(client: KickbaseClient, competition_id: int) -> tuple:
+    url = f"/v4/competitions/{competition_id}/matchdays"
 
     match_days = []
 
     logging.info("Fetching match days...")
 
     try:
-        response = requests.get(url, headers=headers).json()
+        response = client.get(url).json()
     except requests.exceptions.RequestException as e:
         logging.error(f"Request failed: {e}")
 
@@ -125,9 +263,4 @@ def match_days(token: str, competition_id: int = 1) -> tuple:
 
     logging.info("Match days fetched.")
 
-    ### Save to file
-    miscellaneous.write_json_to_file(match_days, "match_days.json")
-
-    ### TODO: Timestamp needed here?
-
     return current_match_day, match_days
\ No newline at end of file
@@ -5,57 +5,95 @@ TODO: Maybe list all functions here automatically?
 """
 
 import logging
-import requests
 
 from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
-from backend import exceptions, miscellaneous
+from backend import exceptions, miscellaneous, player_profiles
+from backend.kickbase import memo
+from backend.kickbase.client import KickbaseClient
+from backend.kickbase.endpoints.competition import Player_Profile
 from backend.kickbase.endpoints.leagues import League_Info, Market_Players
 
 ### -------------------------------------------------------------------
 
+### The activity feed is read in pages of this many items. It is what the Kickbase app
+## asks for. A larger value can be passed to transfers(), the stride adapts to what the server sends.
+FEED_PAGE_SIZE = 26
+### A full read of the feed asks for pages this large, to need fewer requests. The server may
+## send fewer items per page, or reject it, see feed_ledger.sync_transfers()
+FEED_RESYNC_PAGE_SIZE = 200
+### How many feed pages are requested at once when the whole feed is read
+FEED_WINDOW = 8
+
+### The next daily market value update, as announced by the last market response. Kept across runs.
+_market_value_update = None
+
 ### Per-run caches
-## main.py walks every player twice, in market_value_changes() and in taken_free_players()
-## and pages the activity feed three times. None of that changes during a run, so each response is fetched once and reused
+## main.py walks every player twice, in market_value_changes() and in taken_free_players().
+## None of that changes during a run, so each response is fetched once and reused
 MAX_PLAYER_WORKERS = 8
+### The manager dashboards and battles of a league are fetched with this many threads
+MAX_DASHBOARD_WORKERS = 8
+
+### The Kickbase battle types shown in the frontend (4-7: points per position, 8: max points)
+BATTLE_TYPES = (4, 5, 6, 7, 8)
+
+### The size limits of the per-run caches. A run needs about 1 KB per player profile
+## (see Player_Profile) and a few KB per market value history, for every player of every league.
+PLAYER_STATISTICS_CACHE_BYTES = 64 * 1024 * 1024
+PLAYER_MARKETVALUE_CACHE_BYTES = 64 * 1024 * 1024
+MAX_LEAGUE_ENTRIES = 64
+MAX_MANAGER_ENTRIES = 4096
+
+
+def _market_ttl(players_on_market: list):
+    """### A market is only valid until its first listing ends."""
+    return min((player.expiry for player in players_on_market if player.expiry is not None), default=None)
+
 
-_player_statistics_cache = {}
-_player_marketvalue_cache = {}
-_transfers_cache = {}
-_user_stats_cache = {}
-_battles_cache = {}
+_market_cache = memo.MemoCache("market", max_entries=MAX_LEAGUE_ENTRIES, ttl=_market_ttl)
+### {league_id: [datetime]}, when the listings on the market end
+_market_expiries = {}
+### Only the profiles fetched from the API during this run, not the ones taken from backend.player_profiles
+_player_statistics_cache = memo.MemoCache("player_statistics", max_bytes=PLAYER_STATISTICS_CACHE_BYTES)
+_player_marketvalue_cache = memo.MemoCache("player_marketvalue", max_bytes=PLAYER_MARKETVALUE_CACHE_BYTES)
+_users_cache = memo.MemoCache("users", max_entries=MAX_LEAGUE_ENTRIES)
+_user_stats_cache = memo.MemoCache("user_stats", max_entries=MAX_MANAGER_ENTRIES)
+_ranking_cache = memo.MemoCache("ranking", max_entries=MAX_MANAGER_ENTRIES)
+_battles_cache = memo.MemoCache("battles", max_entries=MAX_MANAGER_ENTRIES)
+_battle_index_cache = memo.MemoCache("battle_index", max_entries=MAX_LEAGUE_ENTRIES)
 
 
 def clear_caches() -> None:
     """### Empty the per-run API caches."""
+    _market_cache.clear()
+    _market_expiries.clear()
     _player_statistics_cache.clear()
     _player_marketvalue_cache.clear()
-    _transfers_cache.clear()
+    _users_cache.clear()
     _user_stats_cache.clear()
+    _ranking_cache.clear()
     _battles_cache.clear()
+    _battle_index_cache.clear()
 
     #miscellaneous.clear_caches()
 
 
-def get_league_list(token: str) -> list:
+def get_league_list(client: KickbaseClient) -> list:
     """Get a list of all leagues the user is in.
 
     Args:
-        user_token (str): The user token to authenticate the user.
+        client (KickbaseClient): The logged in API client.
 
     Returns:
         list: List of all leagues the user is in.
     """
-    url = "https://api.kickbase.com/v4/leagues/selection"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Cookie": f"kkstrauth={token};",
-    }
+    url = "/v4/leagues/selection"
 
     ### Send GET request
     try:
-        json_response = requests.get(url, headers=headers).json()
+        json_response = client.get(url).json()
     except:
         raise exceptions.KickbaseException("An exception was raised.") # TODO: Change
     
@@ -65,7 +103,8 @@ def get_league_list(token: str) -> list:
     return league_list
 
 
-def get_market(token: str, league_id: str):
+@memo.memoize(_market_cache)
+def get_market(client: KickbaseClient, league_id: str):
     """
     ### Get the current players on the market in the league
 
@@ -82,249 +121,336 @@ def get_market(token: str, league_id: str):
     ```
     Obviously the "it" list is filled with all players on the market.
     """
-    url = f"https://api.kickbase.com/v4/leagues/{league_id}/market"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Cookie": f"kkstrauth={token};",
-    }
+    global _market_value_update
+
+    url = f"/v4/leagues/{league_id}/market"
 
     ### Send GET request to get all free players in the given league
     try:
-        json_response = requests.get(url, headers=headers).json()
+        json_response = client.get(url).json()
     except:
         raise exceptions.NotificatonException("Notification failed! Please check your Discord Webhook URL.") # TODO: Change exception
     
+    ### Market value histories are cached until the next daily update, which is announced here
+    client.set_market_value_update(json_response.get("mvud"))
+    _market_value_update = json_response.get("mvud") or _market_value_update
+
     ### Create a new object for every entry in the json_response["it"] list.
     players_on_market = [Market_Players(player) for player in json_response["it"]]
+    player_profiles.observe(json_response["it"])
+
+    ### The expiry is sent as seconds left, so it only means something together with the time it was fetched
+    fetched_at = datetime.now(timezone.utc)
+    _market_expiries[league_id] = [fetched_at + timedelta(seconds=player.expiry)
+                                   for player in players_on_market if player.expiry is not None]
 
     return players_on_market
 
 
-def prefetch_players(token: str, league_id: str, player_ids) -> None:
-    """### Fetch statistics and market value history for many players at once.
+def market_events() -> tuple:
+    """### Get the market events seen by get_market() during this run.
+
+    Returns:
+        tuple: The next daily market value update as sent in "mvud" (str, or None if no
+            market was fetched yet), and when the listings on the fetched markets end
+            (list of timezone aware datetimes, earliest first).
+    """
+    expiries = sorted(expiry for league_expiries in _market_expiries.values() for expiry in league_expiries)
+    return _market_value_update, expiries
 
-    market_value_changes() needs both for every player (stats + market value) in the competition.
-    They run concurrently and fill the same caches the individual functions use.
+
+def prefetch_players(client: KickbaseClient, league_id: str, player_ids, refresh: bool = False) -> None:
+    """### Fetch the statistics of many players at once.
+
+    market_value_changes() needs them for every player in the competition.
+    They run concurrently and fill the same cache player_statistics() uses.
+    The market value histories are prefetched by backend.market_values.
 
     Args:
-        token (str): The user's kkstrauth token.
+        client (KickbaseClient): The logged in API client.
         league_id (str): The league to fetch statistics for.
         player_ids (iterable): The player IDs to fetch.
+        refresh (bool): Fetch every player not fetched during this run yet, see player_statistics().
     """
     ids = sorted({str(player_id) for player_id in player_ids})
 
-    missing_statistics = [p for p in ids if (league_id, p) not in _player_statistics_cache]
-    missing_marketvalues = [p for p in ids if p not in _player_marketvalue_cache]
+    if refresh:
+        missing_statistics = [p for p in ids if (league_id, p) not in _player_statistics_cache]
+    else:
+        missing_statistics = [p for p in ids if (league_id, p) not in _player_statistics_cache
+                              and player_profiles.stored(league_id, p) is None]
 
-    if not missing_statistics and not missing_marketvalues:
+    if not missing_statistics:
         return
 
-    logging.debug(f"Prefetching {len(missing_statistics)} player statistic(s) "
-                  f"and {len(missing_marketvalues)} market value history/histories...")
+    logging.debug(f"Prefetching {len(missing_statistics)} player statistic(s)...")
 
     with ThreadPoolExecutor(max_workers=MAX_PLAYER_WORKERS) as executor:
-        futures = [executor.submit(player_statistics, token, league_id, p)
+        futures = [executor.submit(player_statistics, client, league_id, p, refresh)
                    for p in missing_statistics]
-        futures += [executor.submit(player_marketvalue, token, p)
-                    for p in missing_marketvalues]
 
         ### Surface any exception rather than letting it disappear into the pool
         for future in futures:
             future.result()
 
 
-def player_statistics(token: str, league_id: str, player_id: str):
+def player_statistics(client: KickbaseClient, league_id: str, player_id: str, refresh: bool = False) -> Player_Profile:
     """
-    ### Get the statistics of a given player.
+    ### Get the statistics of a given player, as a compact Player_Profile.
+
+    A profile stored by backend.player_profiles is used as long as the player didn't
+    move since. `refresh` fetches the profile unless it was fetched during this run
+    already, e.g. for the ownership, which the stored profiles don't track.
     """
-    cache_key = (league_id, str(player_id))
-    if cache_key in _player_statistics_cache:
-        return _player_statistics_cache[cache_key]
+    player_id = str(player_id)
+    if not refresh and (league_id, player_id) not in _player_statistics_cache:
+        profile = player_profiles.stored(league_id, player_id)
+        if profile is not None:
+            return profile
 
-    url = f"https://api.kickbase.com/v4/competitions/1/players/{player_id}?leagueId={league_id}"
+    return _fetch_player_statistics(client, league_id, player_id)
+
+
+@memo.memoize(_player_statistics_cache)
+def _fetch_player_statistics(client: KickbaseClient, league_id: str, player_id: str) -> Player_Profile:
+    """### Fetch a player's profile and store it in backend.player_profiles."""
+    url = f"/v4/competitions/1/players/{player_id}?leagueId={league_id}"
     headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
         "Accept-Language": "de-DE,de;q=0.9", # localized for 'stxt' (status)
-        "Cookie": f"kkstrauth={token};",
     }
 
     ### Send GET request to get the market value changes of ALL players in the league
     try:
-        json_response = requests.get(url, headers=headers).json()
+        json_response = client.get(url, headers=headers).json()
     except:
         raise exceptions.NotificatonException("Notification failed! Please check your Discord Webhook URL.") # TODO: Change exception
 
-    _player_statistics_cache[cache_key] = json_response
+    profile = Player_Profile(json_response, league_id)
+    player_profiles.store(league_id, player_id, profile)
 
-    return json_response
+    return profile
 
 
-def player_marketvalue(token: str, player_id: str):
+@memo.memoize(_player_marketvalue_cache, key=lambda client, player_id, days=365: (str(player_id), days))
+def player_marketvalue(client: KickbaseClient, player_id: str, days: int = 365):
     """
     ### Get the market value history of a given player.
-    """
-    cache_key = str(player_id)
-    if cache_key in _player_marketvalue_cache:
-        return _player_marketvalue_cache[cache_key]
 
-    url_1year = f"https://api.kickbase.com/v4/competitions/1/players/{player_id}/marketValue/365"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Cookie": f"kkstrauth={token};",
-    }
+    Usually read through backend.market_values, which keeps the histories between runs
+    and only asks for the last few days.
+
+    Args:
+        client (KickbaseClient): The logged in API client.
+        player_id (str): The player ID.
+        days (int): How many days back the history should reach.
+
+    Returns:
+        list: One entry per day, oldest first, each with the day number in "dt" and the value in "mv".
+    """
+    url = f"/v4/competitions/1/players/{player_id}/marketValue/{days}"
 
     ### Send GET request to get the market value changes of ALL players in the league
     try:
-        json_response = requests.get(url_1year, headers=headers).json()
+        json_response = client.get(url).json()
     except:
         raise exceptions.NotificatonException("Notification failed! Please check your Discord Webhook URL.") # TODO: Change exception
 
-    _player_marketvalue_cache[cache_key] = json_response["it"]
-
     return json_response["it"] ### Only return the "it" list
 
 
-def get_users(token: str, league_id: str):
+@memo.memoize(_users_cache)
+def get_users(client: KickbaseClient, league_id: str):
     """
     ### Get all users and their IDs in the lague.
     """
-    url = f"https://api.kickbase.com/v4/leagues/{league_id}/overview?includeManagersAndBattles=true"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Cookie": f"kkstrauth={token};",
-    }
+    url = f"/v4/leagues/{league_id}/overview?includeManagersAndBattles=true"
 
     ### Send GET request to get the market value changes of ALL players in the league
     try:
-        json_response = requests.get(url, headers=headers).json()
+        json_response = client.get(url).json()
     except:
         raise exceptions.NotificatonException("Notification failed! Please check your Discord Webhook URL.") # TODO: Change exception
     
     ### Create a dictionary to map user IDs to user names
     user_id_to_name = {user["i"]: user["n"] for user in json_response["us"]}
     miscellaneous.write_json_to_file(user_id_to_name, "STATIC_users.json")
-    
+
     return json_response["us"] ### Only return the "us" list which contains alls usernames and IDs
 
 
-def transfers(token: str, league_id: str) -> dict:
-    """### Get all transfers of all users in a league.
+def transfers(client: KickbaseClient, league_id: str, known_ids: set = None, cutoff: datetime = None,
+              page_size: int = FEED_PAGE_SIZE) -> list:
+    """### Get the transfers of all users in a league from the activity feed.
+
+    The feed is paged newest first. With `known_ids` the pages are read one by one, and
+    paging stops after the first page whose transfers were all seen before, since
+    everything after it is older still. Without them the whole feed is needed, so
+    FEED_WINDOW pages are requested at once (see `_read_feed_concurrently()`). Either
+    way paging stops at the first empty page, or once a page reaches past `cutoff`.
+
+    Not cached: backend.feed_ledger keeps the merged result for the rest of the run.
 
     Args:
-        token (str): The user's kkstrauth token.
+        client (KickbaseClient): The logged in API client.
         league_id (str): The league ID.
+        known_ids (set): IDs ("i") of the transfers already in the ledger, for an incremental sync.
+        cutoff (datetime): Timezone aware instant before which transfers are not needed.
+        page_size (int): How many feed items to ask for per page.
 
     Returns:
-        dict: A dictionary containing the user's players.
+        list: The transfer items ("t" == 15) of every fetched page, newest first.
     """
-    if league_id in _transfers_cache:
-        return _transfers_cache[league_id]
+    if known_ids is None:
+        pages = _read_feed_concurrently(client, league_id, page_size, cutoff)
+    else:
+        pages = _read_feed_until_known(client, league_id, page_size, cutoff, known_ids)
+
+    ### Filter transfers where "t" == 15
+    return [entry for page in pages for entry in page if entry.get("t") == 15]
 
+
+def _feed_page(client: KickbaseClient, league_id: str, start: int, page_size: int) -> list:
+    """### Get one page of the activity feed. Empty once `start` is past the end of the feed."""
+    query_params = f"?max={page_size}&start={start}"
+    url = f"/v4/leagues/{league_id}/activitiesFeed/{query_params}"
+
+    try:
+        response = client.get(url)
+        ### An error response has no "af" either, it must not read as the end of the feed
+        response.raise_for_status()
+        json_response = response.json()
+    except Exception as e:
+        raise exceptions.NotificatonException(f"Notification failed! Please check your Discord Webhook URL. Error: {e}") # TODO: Change exception
+
+    return json_response.get("af") or []
+
+
+def _past_cutoff(page: list, cutoff: datetime) -> bool:
+    """### Whether the oldest item of a page is from before the cutoff."""
+    return cutoff is not None and miscellaneous.parse_feed_timestamp(page[-1]["dt"]) < cutoff
+
+
+def _read_feed_until_known(client: KickbaseClient, league_id: str, page_size: int, cutoff: datetime, known_ids: set) -> list:
+    """### Read the feed page by page until it reaches transfers in `known_ids`."""
+    pages = []
     start_point = 0
-    user_transfers = []
 
     while True:
-        query_params = f"?max=26&start={start_point}"
-        url = f"https://api.kickbase.com/v4/leagues/{league_id}/activitiesFeed/{query_params}"
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-            "Cookie": f"kkstrauth={token};",
-        }
-
-        ### Send GET request to get the next 26 entries
-        try:
-            json_response = requests.get(url, headers=headers).json()
-        except Exception as e:
-            raise exceptions.NotificatonException(f"Notification failed! Please check your Discord Webhook URL. Error: {e}") # TODO: Change exception
-
-        ### Filter transfers where "t" == 15
-        filtered_transfers = [entry for entry in json_response.get("af", []) if entry.get("t") == 15]
-        user_transfers += filtered_transfers
+        page = _feed_page(client, league_id, start_point, page_size)
 
         ### Check if there are more entries to fetch
-        if not json_response.get("af"):
+        if not page:
+            break
+        pages.append(page)
+        start_point += len(page)
+
+        ### Incremental sync: this page brought nothing new, so neither will the older ones
+        page_transfers = [entry for entry in page if entry.get("t") == 15]
+        if page_transfers and all(entry["i"] in known_ids for entry in page_transfers):
+            logging.debug(f"Activity feed caught up with the ledger after {start_point} entries.")
             break
 
-        start_point += 26
+        if _past_cutoff(page, cutoff):
+            logging.debug(f"Activity feed reached past the cutoff after {start_point} entries.")
+            break
+
+    return pages
+
 
-    _transfers_cache[league_id] = user_transfers
+def _read_feed_concurrently(client: KickbaseClient, league_id: str, page_size: int, cutoff: datetime) -> list:
+    """### Read the whole feed, FEED_WINDOW pages at a time.
 
-    return user_transfers
+    The end of the feed only shows as an empty page, so the offsets are requested
+    speculatively in windows. Pages after the first empty one are thrown away, and
+    requests for them that haven't started yet are cancelled.
 
+    The server may send fewer items than `page_size` asks for, so the first page is
+    fetched on its own and its length is used as the step between offsets.
 
-def user_stats(token: str, league_id: str, user_id: str) -> dict:
+    Returns:
+        list: The pages up to the end of the feed, in feed order.
+    """
+    first_page = _feed_page(client, league_id, 0, page_size)
+    if not first_page:
+        return []
+
+    pages = [first_page]
+    stride = len(first_page)
+    start_point = stride
+    done = _past_cutoff(first_page, cutoff)
+
+    with ThreadPoolExecutor(max_workers=FEED_WINDOW) as executor:
+        while not done:
+            futures = [executor.submit(_feed_page, client, league_id, start_point + k * stride, page_size)
+                       for k in range(FEED_WINDOW)]
+
+            ### 'futures' is in offset order, so pages are reassembled in feed order
+            for future in futures:
+                page = future.result() if not done else None
+                if not page:
+                    done = True
+                    future.cancel()
+                    continue
+
+                pages.append(page)
+                done = _past_cutoff(page, cutoff)
+
+            start_point += FEED_WINDOW * stride
+
+    logging.debug(f"Read {sum(len(page) for page in pages)} activity feed entries in {len(pages)} page(s).")
+
+    return pages
+
+
+@memo.memoize(_user_stats_cache, key=lambda client, league_id, user_id: (league_id, str(user_id)))
+def user_stats(client: KickbaseClient, league_id: str, user_id: str) -> dict:
     """
     Get the statistics of a given user in the given league.
     """
-    cache_key = (league_id, str(user_id))
-    if cache_key in _user_stats_cache:
-        return _user_stats_cache[cache_key]
-
-    url = f"https://api.kickbase.com/v4/leagues/{league_id}/managers/{user_id}/dashboard"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Cookie": f"kkstrauth={token};",
-    }
+    url = f"/v4/leagues/{league_id}/managers/{user_id}/dashboard"
 
     ### Send GET request to get the statistics of a given user in the given league
     try:
-        json_response = requests.get(url, headers=headers).json()
+        json_response = client.get(url).json()
     except:
         raise exceptions.NotificatonException("Notification failed! Please check your Discord Webhook URL.") ### TODO: Change exception
 
-    _user_stats_cache[cache_key] = json_response
-
     return json_response
 
 
-def user_performance(token: str, league_id: str, user_id: str) -> dict:
+def user_performance(client: KickbaseClient, league_id: str, user_id: str) -> dict:
     """
     Get the performance of a given user in the given league.
     """
-    url = f"https://api.kickbase.com/v4/leagues/{league_id}/managers/{user_id}/performance"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Cookie": f"kkstrauth={token};",
-    }
+    url = f"/v4/leagues/{league_id}/managers/{user_id}/performance"
 
     ### Send GET request to get the statistics of a given user in the given league
     try:
-        json_response = requests.get(url, headers=headers).json()
+        json_response = client.get(url).json()
     except:
         raise exceptions.NotificatonException("Notification failed! Please check your Discord Webhook URL.") ### TODO: Change exception
     
     return json_response
 
 
-def ranking(token: str, league_id: str, match_day: int) -> dict:
+@memo.memoize(_ranking_cache)
+def ranking(client: KickbaseClient, league_id: str, match_day: int) -> dict:
     """
     ### Get the ranking of the league.
     """
     query_params = f"?dayNumber={match_day}"
-    url = f"https://api.kickbase.com/v4/leagues/{league_id}/ranking/{query_params}"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Cookie": f"kkstrauth={token};",
-    }
+    url = f"/v4/leagues/{league_id}/ranking/{query_params}"
 
     ### Send GET request to get the ranking of the league
     try:
-        json_response = requests.get(url, headers=headers).json()
+        json_response = client.get(url).json()
     except:
         raise exceptions.NotificatonException("Notification failed! Please check your Discord Webhook URL.") ### TODO: Change exception
-    
+
     return json_response
 
 
-def live_points(token: str, league_id: str) -> dict:
+def live_points(client: KickbaseClient, league_id: str) -> dict:
     """
     ### Get the live points of all users in the given league.
 
@@ -347,43 +473,79 @@ def live_points(token: str, league_id: str) -> dict:
     Kickbase has no v4 equivalent implemented here yet. The live points feature is
     on-hold, so this call is unverified against the current API.
     """
-    url = f"https://api.kickbase.com/leagues/{league_id}/live"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Cookie": f"kkstrauth={token};",
-    }
+    url = f"/leagues/{league_id}/live"
 
     ### Send GET request to get the live points of the league
     try:
-        json_response = requests.get(url, headers=headers).json()
+        json_response = client.get(url).json()
     except:
         raise exceptions.KickbaseException("Couldn't get the live points of the league.")
 
     return json_response
 
 
-def battles(token: str, league_id: str, battle_id: int) -> dict:
+@memo.memoize(_battles_cache)
+def battles(client: KickbaseClient, league_id: str, battle_id: int) -> dict:
     """
     ### Get the battles of the league.
     """
-    cache_key = (league_id, battle_id)
-    if cache_key in _battles_cache:
-        return _battles_cache[cache_key]
-
-    url = f"https://api.kickbase.com/v4/leagues/{league_id}/battles/{battle_id}/users"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Cookie": f"kkstrauth={token};",
-    }
+    url = f"/v4/leagues/{league_id}/battles/{battle_id}/users"
 
     ### Send GET request to get the battles of the league
     try:
-        json_response = requests.get(url, headers=headers).json()
+        json_response = client.get(url).json()
     except:
         raise exceptions.NotificatonException("Notification failed! Please check your Discord Webhook URL.") ### TODO: Change exception
 
-    _battles_cache[cache_key] = json_response
+    return json_response
+
+
+def prefetch_dashboards(client: KickbaseClient, league_id: str, user_ids, battle_types=BATTLE_TYPES) -> None:
+    """### Fetch the dashboards of many managers and the given battles at once.
+
+    balances() and league_user_stats_tables() need a dashboard for every manager.
+    They run concurrently and fill the same caches user_stats() and battles() use.
+
+    Args:
+        client (KickbaseClient): The logged in API client.
+        league_id (str): The league to fetch dashboards for.
+        user_ids (iterable): The user IDs to fetch.
+        battle_types (iterable): The battle types to fetch.
+    """
+    missing_users = sorted(user_id for user_id in {str(user_id) for user_id in user_ids}
+                           if (league_id, user_id) not in _user_stats_cache)
+    missing_battles = [battle_type for battle_type in battle_types if (league_id, battle_type) not in _battles_cache]
 
-    return json_response
\ No newline at end of file
+    if not missing_users and not missing_battles:
+        return
+
+    logging.debug(f"Prefetching {len(missing_users)} dashboard(s) and {len(missing_battles)} battle(s)...")
+
+    with ThreadPoolExecutor(max_workers=MAX_DASHBOARD_WORKERS) as executor:
+        futures = [executor.submit(user_stats, client, league_id, user_id) for user_id in missing_users]
+        futures += [executor.submit(battles, client, league_id, battle_type) for battle_type in missing_battles]
+
+        ### Surface any exception rather than letting it disappear into the pool
+        for future in futures:
+            future.result()
+
+
+@memo.memoize(_battle_index_cache, key=lambda client, league_id, battle_types=BATTLE_TYPES: (league_id, tuple(battle_types)))
+def battle_index(client: KickbaseClient, league_id: str, battle_types=BATTLE_TYPES) -> dict:
+    """
+    ### Get the value of every manager in the given battles, indexed by battle type and user.
+
+    Args:
+        client (KickbaseClient): The logged in API client.
+        league_id (str): The league ID.
+        battle_types (iterable): The battle types to index.
+
+    Returns:
+        dict: {battle_type: {user_id: value}}. Managers missing from a battle are missing here too.
+    """
+    prefetch_dashboards(client, league_id, [], battle_types)
+
+    return {
+        battle_type: {entry["u"]["i"]: entry["v"] for entry in battles(client, league_id, battle_type)["us"]}
+        for battle_type in battle_types
+    }
@@ -4,18 +4,21 @@
 TODO: Maybe list all functions here automatically?
 """
 
-import requests
-
 from backend import exceptions, miscellaneous
+from backend.kickbase.client import KickbaseClient
 from backend.kickbase.endpoints.user import User
 
 ### -------------------------------------------------------------------
 
 
-def login(email: str, password: str, discord_webhook: str) -> tuple:
+def login(client: KickbaseClient, email: str, password: str, discord_webhook: str) -> tuple:
     """### Logs in the user with the provided email and password.
 
+    On success the token is stored on the client, so every later call made through it
+    is authenticated.
+
     Args:
+        client (KickbaseClient): The API client to log in with.
         email (str): The email of the user.
         password (str): The password of the user.
         discord_webhook (str): The Discord webhook URL to send a notification in case of an error.
@@ -26,11 +29,7 @@ def login(email: str, password: str, discord_webhook: str) -> tuple:
     Returns:
         tuple: A tuple containing the user info and token.
     """
-    url = "https://api.kickbase.com/v4/user/login"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
+    url = "/v4/user/login"
     payload = {
         "em": email,
         "pass": password,
@@ -41,7 +40,7 @@ def login(email: str, password: str, discord_webhook: str) -> tuple:
 
     ### Try to login with the given credentials via POST request
     try:
-        json_response = requests.post(url, json=payload, headers=headers).json() # Save response as json
+        json_response = client.post(url, json=payload).json() # Save response as json
     except:
         miscellaneous.discord_notification("Login failed!", "Please check your credentials.", 16711680, discord_webhook)
         raise exceptions.LoginException("[CRITICAL] Login failed! Please check your credentials.")
@@ -50,30 +49,26 @@ def login(email: str, password: str, discord_webhook: str) -> tuple:
     user = User(json_response["u"])
     ### Save the token
     token = json_response["tkn"]
+    client.token = token
 
     ### TODO: Set return type
     return user, token
 
 
-def collect_gift(token: str) -> dict:
+def collect_gift(client: KickbaseClient) -> dict:
     """### Collects the current gift of the user in every league.
 
     Args:
-        token (str): The token of the user.
+        client (KickbaseClient): The logged in API client.
 
     Returns:
         dict: The response of the API call.
     """
-    url = "https://api.kickbase.com/v4/bonus/collect"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Cookie": f"kkstrauth={token};",
-    }
+    url = "/v4/bonus/collect"
 
     ### Send GET request to get the current gift
     try:
-        json_response = requests.get(url, headers=headers).json()
+        json_response = client.get(url).json()
     except:
         raise exceptions.NotificatonException("Notification failed! Please check your Discord Webhook URL.") # TODO: Change exception
     
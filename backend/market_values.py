@@ -0,0 +1,197 @@
+"""
+### This module keeps the market value history of every player between runs.
+
+Kickbase only offers a player's market values as a history reaching back a given
+number of days, and only the last day or two of it are ever new. Instead of the full
+365 days per player on every run, the history is kept in the cache directory and a
+run only asks for a short recent window to merge into it. A player is backfilled with
+a longer window when they are new or when their history has a gap. A player already
+synced today is skipped while their history still ends with the market value the team
+profiles and the market list for them, see backend.player_profiles.
+
+Market values are indexed by the Kickbase day number ("dt", days since 1970-01-01).
+"""
+
+import logging
+import threading
+
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from backend import miscellaneous, player_profiles
+from backend.kickbase.client import KickbaseClient
+from backend.kickbase.v4 import leagues
+
+### -------------------------------------------------------------------
+
+STORE_FILE = "market_values.json"
+
+### How far back a history reaches. market_value_deltas() needs 31 days, the START_DATE
+## lookups need the start of the season.
+HISTORY_DAYS = 365
+### The windows a history is fetched with, shortest first. The shortest one covering
+## everything missing is used.
+FETCH_WINDOWS = (7, 30, 92, HISTORY_DAYS)
+
+MAX_MARKET_VALUE_WORKERS = 8
+
+### {player_id: {day_number: market_value}} and {player_id: day_number of the last sync}, loaded on first use
+_store = None
+_synced_on = None
+### Players already synced during this run
+_synced = set()
+_dirty = False
+_lock = threading.Lock()
+
+
+def clear_cache() -> None:
+    """### Sync every player again on their next use. The stored histories are kept."""
+    _synced.clear()
+
+
+def _today() -> int:
+    return miscellaneous.date_to_julian(datetime.now(timezone.utc))
+
+
+def _load() -> dict:
+    global _store, _synced_on
+
+    with _lock:
+        if _store is None:
+            raw = miscellaneous.read_cache_file(STORE_FILE, {})
+            _store = {player_id: {day: value for day, value in series}
+                      for player_id, series in raw.get("values", {}).items()}
+            _synced_on = raw.get("synced_on", {})
+            logging.debug(f"Loaded the market value histories of {len(_store)} player(s).")
+    return _store
+
+
+def save() -> None:
+    """### Write the histories to the cache directory, if anything changed."""
+    global _dirty
+
+    with _lock:
+        if _store is None or not _dirty:
+            return
+        data = {
+            "synced_on": dict(_synced_on),
+            "values": {player_id: sorted(series.items()) for player_id, series in _store.items()},
+        }
+        _dirty = False
+        miscellaneous.write_cache_file(data, STORE_FILE)
+
+
+def _missing_window(player_id: str, today: int) -> int:
+    """### The shortest fetch window that covers every day since the player's last sync."""
+    last_sync = _synced_on.get(player_id)
+
+    if last_sync is None or player_id not in _store:
+        return HISTORY_DAYS
+
+    ### The day of the last sync is fetched again, it may have been before that day's update
+    ## Runs that were skipped for a while leave a gap, which the window grows to cover
+    needed = today - last_sync + 1
+    return next((window for window in FETCH_WINDOWS if window >= needed), HISTORY_DAYS)
+
+
+def _up_to_date(player_id: str, today: int) -> bool:
+    """### Check whether a player was synced today and their history still ends with their current market value."""
+    series = _store.get(player_id)
+    if not series or _synced_on.get(player_id) != today:
+        return False
+    return series[max(series)] == player_profiles.market_value(player_id)
+
+
+def _sync_player(client: KickbaseClient, player_id: str) -> None:
+    """### Fetch what is missing from one player's history and merge it in."""
+    global _dirty
+
+    store = _load()
+    today = _today()
+
+    if _up_to_date(player_id, today):
+        with _lock:
+            _synced.add(player_id)
+        return
+
+    series = dict(store.get(player_id) or {})
+
+    window = _missing_window(player_id, today)
+    recent = leagues.player_marketvalue(client, player_id, window)
+
+    ### If the short window came back empty, fall back to the full history
+    if not recent and window != HISTORY_DAYS:
+        logging.debug(f"No market values in the last {window} day(s) for player {player_id}, backfilling.")
+        recent = leagues.player_marketvalue(client, player_id, HISTORY_DAYS)
+
+    series.update({entry["dt"]: entry["mv"] for entry in recent})
+
+    ### Forget what is older than the history is meant to reach
+    oldest_wanted = today - HISTORY_DAYS + 1
+    series = {day: value for day, value in series.items() if day >= oldest_wanted}
+
+    with _lock:
+        store[player_id] = series
+        _synced_on[player_id] = today
+        _synced.add(player_id)
+        _dirty = True
+
+
+def prefetch(client: KickbaseClient, player_ids) -> None:
+    """### Sync the histories of many players at once.
+
+    Args:
+        client (KickbaseClient): The logged in API client.
+        player_ids (iterable): The player IDs to sync.
+    """
+    _load()
+    missing = sorted({str(player_id) for player_id in player_ids} - _synced)
+
+    if not missing:
+        return
+
+    logging.debug(f"Syncing {len(missing)} market value history/histories...")
+
+    with ThreadPoolExecutor(max_workers=MAX_MARKET_VALUE_WORKERS) as executor:
+        futures = [executor.submit(_sync_player, client, player_id) for player_id in missing]
+
+        ### Surface any exception rather than letting it disappear into the pool
+        for future in futures:
+            future.result()
+
+
+def history(client: KickbaseClient, player_id: str) -> list:
+    """### Get the market value history of a player.
+
+    Args:
+        client (KickbaseClient): The logged in API client.
+        player_id (str): The player ID.
+
+    Returns:
+        list: One entry per day, oldest first, each with the day number in "dt" and the
+            value in "mv". The same shape as leagues.player_marketvalue().
+    """
+    player_id = str(player_id)
+    if player_id not in _synced:
+        _sync_player(client, player_id)
+
+    series = _load().get(player_id) or {}
+    return [{"dt": day, "mv": series[day]} for day in sorted(series)]
+
+
+def value_on(client: KickbaseClient, player_id: str, day: int):
+    """### Get a player's market value on one day.
+
+    Args:
+        client (KickbaseClient): The logged in API client.
+        player_id (str): The player ID.
+        day (int): The Kickbase day number, see miscellaneous.date_to_julian().
+
+    Returns:
+        int: The market value on that day, or None if the history has none for it.
+    """
+    player_id = str(player_id)
+    if player_id not in _synced:
+        _sync_player(client, player_id)
+
+    return (_load().get(player_id) or {}).get(day)
@@ -7,11 +7,11 @@ TODO: Maybe list all functions here automatically?
 import requests
 import json
 import logging
+import tempfile
 
-import pandas as pd
-from datetime import datetime, timedelta, timezone
-from os import getenv, path, makedirs
-from backend.paths import DATA_DIR, TIMESTAMP_DIR
+from datetime import date, datetime, timedelta, timezone
+from os import getenv, path, makedirs, replace, remove, fdopen
+from backend.paths import CACHE_DIR, data_dir, timestamp_dir
 
 from backend import exceptions
 
@@ -82,55 +82,23 @@ def discord_notification(title: str, message: str, color: int, webhook_url: str)
         raise exceptions.NotificatonException("Notification failed! Please check your Discord Webhook URL.")
 
 
-def calculate_revenue_data_daily(turnovers: dict) -> None:
+def calculate_revenue_data_daily(turnovers: list) -> None:
     """### Calculate daily revenue data.
 
     Args:
-        turnovers (dict): A dictionary containing all buy-sell pairs.
+        turnovers (list): All buy-sell pairs.
     """
     logging.info("Calculating daily revenue data...")
 
     ### Load STATIC_users.json
-    with open(path.join(DATA_DIR, "STATIC_users.json"), "r") as f:
+    with open(path.join(data_dir(), "STATIC_users.json"), "r") as f:
         league_users = json.load(f)
 
-    ### Create an empty dict with all user names as keys
-    user_transfer_revenue = {user_name: [] for user_name in league_users.values()}
+    ### The graph starts at START_DATE and ends today, both as UTC days
+    first_day = get_start_datetime().date()
+    last_day = datetime.now(timezone.utc).date()
 
-    ### This loop iterates over each buy-sell pair in the turnovers list. It calculates the revenue by subtracting the buy value from the sell value.
-    ### The revenue and the date of the sell transfer are then appended to the corresponding user's list in user_transfer_revenue.
-    
-    for buy, sell in turnovers:
-        revenue = sell["price"] - buy["price"]
-        if buy["user"] in league_users.values():
-            user_transfer_revenue[buy["user"]].append((revenue, sell["date"]))
-
-    ### Add start and end points for the graph
-    ## Both are timezone aware UTC
-    for _, data in user_transfer_revenue.values():
-        data.append((0, get_start_datetime()))
-        data.append((0, datetime.now(timezone.utc)))
-
-    ### This section converts the data in user_transfer_revenue into Pandas DataFrames.
-    ### It performs operations to aggregate daily revenues and calculates cumulative sums.
-    ### The resulting DataFrames are stored in the dataframes dictionary.
-    dataframes = {}
-    for user, data in user_transfer_revenue.items():
-        df = pd.DataFrame(data, columns=["revenue", "date"])
-        df["date"] = pd.to_datetime(df["date"], utc=True)
-        df = df.groupby(pd.Grouper(key="date", freq="D"))["revenue"] \
-            .sum().reset_index().sort_values("date")
-        df["revenue"] = df["revenue"].cumsum()
-        df["date"] = df["date"].dt.strftime("%Y-%m-%d")
-
-        dataframes[user] = df
-
-    ### Here, the data is formatted into a dictionary called data.
-    ### Each user's name is a key, and the corresponding value is a list of tuples containing revenue and date information
-    data = {user_name: [] for user_name in league_users.values()}
-    for user, df in dataframes.items():
-        for entry in df.to_numpy().tolist():
-            data[user].append((entry[0], entry[1]))
+    data = daily_cumulative_revenue(turnovers, league_users.values(), first_day, last_day)
 
     logging.info("Calculated daily revenue data.")
 
@@ -139,6 +107,83 @@ def calculate_revenue_data_daily(turnovers: dict) -> None:
     write_json_to_file({"time": datetime.now().isoformat()}, "ts_revenue_sum.json")
 
 
+def daily_cumulative_revenue(turnovers: list, user_names, first_day: date, last_day: date) -> dict:
+    """### Sum up the revenue of every user per UTC day and accumulate it over time.
+
+    One pass over all turnovers buckets the revenue (sell price minus buy price) by
+    user and by the day of the sale. Every day from first_day to last_day gets an
+    entry, also days without a sale, so the graph has no gaps.
+
+    Args:
+        turnovers (list): All buy-sell pairs.
+        user_names (iterable): The users to calculate the revenue for. Pairs of other users are ignored.
+        first_day (date): The first day of every series.
+        last_day (date): The last day of every series. Sales after it extend the series.
+
+    Returns:
+        dict: {user_name: [("YYYY-MM-DD", cumulative revenue), ...]}, one entry per day, oldest first.
+    """
+    revenue_per_day = {user_name: {} for user_name in user_names}
+
+    for buy, sell in turnovers:
+        user_days = revenue_per_day.get(buy["user"])
+        if user_days is None:
+            continue
+        day = parse_feed_timestamp(sell["date"]).date()
+        user_days[day] = user_days.get(day, 0) + sell["price"] - buy["price"]
+
+    data = {}
+    for user_name, user_days in revenue_per_day.items():
+        ### A single float price turns the whole series into floats
+        as_float = any(isinstance(revenue, float) for revenue in user_days.values())
+
+        day = min(first_day, *user_days)
+        end = max(last_day, *user_days)
+        cumulative = 0
+        series = []
+        while day <= end:
+            cumulative += user_days.get(day, 0)
+            series.append((day.isoformat(), float(cumulative) if as_float else cumulative))
+            day += timedelta(days=1)
+
+        data[user_name] = series
+
+    return data
+
+
+def pair_transfers(transfers: list) -> tuple:
+    """### Pair every buy with the next sell of the same player.
+
+    One backwards pass over the transfers keeps the next sell of every player, so each
+    buy finds its sell in constant time instead of scanning the transfers after it.
+    A transfer of unknown type counts as both, and is paired with itself.
+
+    Args:
+        transfers (list): The transfers of turnovers(), oldest first, each with "type" and "playerId".
+
+    Returns:
+        tuple: The (buy, sell) pairs in the order of the buys, and the sells no buy was
+            paired with, in the order of the transfers.
+    """
+    next_sell = {}
+    pairs = []
+
+    for transfer in reversed(transfers):
+        if transfer["type"] != "buy":
+            next_sell[transfer["playerId"]] = transfer
+        if transfer["type"] != "sell" and transfer["playerId"] in next_sell:
+            pairs.append((transfer, next_sell[transfer["playerId"]]))
+
+    pairs.reverse()
+
+    ### The transfers are unique, so a sell is matched by identity
+    paired_sells = {id(sell) for _, sell in pairs}
+    unpaired_sells = [transfer for transfer in transfers
+                      if transfer["type"] != "buy" and id(transfer) not in paired_sells]
+
+    return pairs, unpaired_sells
+
+
 def get_player_owner(player_stats: dict, league_id: str) -> dict:
     """### Find out which manager owns a player in the given league.
 
@@ -275,17 +320,17 @@ def write_json_to_file(data, file_name: str) -> None:
         file_name (str): file name
     """
     ### Make sure the data directories exist, since app.py can write files before main.py ever ran
-    makedirs(TIMESTAMP_DIR, exist_ok=True)
+    makedirs(timestamp_dir(), exist_ok=True)
 
     ### Check if it is a data or timestamp file
     try:
         if file_name.startswith("ts_"):
-            file_path = path.join(TIMESTAMP_DIR, file_name)
+            file_path = path.join(timestamp_dir(), file_name)
             with open(file_path, "w") as f:
                 json.dump(data, f)
             logging.debug(f"Created timestamp file {file_name}")
         else:
-            file_path = path.join(DATA_DIR, file_name)
+            file_path = path.join(data_dir(), file_name)
             with open(file_path, "w") as f:
                 json.dump(data, f, indent=2)
             logging.debug(f"Created file {file_name}")
@@ -293,6 +338,59 @@ def write_json_to_file(data, file_name: str) -> None:
         logging.error(f"Failed to write JSON to {file_path}: {e}")
 
 
+def read_cache_file(file_name: str, default=None):
+    """### Read a JSON state file from the cache directory.
+
+    These files hold what the backend remembers between runs. A missing or broken file
+    is not an error, the state is simply built again from scratch.
+
+    Args:
+        file_name (str): file name, relative to the cache directory
+        default (any): returned if the file is missing or unreadable
+
+    Returns:
+        any: The file's content, or the default.
+    """
+    file_path = path.join(CACHE_DIR, file_name)
+
+    if not path.exists(file_path):
+        return default
+
+    try:
+        with open(file_path, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logging.warning(f"Ignoring unreadable cache file {file_name}: {e}")
+        return default
+
+
+def write_cache_file(data, file_name: str) -> None:
+    """### Write a JSON state file to the cache directory.
+
+    The file is written to a temporary file of its own next to the old one first and then
+    swapped in, so a run that dies halfway never leaves a truncated file behind and
+    writers in different threads don't share a temporary file.
+
+    Args:
+        data (any): data to be written to the file
+        file_name (str): file name, relative to the cache directory
+    """
+    file_path = path.join(CACHE_DIR, file_name)
+    makedirs(path.dirname(file_path), exist_ok=True)
+
+    temp_path = None
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=path.dirname(file_path), prefix=path.basename(file_path) + ".", suffix=".tmp")
+        with fdopen(fd, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        replace(temp_path, file_path)
+        logging.debug(f"Updated cache file {file_name}")
+    except Exception as e:
+        logging.error(f"Failed to write cache file {file_path}: {e}")
+        if temp_path is not None and path.exists(temp_path):
+            remove(temp_path)
+
+
 def julian_to_date(julian_date: int) -> str:
     """Convert a Julian date to a standard date format (YYYY-MM-DD)."""
     reference_date = datetime(1970, 1, 1)
@@ -300,28 +398,11 @@ def julian_to_date(julian_date: int) -> str:
     return converted_date.strftime("%d.%m.%Y")
 
 
-def get_profilepic(user_id: str) -> str:
-    """### Get the profile picture of a user.
+def date_to_julian(date: datetime) -> int:
+    """Convert a date to the Julian day number Kickbase uses for market values (days since 1970-01-01).
 
-    Args:
-        user_id (str): The user ID.
-
-    Returns:
-        str: The URL of the profile picture.
+    A timezone aware datetime is converted to UTC first, so this is the inverse of julian_to_date().
     """
-    url = f"https://cdn.kickbase.com/files/users/{user_id}/0"
-    headers = {
-        "Content-Type": "image/jpeg",
-    }
-
-    ### Send GET request to get the profile picture
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.url # Profile pic is set
-        elif response.status_code == 404:
-            return None # Profile pic is not set
-        else:
-            response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        raise exceptions.NotificatonException("Notification failed! Please check your Discord Webhook URL.") from e
\ No newline at end of file
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc)
+    return (date.date() - datetime(1970, 1, 1).date()).days
@@ -0,0 +1,164 @@
+"""
+### This module keeps track of which manager owns which player in a league.
+
+A player's profile tells who owns them ("opl"), but asking every profile costs one
+request per player of the competition. Ownership only ever changes through transfers,
+which are all in the activity feed, and at the start of the season. So the owners are
+read from the profiles once, kept in the cache directory, and from then on updated by
+replaying the transfers that are new in the transfer ledger:
+
+- a buy from Kickbase ("byr" only) or from another manager ("slr" and "byr") makes the
+  buyer the owner, if they are a manager of the league,
+- a sell to Kickbase ("slr" only) or a buy by anyone else frees the player.
+
+Players the index doesn't know yet, e.g. after a winter transfer, are read from their
+profiles. On every run SPOT_CHECK_SIZE players, those checked longest ago, are compared
+with their profiles. A mismatch is corrected. More than MAX_SPOT_CHECK_MISMATCHES of them
+mean the index went wrong, e.g. because a manager left the league, and it is read from
+the profiles again.
+"""
+
+import time
+import logging
+import threading
+
+from backend import feed_ledger, miscellaneous, user_directory
+from backend.kickbase.client import KickbaseClient
+from backend.kickbase.v4 import leagues
+
+### -------------------------------------------------------------------
+
+### How many players are compared with their profiles on every run
+SPOT_CHECK_SIZE = 20
+### More mismatches than this in one spot check rebuild the whole index
+MAX_SPOT_CHECK_MISMATCHES = 2
+
+### {league_id: {player_id: owner entry or None}} of the leagues synced during this run
+_owners_cache = {}
+### {league_id: threading.Lock}, so leagues sync at the same time but each one only once
+_league_locks = {}
+_lock = threading.Lock()
+
+
+def clear_cache() -> None:
+    """### Sync every league again on its next use. The stored index is kept."""
+    _owners_cache.clear()
+
+
+def _index_file(league_id: str) -> str:
+    return f"ownership_{league_id}.json"
+
+
+def _read_profiles(client: KickbaseClient, league_id: str, player_ids: list) -> dict:
+    """### Read the owners of the given players from their current profiles, all at once."""
+    leagues.prefetch_players(client, league_id, player_ids, refresh=True)
+    return {player_id: leagues.player_statistics(client, league_id, player_id, True).owner for player_id in player_ids}
+
+
+def _replay(owners: dict, transfers: list, directory) -> None:
+    """### Apply transfers, oldest first, to the owners."""
+    for transfer in transfers:
+        data = transfer["data"]
+
+        if "byr" in data:
+            buyer_id = directory.id_of(data["byr"])
+            ### Like "opl", only managers of the league own players. Anyone else leaves them free
+            owners[data["pi"]] = {"oui": buyer_id, "onm": data["byr"]} if buyer_id is not None else None
+        elif "slr" in data:
+            owners[data["pi"]] = None
+
+
+def _spot_check(client: KickbaseClient, league_id: str, owners: dict, checked: dict, player_ids: list) -> int:
+    """### Compare the players checked longest ago with their profiles and correct them.
+
+    Returns:
+        int: How many of them the index got wrong.
+    """
+    sample = sorted(player_ids, key=lambda player_id: checked.get(player_id, 0))[:SPOT_CHECK_SIZE]
+    actual = _read_profiles(client, league_id, sample)
+
+    now = time.time()
+    mismatches = 0
+    for player_id, owner in actual.items():
+        expected = owners.get(player_id)
+        if (expected or {}).get("oui") != (owner or {}).get("oui"):
+            logging.debug(f"Ownership of player {player_id} was {expected}, the profile says {owner}.")
+            mismatches += 1
+        owners[player_id] = owner
+        checked[player_id] = now
+
+    return mismatches
+
+
+def sync(client: KickbaseClient, league_id: str, player_ids) -> dict:
+    """### Get the owners of the given players in a league.
+
+    The transfer ledger and STATIC_users.json of the current data directory have to be
+    up to date, like for the stages reading them.
+
+    Args:
+        client (KickbaseClient): The logged in API client.
+        league_id (str): The league ID.
+        player_ids (iterable): The players of the competition.
+
+    Returns:
+        dict: {player_id: {"oui": owner ID, "onm": owner name} or None if no manager
+            of the league owns the player}.
+    """
+    player_ids = [str(player_id) for player_id in player_ids]
+
+    with _lock:
+        league_lock = _league_locks.setdefault(league_id, threading.Lock())
+
+    with league_lock:
+        if league_id not in _owners_cache:
+            _owners_cache[league_id] = _sync(client, league_id, player_ids)
+        owners = _owners_cache[league_id]
+
+        ### Players asked for in a later call of the same run are read from their profiles
+        missing = [player_id for player_id in player_ids if player_id not in owners]
+        if missing:
+            owners.update(_read_profiles(client, league_id, missing))
+
+        return {player_id: owners[player_id] for player_id in player_ids}
+
+
+def _sync(client: KickbaseClient, league_id: str, player_ids: list) -> dict:
+    transfers = feed_ledger.sync_transfers(client, league_id)
+    directory = user_directory.load()
+
+    index = miscellaneous.read_cache_file(_index_file(league_id), {})
+    owners = index.get("owners") or {}
+    checked = index.get("checked") or {}
+    applied = set(index.get("applied") or ())
+
+    if not owners:
+        logging.info("Reading the owners of all players from their profiles...")
+        owners = _read_profiles(client, league_id, player_ids)
+        ### The profiles already reflect every transfer so far
+        applied = {transfer["i"] for transfer in transfers}
+    else:
+        new_transfers = [transfer for transfer in transfers if transfer["i"] not in applied]
+        _replay(owners, new_transfers, directory)
+        applied.update(transfer["i"] for transfer in new_transfers)
+        logging.debug(f"Replayed {len(new_transfers)} transfer(s) onto the ownership index.")
+
+        unknown = [player_id for player_id in player_ids if player_id not in owners]
+        if unknown:
+            logging.debug(f"Reading the owners of {len(unknown)} new player(s) from their profiles.")
+            owners.update(_read_profiles(client, league_id, unknown))
+
+        mismatches = _spot_check(client, league_id, owners, checked, player_ids)
+        if mismatches > MAX_SPOT_CHECK_MISMATCHES:
+            logging.warning(f"The ownership index got {mismatches} of {SPOT_CHECK_SIZE} players wrong. Reading all owners from their profiles again.")
+            owners = _read_profiles(client, league_id, player_ids)
+            checked = {}
+
+    miscellaneous.write_cache_file({
+        "owners": owners,
+        "checked": checked,
+        ### Only transfers still in the ledger can come up again
+        "applied": sorted(applied & {transfer["i"] for transfer in transfers}),
+    }, _index_file(league_id))
+
+    return owners
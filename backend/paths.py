@@ -3,9 +3,15 @@
 
 These live here instead of in `main.py` so that both `main.py` and the modules it
 imports (e.g. `backend/miscellaneous.py`) can use them without a circular import.
+
+A run can process several leagues. Only one of them is shown in the frontend and
+writes to DATA_DIR, the others write to their own directory below LEAGUES_DIR. League
+files are therefore read and written through data_dir() and timestamp_dir().
 """
 
 from os import path, getcwd
+from contextlib import contextmanager
+from contextvars import ContextVar
 
 ### ===============================================================================
 
@@ -16,3 +22,47 @@ BASE_PATH = getcwd()
 LOG_DIR = path.join(BASE_PATH, "logs")
 DATA_DIR = path.join(BASE_PATH, "frontend", "src", "data")
 TIMESTAMP_DIR = path.join(DATA_DIR, "timestamps")
+### Internal state kept between runs (e.g. the HTTP response cache), never read by the frontend
+CACHE_DIR = path.join(BASE_PATH, "cache")
+### Leagues other than the one shown in the frontend write their data files here, one directory per league ID
+LEAGUES_DIR = path.join(DATA_DIR, "leagues")
+
+### ===============================================================================
+
+### The data directory of the league whose stage is running in the current thread or task
+_data_dir = ContextVar("data_dir", default=DATA_DIR)
+
+
+def data_dir() -> str:
+    """### The data directory to read and write league files in. DATA_DIR unless set otherwise."""
+    return _data_dir.get()
+
+
+def timestamp_dir() -> str:
+    """### The timestamp directory belonging to data_dir()."""
+    return path.join(data_dir(), "timestamps")
+
+
+def league_data_dir(league_id: str) -> str:
+    """### The data directory of a league that is not shown in the frontend."""
+    return path.join(LEAGUES_DIR, league_id)
+
+
+@contextmanager
+def using_data_dir(directory: str):
+    """### Read and write league files in the given directory until the block ends.
+
+    The directory is kept in a context variable, so it only applies to the current
+    thread or asyncio task and to the ones started from it with a copied context.
+    """
+    token = _data_dir.set(directory)
+    try:
+        yield directory
+    finally:
+        _data_dir.reset(token)
+
+
+def run_in_data_dir(directory: str, func, *args, **kwargs):
+    """### Call a function with data_dir() set to the given directory."""
+    with using_data_dir(directory):
+        return func(*args, **kwargs)
@@ -0,0 +1,147 @@
+"""
+### This module keeps the player profiles of every league between runs.
+
+A run reads the profile of every player in the competition, one request each, yet
+most of them didn't change since the last run. The team profiles and the market, which
+a run downloads anyway, list every player with their market value, status, trend,
+position and team. Those fields are remembered as the player's snapshot. A stored
+profile is reused as long as the player's snapshot is still the one it was fetched
+with and it is younger than PLAYER_PROFILE_MAX_AGE hours. So only players that moved,
+that are new or whose profile got old are fetched again.
+
+Ownership ("opl") is not part of the snapshot. backend.ownership reads it fresh.
+
+Profiles are kept as compact Player_Profile records, in memory and on disk.
+"""
+
+import time
+import logging
+import threading
+
+from os import getenv
+
+from backend import miscellaneous
+from backend.kickbase.endpoints.competition import Player_Profile
+
+### -------------------------------------------------------------------
+
+SNAPSHOTS_FILE = "player_snapshots.json"
+
+### The fields of a team profile or market entry a player's profile is keyed on
+SNAPSHOT_FIELDS = ("mv", "st", "mvt", "pos", "tid")
+
+### {player_id: [snapshot fields]} and {league_id: {player_id: {"profile", "fetched", "snapshot"}}}, loaded on first use
+_snapshots = None
+_profiles = {}
+### What changed since the last save()
+_snapshots_dirty = False
+_dirty_leagues = set()
+_lock = threading.Lock()
+
+
+def _profiles_file(league_id: str) -> str:
+    return f"player_profiles_{league_id}.json"
+
+
+def _max_age() -> float:
+    """### How long a stored profile is reused at most, in seconds."""
+    return float(getenv("PLAYER_PROFILE_MAX_AGE", "24")) * 60 * 60
+
+
+def _load_snapshots() -> dict:
+    global _snapshots
+
+    if _snapshots is None:
+        _snapshots = miscellaneous.read_cache_file(SNAPSHOTS_FILE, {})
+    return _snapshots
+
+
+def _load_profiles(league_id: str) -> dict:
+    if league_id not in _profiles:
+        stored_profiles = miscellaneous.read_cache_file(_profiles_file(league_id), {})
+        _profiles[league_id] = {player_id: dict(entry, profile=Player_Profile(entry["profile"], league_id))
+                                for player_id, entry in stored_profiles.items()}
+    return _profiles[league_id]
+
+
+def observe(players) -> None:
+    """### Remember the current snapshot of players, as listed by a team profile or the market.
+
+    Args:
+        players (iterable): Player dicts with the player ID in "i" and the SNAPSHOT_FIELDS.
+    """
+    global _snapshots_dirty
+
+    with _lock:
+        snapshots = _load_snapshots()
+        for player in players:
+            ### A field the listing doesn't have keeps its last known value
+            previous = snapshots.get(str(player["i"])) or [None] * len(SNAPSHOT_FIELDS)
+            snapshot = [player.get(field, known) for field, known in zip(SNAPSHOT_FIELDS, previous)]
+            if previous != snapshot:
+                snapshots[str(player["i"])] = snapshot
+                _snapshots_dirty = True
+
+
+def market_value(player_id: str):
+    """### Get a player's market value as last listed by a team profile or the market, or None if never listed."""
+    with _lock:
+        snapshot = _load_snapshots().get(str(player_id))
+    return snapshot[SNAPSHOT_FIELDS.index("mv")] if snapshot else None
+
+
+def stored(league_id: str, player_id: str) -> Player_Profile:
+    """### Get a player's stored profile, if it can still be used.
+
+    Args:
+        league_id (str): The league ID.
+        player_id (str): The player ID.
+
+    Returns:
+        Player_Profile: The profile, or None if there is none, the player moved since it was fetched
+            or it is older than PLAYER_PROFILE_MAX_AGE.
+    """
+    with _lock:
+        entry = _load_profiles(league_id).get(str(player_id))
+        if entry is None or time.time() - entry["fetched"] > _max_age():
+            return None
+        if entry["snapshot"] != _load_snapshots().get(str(player_id)):
+            return None
+        return entry["profile"]
+
+
+def store(league_id: str, player_id: str, profile: Player_Profile) -> None:
+    """### Keep a freshly fetched profile, together with the player's current snapshot.
+
+    Args:
+        league_id (str): The league ID.
+        player_id (str): The player ID.
+        profile (Player_Profile): The player_statistics response.
+    """
+    with _lock:
+        _load_profiles(league_id)[str(player_id)] = {
+            "profile": profile,
+            "fetched": time.time(),
+            "snapshot": _load_snapshots().get(str(player_id)),
+        }
+        _dirty_leagues.add(league_id)
+
+
+def save() -> None:
+    """### Write the snapshots and the profiles of every league to the cache directory, if anything changed."""
+    global _snapshots_dirty
+
+    with _lock:
+        files = {_profiles_file(league_id): {player_id: dict(entry, profile=entry["profile"].to_dict())
+                                             for player_id, entry in _profiles[league_id].items()}
+                 for league_id in _dirty_leagues}
+        if _snapshots_dirty:
+            files[SNAPSHOTS_FILE] = dict(_snapshots)
+        _snapshots_dirty = False
+        _dirty_leagues.clear()
+
+        for file_name, data in files.items():
+            miscellaneous.write_cache_file(data, file_name)
+
+    if files:
+        logging.debug(f"Saved {len(files)} player profile file(s).")
@@ -0,0 +1,186 @@
+"""
+### This module holds the asyncio counterparts of the stages in `main.py`.
+
+Every function here fetches what its stage needs and nothing else. They don't build
+or write any output, they only fill the per-run caches of the v4 modules, so the
+regular stages afterwards run almost without waiting on the network.
+
+`run()` starts all of them on one event loop. Fetches that don't depend on each other
+overlap, across stages and leagues too, so a refresh only waits for its slowest dependency chain
+(the team overview followed by every player's profile and market value history).
+"""
+
+import asyncio
+import logging
+
+from backend import feed_ledger, market_values, paths, profile_pics, ranking_archive
+from backend.kickbase.client import KickbaseClient, AsyncKickbaseClient
+from backend.kickbase.v4 import competitions, leagues
+
+### -------------------------------------------------------------------
+
+### How many requests the prefetch keeps in flight at once, across all endpoints
+MAX_WORKERS = 8
+
+
+async def _players(aclient: AsyncKickbaseClient, league_id: str, player_ids) -> None:
+    """### Fetch the statistics and market value history of the given players."""
+    ids = sorted({str(player_id) for player_id in player_ids})
+
+    await asyncio.gather(
+        *(aclient.call(leagues.player_statistics, league_id, player_id) for player_id in ids),
+        *(aclient.call(market_values.history, player_id) for player_id in ids),
+    )
+
+
+async def _dashboards(aclient: AsyncKickbaseClient, league_id: str) -> None:
+    """### Fetch the dashboard of every manager in the league."""
+    users = await aclient.call(leagues.get_users, league_id)
+
+    await asyncio.gather(*(aclient.call(leagues.user_stats, league_id, user["i"]) for user in users))
+
+
+async def _battles(aclient: AsyncKickbaseClient, league_id: str) -> None:
+    """### Fetch every battle shown in the frontend and index it by user."""
+    await asyncio.gather(*(aclient.call(leagues.battles, league_id, battle_type) for battle_type in leagues.BATTLE_TYPES))
+
+    await aclient.call(leagues.battle_index, league_id)
+
+
+async def _profile_pics(aclient: AsyncKickbaseClient, league_id: str) -> None:
+    """### Check the profile picture of every manager in the league."""
+    users = await aclient.call(leagues.get_users, league_id)
+
+    ### resolve() doesn't take the API client, the pictures come from the CDN
+    ## Concurrent calls wait for each other, so the second one is answered from the cache
+    await asyncio.to_thread(profile_pics.resolve, [user["i"] for user in users])
+
+
+async def market(aclient: AsyncKickbaseClient, league_id: str) -> None:
+    """### Fetch everything main.market() needs: the market and every listed player."""
+    players_on_market = await aclient.call(leagues.get_market, league_id)
+
+    await _players(aclient, league_id, [player.id for player in players_on_market])
+
+
+async def market_value_changes(aclient: AsyncKickbaseClient, league_id: str) -> None:
+    """### Fetch everything main.market_value_changes() needs: every player in the competition."""
+    _, all_teams = await asyncio.gather(
+        aclient.call(leagues.get_users, league_id),
+        aclient.call(competitions.get_team_overview),
+    )
+
+    await _players(aclient, league_id, [player["i"] for team in all_teams for player in team["players"]])
+
+
+async def taken_free_players(aclient: AsyncKickbaseClient, league_id: str) -> None:
+    """### Fetch everything main.taken_free_players() needs: the transfer ledger and every player in the competition."""
+    await asyncio.gather(
+        aclient.call(feed_ledger.sync_transfers, league_id),
+        market_value_changes(aclient, league_id),
+    )
+
+
+async def turnovers(aclient: AsyncKickbaseClient, league_id: str) -> None:
+    """### Fetch everything main.turnovers() needs: the transfer ledger and every traded player."""
+    ### The team overview tells which stored player profiles are outdated, so it comes first
+    all_transfers, _ = await asyncio.gather(
+        aclient.call(feed_ledger.sync_transfers, league_id),
+        aclient.call(competitions.get_team_overview),
+    )
+
+    await _players(aclient, league_id, [transfer["data"]["pi"] for transfer in all_transfers])
+
+
+async def balances(aclient: AsyncKickbaseClient, league_id: str) -> None:
+    """### Fetch everything main.balances() needs: the transfer ledger, dashboards and profile pictures."""
+    await asyncio.gather(
+        aclient.call(feed_ledger.sync_transfers, league_id),
+        _dashboards(aclient, league_id),
+        _profile_pics(aclient, league_id),
+    )
+
+
+async def team_value_per_match_day(aclient: AsyncKickbaseClient, league_id: str) -> None:
+    """### Fetch everything main.team_value_per_match_day() needs: the rankings missing in the archive."""
+    await aclient.call(ranking_archive.sync, league_id)
+
+
+async def league_user_stats_tables(aclient: AsyncKickbaseClient, league_id: str) -> None:
+    """### Fetch everything main.league_user_stats_tables() needs: dashboards, battles and profile pictures."""
+    await asyncio.gather(
+        _dashboards(aclient, league_id),
+        _profile_pics(aclient, league_id),
+        _battles(aclient, league_id),
+    )
+
+
+async def _league(aclient: AsyncKickbaseClient, league_id: str, directory: str, only: tuple = None) -> None:
+    """### Run every stage's prefetch for one league, or those in `only`, with its files going to the league's data directory."""
+    stages = {
+        "market": market,
+        "market_value_changes": market_value_changes,
+        "taken_free_players": taken_free_players,
+        "turnovers": turnovers,
+        "balances": balances,
+        "team_value_per_match_day": team_value_per_match_day,
+        "league_user_stats_tables": league_user_stats_tables,
+    }
+    if only is not None:
+        stages = {name: stage for name, stage in stages.items() if name in only}
+
+    ### The tasks started below copy the context, so they all write to the league's directory
+    with paths.using_data_dir(directory):
+        results = await asyncio.gather(*(stage(aclient, league_id) for stage in stages.values()),
+                                       return_exceptions=True)
+
+    for name, result in zip(stages, results):
+        if isinstance(result, Exception):
+            logging.warning(f"Prefetching for {name}() of league {league_id} failed, it will fetch its data itself: {result}")
+
+
+async def prefetch_all(client: KickbaseClient, league_dirs: dict, only: tuple = None, deadline: float = None) -> None:
+    """### Run every stage's prefetch for every league concurrently on the running event loop.
+
+    All leagues share one AsyncKickbaseClient, so what doesn't depend on the league,
+    like the team overview and the market value histories, is only fetched once.
+    A failed prefetch is only logged. Its stage will send the missing requests itself
+    later on and report the error the usual way.
+
+    Args:
+        client (KickbaseClient): The logged in API client.
+        league_dirs (dict): {league_id: data directory} of the leagues to fetch data for.
+        only (tuple): The names of the stages to prefetch for, e.g. ("market",). Defaults to all.
+        deadline (float): Stop waiting after this many seconds. Requests not sent by then
+            are dropped, the stages send them themselves. Requests already running finish in
+            the background, a stage needing one of them waits for it through the endpoint
+            caches. Defaults to no deadline.
+    """
+    aclient = AsyncKickbaseClient(client, max_workers=MAX_WORKERS)
+    timed_out = False
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(_league(aclient, league_id, directory, only) for league_id, directory in league_dirs.items())),
+            timeout=deadline,
+        )
+    except asyncio.TimeoutError:
+        timed_out = True
+        logging.warning(f"Prefetching took longer than {deadline}s. The stages fetch what is missing themselves.")
+    finally:
+        aclient.close(wait=not timed_out)
+
+
+def run(client: KickbaseClient, league_dirs: dict, only: tuple = None, deadline: float = None) -> None:
+    """### Prefetch the data of every stage, or of those in `only`, on a new event loop.
+
+    Args:
+        client (KickbaseClient): The logged in API client.
+        league_dirs (dict): {league_id: data directory} of the leagues to fetch data for.
+        only (tuple): The names of the stages to prefetch for, e.g. ("market",). Defaults to all.
+        deadline (float): Stop waiting after this many seconds, see prefetch_all().
+    """
+    logging.info(f"Prefetching data for {'all stages' if only is None else ', '.join(only)}...")
+
+    asyncio.run(prefetch_all(client, league_dirs, only, deadline))
+
+    logging.info("Prefetching done.")
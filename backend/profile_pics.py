@@ -0,0 +1,115 @@
+"""
+### This module resolves the profile pictures of the league's managers.
+
+Kickbase serves every profile picture from a fixed CDN URL, which answers 404 for
+managers without one. Whether a picture exists is checked with a HEAD request, for
+all managers at once, and the result is kept in the cache directory for a day, so
+most runs send no request at all.
+"""
+
+import time
+import logging
+import threading
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+
+from backend import exceptions, miscellaneous
+
+### -------------------------------------------------------------------
+
+CDN_URL = "https://cdn.kickbase.com/files/users/{user_id}/0"
+
+PROFILE_PICS_FILE = "profile_pics.json"
+
+### How long a checked picture is trusted before asking the CDN again, in seconds
+PROFILE_PIC_TTL = 24 * 60 * 60
+
+MAX_PROFILE_PIC_WORKERS = 8
+
+### {user_id: {"url": str or None, "checked": UNIX time}}, loaded on first use
+_resolved = None
+_lock = threading.Lock()
+### Held while checking, so concurrent callers don't check the same users twice
+_resolve_lock = threading.Lock()
+_session = requests.Session()
+
+
+def _load() -> dict:
+    global _resolved
+
+    with _lock:
+        if _resolved is None:
+            _resolved = miscellaneous.read_cache_file(PROFILE_PICS_FILE, {})
+    return _resolved
+
+
+def _check(user_id: str) -> str:
+    """### Ask the CDN whether a user has a profile picture, without downloading it.
+
+    Returns:
+        str: The URL of the profile picture, or None if the user has none.
+    """
+    url = CDN_URL.format(user_id=user_id)
+
+    try:
+        response = _session.head(url, allow_redirects=True, timeout=10)
+        if response.status_code == 200:
+            return response.url # Profile pic is set
+        elif response.status_code == 404:
+            return None # Profile pic is not set
+        else:
+            response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        raise exceptions.KickbaseException(f"Checking the profile picture of user {user_id} failed!") from e
+
+
+def resolve(user_ids) -> dict:
+    """### Get the profile pictures of many users at once.
+
+    Users checked less than PROFILE_PIC_TTL ago are answered from the cache, the others
+    are checked concurrently. If a check fails, the last known result is used instead.
+
+    Args:
+        user_ids (iterable): The user IDs.
+
+    Raises:
+        exceptions.KickbaseException: If a check fails for a user that was never checked before.
+
+    Returns:
+        dict: {user_id: URL of the profile picture, or None if the user has none}
+    """
+    resolved = _load()
+    user_ids = [str(user_id) for user_id in user_ids]
+
+    with _resolve_lock:
+        _check_outdated(resolved, user_ids)
+
+    return {user_id: resolved[user_id]["url"] for user_id in user_ids}
+
+
+def _check_outdated(resolved: dict, user_ids: list) -> None:
+    """### Check every user whose result is missing or older than PROFILE_PIC_TTL."""
+    now = time.time()
+
+    outdated = sorted({user_id for user_id in user_ids
+                       if now - resolved.get(user_id, {}).get("checked", 0) > PROFILE_PIC_TTL})
+
+    if outdated:
+        logging.debug(f"Checking the profile pictures of {len(outdated)} user(s)...")
+
+        def check(user_id: str):
+            try:
+                return user_id, {"url": _check(user_id), "checked": now}
+            except exceptions.KickbaseException as e:
+                if user_id not in resolved:
+                    raise
+                logging.warning(f"{e} Using the last known profile picture.")
+                return user_id, resolved[user_id]
+
+        with ThreadPoolExecutor(max_workers=MAX_PROFILE_PIC_WORKERS) as executor:
+            checked = dict(executor.map(check, outdated))
+
+        with _lock:
+            resolved.update(checked)
+            miscellaneous.write_cache_file(dict(resolved), PROFILE_PICS_FILE)
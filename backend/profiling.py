@@ -0,0 +1,252 @@
+"""
+### This module records where the time of a run goes, if PROFILE=true.
+
+For every stage it keeps the wall time and status. For every API endpoint it keeps
+the request count, latency percentiles, bytes received, cache hits and retries. The
+counters of the in-memory endpoint caches (backend.kickbase.memo) are added as well.
+PROFILE_CAPTURE additionally captures one of these per stage:
+
+- `cprofile`: the 25 functions with the most cumulative time. Only the stage's own
+  thread is profiled, not the thread pools it hands work to. From Python 3.12 on only
+  one profiler can be active per process, so one stage is profiled at a time. A stage
+  starting while another one is profiled is not captured; it is logged and listed in
+  the report with the reason instead.
+- `tracemalloc`: the 10 lines that allocated the most memory still held when the stage
+  finished. Memory is traced for the whole process, so stages running at the same
+  time show up in each other's snapshots.
+
+The report of a run is written to `logs/profile.json`, next to the log files. Without
+PROFILE=true nothing is recorded and the hooks return right away.
+"""
+
+import re
+import json
+import pstats
+import logging
+import cProfile
+import threading
+import tracemalloc
+
+from io import StringIO
+from os import getenv, makedirs, path
+from datetime import datetime
+from contextlib import contextmanager
+
+from backend.paths import LOG_DIR
+from backend.kickbase import memo
+
+### -------------------------------------------------------------------
+
+PROFILE_FILE = "profile.json"
+
+### How many entries a captured cProfile or tracemalloc snapshot keeps
+CPROFILE_ENTRIES = 25
+TRACEMALLOC_ENTRIES = 10
+
+### IDs in API paths, replaced so all calls of one endpoint are counted together
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+### {endpoint: {"latencies": [seconds], "bytes": int, "cache_hits": int, "revalidated": int, "retries": int}}
+_endpoints = {}
+### {stage name: captured snapshot}
+_captures = {}
+### {stage name: why it wasn't captured}
+_not_captured = {}
+_lock = threading.Lock()
+### Held while a stage is profiled with cProfile
+_cprofile_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    """### Check whether PROFILE=true asks for a report."""
+    return getenv("PROFILE", "false").lower() == "true"
+
+
+def _capture_mode() -> str:
+    mode = getenv("PROFILE_CAPTURE", "").lower()
+    if mode not in ("", "cprofile", "tracemalloc"):
+        logging.warning(f"Ignoring PROFILE_CAPTURE={mode}, it must be 'cprofile' or 'tracemalloc'.")
+        return ""
+    return mode
+
+
+def clear() -> None:
+    """### Start recording a new run."""
+    with _lock:
+        _endpoints.clear()
+        _captures.clear()
+        _not_captured.clear()
+
+    if enabled() and _capture_mode() == "tracemalloc" and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def endpoint(method: str, api_path: str) -> str:
+    """### Name the endpoint of a request, e.g. `GET /v4/leagues/{id}/market`."""
+    return f"{method} {_ID_SEGMENT.sub('/{id}', api_path.split('?', 1)[0])}"
+
+
+def record_request(method: str, api_path: str, seconds: float, response=None, cached: str = None) -> None:
+    """### Record one API request.
+
+    Args:
+        method (str): The HTTP method.
+        api_path (str): The API path, including any query string.
+        seconds (float): How long the request took.
+        response (requests.Response): The response, for its size and retries.
+        cached (str): "hit" if the response cache answered without a request,
+            "revalidated" if the server confirmed the cached response with a 304.
+    """
+    if not enabled():
+        return
+
+    size = len(response.content) if response is not None and cached != "hit" else 0
+    retries = getattr(getattr(getattr(response, "raw", None), "retries", None), "history", None) or ()
+
+    with _lock:
+        stats = _endpoints.setdefault(endpoint(method, api_path),
+                                      {"latencies": [], "bytes": 0, "cache_hits": 0, "revalidated": 0, "retries": 0})
+        stats["latencies"].append(seconds)
+        stats["bytes"] += size
+        stats["cache_hits"] += cached == "hit"
+        stats["revalidated"] += cached == "revalidated"
+        stats["retries"] += len(retries)
+
+
+def _skip_capture(stage_name: str, reason: str) -> None:
+    """### Note that a stage isn't captured, for the log and the report."""
+    logging.info(f"Not profiling the stage {stage_name}: {reason}")
+    with _lock:
+        _not_captured[stage_name] = reason
+
+
+def _start_cprofile(stage_name: str):
+    """### Start profiling a stage, or return None if another profiler is active. Holds _cprofile_lock on success."""
+    if not _cprofile_lock.acquire(blocking=False):
+        _skip_capture(stage_name, "another stage was being profiled")
+        return None
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        _cprofile_lock.release()
+        _skip_capture(stage_name, str(e))
+        return None
+    return profiler
+
+
+@contextmanager
+def capture(stage_name: str):
+    """### Capture what PROFILE_CAPTURE asks for while a stage runs.
+
+    Args:
+        stage_name (str): The stage, to file the snapshot under.
+    """
+    mode = _capture_mode() if enabled() else ""
+
+    if mode == "cprofile":
+        profiler = _start_cprofile(stage_name)
+        if profiler is None:
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            profiler.disable()
+            _cprofile_lock.release()
+            output = StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(CPROFILE_ENTRIES)
+            with _lock:
+                _captures[stage_name] = output.getvalue().splitlines()
+    elif mode == "tracemalloc" and tracemalloc.is_tracing():
+        try:
+            yield
+        finally:
+            top = tracemalloc.take_snapshot().statistics("lineno")[:TRACEMALLOC_ENTRIES]
+            with _lock:
+                _captures[stage_name] = [str(statistic) for statistic in top]
+    else:
+        yield
+
+
+def _percentile(sorted_values: list, percent: float) -> float:
+    """### The value below which `percent` of the sorted values lie, nearest rank."""
+    index = min(len(sorted_values) - 1, max(0, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def report(results: dict, critical_path: list, elapsed: float) -> dict:
+    """### Build the report of a run.
+
+    Args:
+        results (dict): The scheduler.StageResult of every stage.
+        critical_path (list): The stage names along the critical path.
+        elapsed (float): The wall time of the whole run in seconds.
+
+    Returns:
+        dict: The report, as written to PROFILE_FILE.
+    """
+    with _lock:
+        endpoints = {name: dict(stats, latencies=sorted(stats["latencies"])) for name, stats in _endpoints.items()}
+        captures = dict(_captures)
+        not_captured = dict(_not_captured)
+
+    stages = {}
+    for name, result in results.items():
+        stages[name] = {"status": result.status, "seconds": round(result.duration, 3)}
+        if name in captures:
+            stages[name]["capture"] = captures[name]
+        elif name in not_captured:
+            stages[name]["not_captured"] = not_captured[name]
+
+    endpoint_report = {}
+    for name, stats in sorted(endpoints.items(), key=lambda item: -sum(item[1]["latencies"])):
+        latencies = stats["latencies"]
+        sent = len(latencies) - stats["cache_hits"]
+        endpoint_report[name] = {
+            "calls": len(latencies),
+            "requests": sent,
+            "seconds": round(sum(latencies), 3),
+            "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+            "p90_ms": round(_percentile(latencies, 90) * 1000, 1),
+            "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+            "max_ms": round(latencies[-1] * 1000, 1),
+            "bytes": stats["bytes"],
+            "cache_hit_rate": round((stats["cache_hits"] + stats["revalidated"]) / len(latencies), 3),
+            "retries": stats["retries"],
+        }
+
+    return {
+        "time": datetime.now().isoformat(),
+        "seconds": round(elapsed, 3),
+        "critical_path": critical_path,
+        "stages": stages,
+        "endpoints": endpoint_report,
+        "caches": memo.stats(),
+    }
+
+
+def write_report(results: dict, critical_path: list, elapsed: float) -> None:
+    """### Write the report of a run to PROFILE_FILE, if PROFILE=true.
+
+    Args:
+        results (dict): The scheduler.StageResult of every stage.
+        critical_path (list): The stage names along the critical path.
+        elapsed (float): The wall time of the whole run in seconds.
+    """
+    if not enabled():
+        return
+
+    data = report(results, critical_path, elapsed)
+    file_path = path.join(LOG_DIR, PROFILE_FILE)
+
+    try:
+        makedirs(LOG_DIR, exist_ok=True)
+        with open(file_path, "w") as f:
+            json.dump(data, f, indent=2)
+        logging.info(f"Wrote the profiling report to {file_path}")
+    except OSError as e:
+        logging.error(f"Failed to write the profiling report to {file_path}: {e}")
+
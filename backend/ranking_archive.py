@@ -0,0 +1,109 @@
+"""
+### This module keeps an archive of the league ranking of every match day.
+
+The ranking of a match day holds the team value ("tv") of every manager, and once the
+match day is over it never changes again. Each finished match day is therefore
+fetched once and kept in the cache directory for good. Later runs only fetch the
+current match day.
+
+The archive is kept together with the START_DATE it was built for. A new season or a
+league reset keeps the league ID but moves START_DATE, and the archive is dropped then.
+"""
+
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from backend import miscellaneous
+from backend.kickbase.client import KickbaseClient
+from backend.kickbase.v4 import competitions, leagues
+
+### -------------------------------------------------------------------
+
+### How many missing match days to fetch at once, e.g. on the first run of a season
+MAX_RANKING_WORKERS = 4
+
+
+def _archive_file(league_id: str) -> str:
+    return f"rankings_{league_id}.json"
+
+
+def load_archive(league_id: str) -> dict:
+    """### Load the archived rankings of a league.
+
+    Args:
+        league_id (str): The league ID.
+
+    Returns:
+        dict: {match_day: {user_id: team_value}} for every archived match day. Empty if
+            the archive was built for another START_DATE.
+    """
+    archive = miscellaneous.read_cache_file(_archive_file(league_id), {})
+
+    if archive.get("start_date") != _start_date():
+        if archive:
+            logging.info(f"The ranking archive of league {league_id} is from before START_DATE changed. Rebuilding it.")
+        return {}
+
+    ### JSON object keys are always strings
+    return {int(match_day): team_values for match_day, team_values in archive["rankings"].items()}
+
+
+def _start_date() -> str:
+    return miscellaneous.get_start_datetime().isoformat()
+
+
+def sync(client: KickbaseClient, league_id: str) -> dict:
+    """### Get the team values of every manager on every match day up to the current one.
+
+    Finished match days (before the current one) come from the archive, those missing
+    there are fetched and archived. The current match day is still running, so it is
+    fetched on every run and not archived.
+
+    Args:
+        client (KickbaseClient): The logged in API client.
+        league_id (str): The league ID.
+
+    Returns:
+        dict: {match_day: {user_id: team_value}} for every match day up to the current one.
+    """
+    current_match_day, match_days_list = competitions.match_days(client)
+    archive = load_archive(league_id)
+
+    wanted = [match_day["day"] for match_day in match_days_list if match_day["day"] <= current_match_day]
+    missing = [day for day in wanted if day not in archive or day == current_match_day]
+
+    logging.debug(f"Rankings: {len(wanted) - len(missing)} match day(s) archived, fetching {missing}")
+
+    def team_values(day: int) -> dict:
+        ranking_data = leagues.ranking(client, league_id, day)
+        return {real_user["i"]: real_user["tv"] for real_user in ranking_data["us"]}
+
+    with ThreadPoolExecutor(max_workers=MAX_RANKING_WORKERS) as executor:
+        fetched = dict(zip(missing, executor.map(team_values, missing)))
+
+    newly_finished = {day: values for day, values in fetched.items() if day < current_match_day}
+    if newly_finished:
+        archive.update(newly_finished)
+        miscellaneous.write_cache_file({
+            "start_date": _start_date(),
+            "rankings": {str(day): values for day, values in sorted(archive.items())},
+        }, _archive_file(league_id))
+
+    return {day: fetched[day] if day in fetched else archive[day] for day in wanted}
+
+
+def team_values_by_user(rankings: dict) -> dict:
+    """### Turn the rankings around, so they are indexed by user first.
+
+    Args:
+        rankings (dict): {match_day: {user_id: team_value}}, as returned by sync().
+
+    Returns:
+        dict: {user_id: {match_day: team_value}}
+    """
+    by_user = {}
+    for day, team_values in rankings.items():
+        for user_id, team_value in team_values.items():
+            by_user.setdefault(user_id, {})[day] = team_value
+    return by_user
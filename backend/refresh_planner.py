@@ -0,0 +1,130 @@
+"""
+### This module plans when the data files are refreshed next.
+
+The data behind the files only changes on a few known events: the daily market value
+update ("mvud" in the market response), the end of the listings on the market ("exs"),
+and the matches of a match day, during which the points move. After every run the events
+it saw are written to the cache directory. `next_refresh()` plans the next run from them:
+
+- just after the next market value update,
+- shortly before the next listing ends, so its final state is captured. Only the market
+  table can change then, so these runs only refresh it (see LISTING_STAGES),
+- at least every MATCH_INTERVAL while matches are played,
+- otherwise after an idle interval that doubles with every run that changed nothing,
+  from MIN_INTERVAL up to MAX_INTERVAL.
+
+Every planned time gets a little random jitter, so several instances don't hit the API
+at the same second.
+"""
+
+import random
+import logging
+
+from datetime import datetime, timedelta, timezone
+
+from backend import miscellaneous
+
+### -------------------------------------------------------------------
+
+EVENTS_FILE = "refresh_events.json"
+
+### How long after the market value update to refresh, so the new values are out everywhere
+MARKET_VALUE_UPDATE_DELAY = timedelta(minutes=5)
+### How long before a listing ends to refresh
+EXPIRY_LEAD = timedelta(minutes=10)
+### The stages run shortly before a listing ends
+LISTING_STAGES = ("market",)
+### Events closer than this to the run that just ended are covered by it
+MIN_GAP = timedelta(minutes=15)
+
+### The idle interval after a run that changed something, and how far it backs off
+MIN_INTERVAL = timedelta(minutes=30)
+MAX_INTERVAL = timedelta(hours=6)
+### The longest interval while matches are played
+MATCH_INTERVAL = timedelta(hours=1)
+### How long a match window lasts after the kickoff of its last match
+MATCH_DURATION = timedelta(hours=2, minutes=30)
+
+### The most a planned time is moved by jitter. Always less than the delay and lead above,
+## so refreshes still land after the market value update and before the listing ends
+MAX_JITTER = timedelta(minutes=3)
+
+
+def _parse(timestamp: str) -> datetime:
+    """### Parse an ISO 8601 timestamp from the API into a timezone aware datetime."""
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+def record(market_value_update: str, expiries: list, match_days: list, changed: bool) -> None:
+    """### Remember the events a run saw, for next_refresh().
+
+    Args:
+        market_value_update (str): The "mvud" timestamp of the market response, or None.
+        expiries (list): When the listings on the market end, as datetimes.
+        match_days (list): The match days as returned by competitions.match_days().
+        changed (bool): Whether the run changed any output file.
+    """
+    previous = miscellaneous.read_cache_file(EVENTS_FILE, {})
+
+    miscellaneous.write_cache_file({
+        "recorded": datetime.now(timezone.utc).isoformat(),
+        "market_value_update": market_value_update or previous.get("market_value_update"),
+        "expiries": [expiry.isoformat() for expiry in sorted(set(expiries))],
+        "match_windows": [[match_day["firstMatch"], match_day["lastMatch"]] for match_day in match_days]
+                         or previous.get("match_windows", []),
+        ### The number of runs in a row that changed nothing
+        "idle_runs": 0 if changed else previous.get("idle_runs", 0) + 1,
+    }, EVENTS_FILE)
+
+
+def _in_match_window(now: datetime, windows: list) -> bool:
+    return any(first <= now <= last + MATCH_DURATION for first, last in windows)
+
+
+def next_refresh(now: datetime = None) -> tuple:
+    """### Plan the next refresh from the events the last run saw.
+
+    Args:
+        now (datetime): The time to plan from, timezone aware. Defaults to the current time.
+
+    Returns:
+        tuple: When to refresh next (timezone aware datetime), why (str) and which stages
+            to run (tuple of stage names, or None for all of them).
+    """
+    now = now or datetime.now(timezone.utc)
+    events = miscellaneous.read_cache_file(EVENTS_FILE, {})
+
+    try:
+        windows = [(_parse(first), _parse(last)) for first, last in events.get("match_windows", [])]
+        expiries = [_parse(expiry) for expiry in events.get("expiries", [])]
+        market_value_update = events.get("market_value_update")
+        market_value_update = _parse(market_value_update) if market_value_update else None
+    except (ValueError, TypeError, AttributeError) as e:
+        logging.warning(f"Ignoring the unreadable refresh events: {e}")
+        windows, expiries, market_value_update = [], [], None
+
+    ### The idle interval, backing off with every run that changed nothing
+    interval = min(MIN_INTERVAL * 2 ** min(events.get("idle_runs", 0), 16), MAX_INTERVAL)
+    if _in_match_window(now, windows):
+        interval = min(interval, MATCH_INTERVAL)
+        reason = "matches are played"
+    else:
+        reason = "idle interval"
+
+    ### (time, why, direction of the jitter, stages): after events late, before events early
+    candidates = [(now + interval, reason, 1, None)]
+
+    if market_value_update is not None:
+        ### The update happens daily, an outdated announcement still tells the time of day
+        while market_value_update + MARKET_VALUE_UPDATE_DELAY < now:
+            market_value_update += timedelta(days=1)
+        candidates.append((market_value_update + MARKET_VALUE_UPDATE_DELAY, "market value update", 1, None))
+
+    candidates += [(expiry - EXPIRY_LEAD, "listing ends", -1, LISTING_STAGES) for expiry in expiries]
+    candidates += [(first + MATCH_INTERVAL, "matches are played", 1, None) for first, _ in windows]
+
+    planned, reason, direction, stages = min((candidate for candidate in candidates if candidate[0] >= now + MIN_GAP),
+                                     key=lambda candidate: candidate[0], default=candidates[0])
+
+    jitter = timedelta(seconds=random.uniform(0, MAX_JITTER.total_seconds()))
+    return max(planned + direction * jitter, now + timedelta(minutes=1)), reason, stages
@@ -0,0 +1,257 @@
+"""
+### This module runs the stages of `main.py` in the order their data dependencies allow.
+
+Every stage declares the artifacts it reads (`inputs`) and writes (`outputs`), e.g.
+`STATIC_users.json`. A stage starts as soon as every artifact it reads was written, so
+stages that don't depend on each other run at the same time. A stage that fails only
+takes the stages reading its outputs down with it, everything else still runs.
+
+After a run, `log_report()` lists how long each stage took and the critical path: the
+chain of dependent stages that bounded the total run time.
+"""
+
+import time
+import logging
+import contextvars
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from backend import profiling
+
+### -------------------------------------------------------------------
+
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class Stage:
+    """
+    ### One step of a run, with the artifacts it reads and writes.
+
+    Args:
+        name (str): The name shown in the log.
+        func (callable): The function to run. Called with `args`.
+        *args: The arguments for `func`.
+        inputs (tuple): The artifacts the stage reads. It only runs once all of them were written.
+        outputs (tuple): The artifacts the stage writes.
+        after (tuple): Stages to wait for, whether they succeed or not. For stages that
+            only warm caches for others, like the prefetch.
+    """
+    __slots__ = ("name", "func", "args", "inputs", "outputs", "after")
+
+    def __init__(self, name: str, func, *args, inputs: tuple = (), outputs: tuple = (), after: tuple = ()):
+        self.name: str = name
+        self.func = func
+        self.args: tuple = args
+        self.inputs: tuple = tuple(inputs)
+        self.outputs: tuple = tuple(outputs)
+        self.after: tuple = tuple(after)
+
+
+class StageResult:
+    """
+    ### How a stage went: its status, when it ran and what went wrong.
+    """
+    __slots__ = ("status", "started", "finished", "error")
+
+    def __init__(self, status: str, started: float = None, finished: float = None, error: Exception = None):
+        self.status: str = status
+        self.started: float = started
+        self.finished: float = finished
+        self.error: Exception = error
+
+    @property
+    def duration(self) -> float:
+        """The wall time of the stage in seconds, 0 if it never ran."""
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+
+def _dependencies(stages: list) -> dict:
+    """### Map every stage to the stages it waits for.
+
+    Raises:
+        ValueError: If an input is written by no stage, an artifact by several, or the
+            stages depend on each other in a cycle.
+    """
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Stage names must be unique: {names}")
+
+    producers = {}
+    for stage in stages:
+        for artifact in stage.outputs:
+            if artifact in producers:
+                raise ValueError(f"{artifact} is written by both {producers[artifact]} and {stage.name}.")
+            producers[artifact] = stage.name
+
+    dependencies = {}
+    for stage in stages:
+        missing = [artifact for artifact in stage.inputs if artifact not in producers]
+        if missing:
+            raise ValueError(f"No stage writes {missing}, which {stage.name} reads.")
+
+        unknown = [name for name in stage.after if name not in names]
+        if unknown:
+            raise ValueError(f"{stage.name} waits for unknown stage(s) {unknown}.")
+
+        dependencies[stage.name] = {producers[artifact] for artifact in stage.inputs} | set(stage.after)
+
+    ### Reject cycles up front, they would leave the scheduler waiting forever
+    resolved = set()
+    remaining = dict(dependencies)
+    while remaining:
+        ready = [name for name, deps in remaining.items() if deps <= resolved]
+        if not ready:
+            raise ValueError(f"The stages {sorted(remaining)} depend on each other in a cycle.")
+        resolved.update(ready)
+        for name in ready:
+            del remaining[name]
+
+    return dependencies
+
+
+def select(stages: list, names) -> list:
+    """### Pick the given stages and every stage they wait for, e.g. for a partial run.
+
+    Args:
+        stages (list): The Stage objects of a full run.
+        names (iterable): The names of the stages to run.
+
+    Raises:
+        ValueError: If a name is not one of the stages.
+
+    Returns:
+        list: The picked Stage objects, in the order they were given.
+    """
+    dependencies = _dependencies(stages)
+
+    unknown = sorted(set(names) - dependencies.keys())
+    if unknown:
+        raise ValueError(f"Unknown stage(s) {unknown}, the stages are: {', '.join(dependencies)}")
+
+    picked = set()
+    wanted = list(names)
+    while wanted:
+        name = wanted.pop()
+        if name not in picked:
+            picked.add(name)
+            wanted.extend(dependencies[name])
+
+    return [stage for stage in stages if stage.name in picked]
+
+
+def run_stages(stages: list, max_workers: int = None) -> dict:
+    """### Run the stages, each as soon as its dependencies are through.
+
+    A stage whose inputs were not written, because their stage failed or was skipped
+    itself, is skipped. Exceptions never leave this function, they are logged and kept
+    in the results.
+
+    Args:
+        stages (list): The Stage objects to run.
+        max_workers (int): How many stages may run at once. Defaults to all of them.
+
+    Raises:
+        ValueError: If the declared inputs and outputs don't form a valid graph.
+
+    Returns:
+        dict: {stage name: StageResult}, in the order the stages were given.
+    """
+    dependencies = _dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    results = {}
+    pending = [stage.name for stage in stages]
+    running = {}
+
+    def execute(stage: Stage) -> StageResult:
+        started = time.perf_counter()
+        try:
+            with profiling.capture(stage.name):
+                stage.func(*stage.args)
+        except Exception as e:
+            logging.error(f"Stage {stage.name} failed: {e}")
+            logging.debug(f"Stage {stage.name} failed.", exc_info=True)
+            return StageResult(FAILED, started, time.perf_counter(), e)
+        return StageResult(DONE, started, time.perf_counter())
+
+    def producers_ok(name: str) -> bool:
+        stage = by_name[name]
+        required = dependencies[name] - set(stage.after)
+        return all(results[dependency].status == DONE for dependency in required)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages) or 1, thread_name_prefix="stage") as executor:
+        while pending or running:
+            for name in list(pending):
+                if not dependencies[name] <= results.keys():
+                    continue
+                pending.remove(name)
+
+                if not producers_ok(name):
+                    logging.warning(f"Skipping stage {name}, an input it needs is missing.")
+                    results[name] = StageResult(SKIPPED)
+                    continue
+
+                logging.debug(f"Starting stage {name}.")
+                ### Stages see the context run_stages() was called in, like a direct call would
+                context = contextvars.copy_context()
+                running[executor.submit(context.run, execute, by_name[name])] = name
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                results[running.pop(future)] = future.result()
+
+    return {stage.name: results[stage.name] for stage in stages}
+
+
+def critical_path(stages: list, results: dict) -> list:
+    """### Find the chain of dependent stages that bounded the run time.
+
+    Args:
+        stages (list): The Stage objects that were run.
+        results (dict): The results of run_stages().
+
+    Returns:
+        list: The stage names along the critical path, first stage first.
+    """
+    dependencies = _dependencies(stages)
+    results_in_order = sorted(results.items(), key=lambda item: item[1].finished or 0)
+
+    ### The longest chain ending in each stage, built up in the order the stages finished
+    chains = {}
+    for name, result in results_in_order:
+        longest = max((chains[dependency] for dependency in dependencies[name] if dependency in chains),
+                      key=lambda chain: chain[0], default=(0.0, []))
+        chains[name] = (longest[0] + result.duration, longest[1] + [name])
+
+    if not chains:
+        return []
+    return max(chains.values(), key=lambda chain: chain[0])[1]
+
+
+def log_report(stages: list, results: dict) -> None:
+    """### Log how long every stage took, which ones failed and the critical path.
+
+    Args:
+        stages (list): The Stage objects that were run.
+        results (dict): The results of run_stages().
+    """
+    for name, result in results.items():
+        logging.debug(f"Stage {name}: {result.status} in {result.duration:.2f}s")
+
+    failed = [name for name, result in results.items() if result.status == FAILED]
+    skipped = [name for name, result in results.items() if result.status == SKIPPED]
+    if failed:
+        logging.warning(f"Failed stage(s): {', '.join(failed)}")
+    if skipped:
+        logging.warning(f"Skipped stage(s): {', '.join(skipped)}")
+
+    path = critical_path(stages, results)
+    total = sum(results[name].duration for name in path)
+    steps = " -> ".join(f"{name} ({results[name].duration:.2f}s)" for name in path)
+    logging.info(f"Critical path ({total:.2f}s): {steps}")
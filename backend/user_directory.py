@@ -0,0 +1,54 @@
+"""
+### This module maps the managers of a league between their IDs and names.
+
+The activity feed names buyers and sellers ("byr", "slr") by their user name, while
+everything else uses the user ID. `STATIC_users.json` holds {user_id: user_name}; a
+UserDirectory indexes it both ways once, so a lookup in either direction is a dict access.
+"""
+
+import json
+
+from os import path
+
+from backend.paths import data_dir
+
+### -------------------------------------------------------------------
+
+USERS_FILE = "STATIC_users.json"
+
+
+class UserDirectory:
+    """
+    ### The managers of a league, looked up by ID or by name.
+
+    If two managers share a name, the name resolves to the one listed last, like the
+    inverted dict the stages used before.
+
+    Args:
+        league_users (dict): {user_id: user_name}, as in STATIC_users.json.
+    """
+    __slots__ = ("names", "ids")
+
+    def __init__(self, league_users: dict):
+        self.names: dict = dict(league_users)
+        self.ids: dict = {user_name: user_id for user_id, user_name in self.names.items()}
+
+    def id_of(self, user_name: str) -> str:
+        """### Get the ID of a manager by name, or None if no manager of the league has it."""
+        return self.ids.get(user_name)
+
+    def name_of(self, user_id: str) -> str:
+        """### Get the name of a manager by ID, or None if no manager of the league has it."""
+        return self.names.get(user_id)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+def load() -> UserDirectory:
+    """### Load the managers the users stage wrote to the current data directory."""
+    with open(path.join(data_dir(), USERS_FILE), "r") as f:
+        return UserDirectory(json.load(f))
@@ -1,11 +1,12 @@
+import threading
 import subprocess
 
-from os import getenv, chdir
+from os import getenv, chdir, environ
 from time import sleep
 from croniter import croniter
 from datetime import datetime
 
-from backend import exceptions, miscellaneous
+from backend import exceptions, miscellaneous, refresh_planner
 
 ### ===============================================================================
 
@@ -26,11 +27,15 @@ KB_MAIL = getenv("KB_MAIL")
 KB_PASSWORD = getenv("KB_PASSWORD")
 KB_LIGA = getenv("KB_LIGA")
 DISCORD_WEBHOOK = getenv("DISCORD_WEBHOOK")
-RUN_SCHEDULE = getenv("RUN_SCHEDULE", "10 2,6,10,14,18,22 * * *")
+RUN_SCHEDULE = getenv("RUN_SCHEDULE", "adaptive")
+### adaptive -> Plan every run around the market value update, expiring listings and matches
 ### 10 */8 * * * -> At minute 10 past every 8th hour
 ### 10 2,6,10,14,18,22 * * * -> At minute 10 past every 4th hour starting from 2am
 START_DATE = getenv("START_DATE")
 START_MONEY = getenv("START_MONEY", "50000000")
+### "daemon": refresh within this process and keep everything warm between runs
+### "subprocess": start a fresh python3 main.py for every run
+RUN_MODE = getenv("RUN_MODE", "daemon")
 
 ### Display a welcoming message in Docker logs
 print("👍 Container started. Welcome!")
@@ -58,10 +63,13 @@ else:
     print("  ✅ DISCORD_WEBHOOK is set.")
 
 ### Check if RUN_SCHEDULE is using the default value
-if RUN_SCHEDULE == "10 2,6,10,14,18,22 * * *":
-    print("  ✅ Using default value for RUN_SCHEDULE:", RUN_SCHEDULE)
-else:
+if RUN_SCHEDULE == "adaptive":
+    print("  ✅ Planning every refresh around the market and the matches (RUN_SCHEDULE=adaptive).")
+elif croniter.is_valid(RUN_SCHEDULE):
     print("  ⚠️ RUN_SCHEDULE has been set to a custom value:", RUN_SCHEDULE)
+else:
+    print(f"  ❌ RUN_SCHEDULE must be 'adaptive' or a cron expression, not '{RUN_SCHEDULE}'. Exiting...")
+    exit()
 
 ### Check if START_DATE is set by user
 ## Uses the same parser as main.py so both agree on what a valid value is
@@ -83,10 +91,48 @@ else:
     print("  ❌ START_MONEY is not set to a valid value. Exiting...")
     exit()
 
+### Check RUN_MODE
+if RUN_MODE == "daemon":
+    print("  ✅ Refreshing the data within this process (RUN_MODE=daemon).")
+elif RUN_MODE == "subprocess":
+    print("  ⚠️ Starting a new process for every refresh (RUN_MODE=subprocess).")
+else:
+    print(f"  ❌ RUN_MODE must be 'daemon' or 'subprocess', not '{RUN_MODE}'. Exiting...")
+    exit()
+
+### ===============================================================================
+
+### In daemon mode one Worker does every run, so the login, connections and caches stay warm
+if RUN_MODE == "daemon":
+    import main
+
+    main.configure_logging()
+    worker = main.Worker()
+else:
+    worker = None
+
+
+def refresh(wait: bool, only: tuple = None) -> None:
+    """### Refresh all data files once, the way RUN_MODE asks for.
+
+    Args:
+        wait (bool): Block until the run is done. Otherwise a daemon run happens on its
+            own thread, and a tick arriving while it still runs is skipped by the Worker.
+        only (tuple): The names of the stages to run, e.g. ("market",). Defaults to all stages.
+    """
+    if worker is None:
+        env = None if only is None else {**environ, "RUN_STAGES": ",".join(only)}
+        subprocess.run(["python3", "-u", "/code/main.py"], env=env)
+    elif wait:
+        worker.run(only)
+    else:
+        threading.Thread(target=worker.run, args=(only,), name="refresh", daemon=True).start()
+
 ### ===============================================================================
 
 # print("\nDEBUG ep.py: Running main")
-subprocess.run(["python3", "-u", "/code/main.py"])
+### The frontend needs the data files, so wait for the first run
+refresh(wait=True)
 
 # print("\nDEBUG ep.py: Changing directiry")
 chdir("/code/frontend")
@@ -108,7 +154,19 @@ flask_api = subprocess.Popen(["python3", "-u", "-m", "flask", "run", "--host=0.0
 ### Sleep here to give the flask server time to start
 sleep(120)
 
-next_execution_timestamp = convert_cron_to_timestamp(RUN_SCHEDULE)
+def next_execution() -> tuple:
+    """### Get the time of the next run, why it happens then and its stages, the way RUN_SCHEDULE asks for."""
+    if RUN_SCHEDULE == "adaptive":
+        planned, reason, only = refresh_planner.next_refresh()
+        return planned.timestamp(), reason, only
+    return convert_cron_to_timestamp(RUN_SCHEDULE), "RUN_SCHEDULE", None
+
+
+### A cron tick arriving while a daemon run is still in progress is skipped by the Worker.
+## Adaptive runs are always waited for, since the next one is planned from what they saw
+wait_for_runs = RUN_MODE == "subprocess" or RUN_SCHEDULE == "adaptive"
+
+next_execution_timestamp, next_execution_reason, next_execution_stages = next_execution()
 # print(f"DB: WHILE -> next execution timestamp: {next_execution_timestamp}")
 while True:
     current_time_timestamp = datetime.now().timestamp()
@@ -118,18 +176,18 @@ while True:
         ### Run the python script (auto_entry.py)
         print("\n  🚀 Running main.py...\n\n")
         ### TODO: Log output
-        subprocess.run(["python3", "-u", "/code/main.py"])
+        refresh(wait=wait_for_runs, only=next_execution_stages)
         
-        next_execution_timestamp = convert_cron_to_timestamp(RUN_SCHEDULE)
+        next_execution_timestamp, next_execution_reason, next_execution_stages = next_execution()
         # print(f"DB: WHILE -> next execution timestamp: {next_execution_timestamp}")
     else:
         ### Log the next scheduled execution time
         next_execution_readable = datetime.fromtimestamp(next_execution_timestamp).strftime('%A, %B %d, %Y %I:%M %p')
         print("\n\n▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼▼")
-        print(f"👀 Next execution will be on: {next_execution_readable}")
+        print(f"👀 Next execution will be on: {next_execution_readable} ({next_execution_reason})")
         print("▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲")
 
         ### Sleep until the next scheduled time
         sleep_duration = next_execution_timestamp - current_time_timestamp
         # print("DB: WHILE -> sleeping for: ", sleep_duration)
-        sleep(sleep_duration)
\ No newline at end of file
+        sleep(sleep_duration)
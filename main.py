@@ -1,6 +1,7 @@
 import json
 import time
 import logging
+import threading
 
 from os import getenv, makedirs, path
 from art import tprint
@@ -8,9 +9,12 @@ from sys import stdout
 from logging.config import dictConfig
 from datetime import datetime, timedelta, timezone
 
-from backend import exceptions, miscellaneous
+from backend import balance_ledger, exceptions, feed_ledger, fingerprints, market_values, miscellaneous, ownership, player_profiles, prefetch, profile_pics, profiling, ranking_archive, refresh_planner, scheduler, user_directory
+from backend.kickbase import memo
+from backend.kickbase.client import API_BASE_URL, KickbaseClient
+from backend.kickbase.http_cache import ResponseCache
 from backend.kickbase.v4 import competitions, user, leagues
-from backend.paths import LOG_DIR, DATA_DIR, TIMESTAMP_DIR
+from backend.paths import LOG_DIR, DATA_DIR, TIMESTAMP_DIR, CACHE_DIR, data_dir, league_data_dir, run_in_data_dir
 
 ### -------------------------------------------------------------------
 ### -------------------------------------------------------------------
@@ -18,12 +22,45 @@ from backend.paths import LOG_DIR, DATA_DIR, TIMESTAMP_DIR
 
 __version__ = getenv("REACT_APP_VERSION", "Warning: Couldn't load version")
 
+### Try to get the logins and Discord URL from the environment variables (Docker)
+kb_mail = getenv("KB_MAIL")
+kb_password = getenv("KB_PASSWORD")
+discord_webhook = getenv("DISCORD_WEBHOOK")
+
+### How long a login is reused by a Worker before it logs in again
+LOGIN_MAX_AGE = timedelta(hours=12)
+### How long a partial run (RUN_STAGES) waits for its prefetch, in seconds. The stages fetch the rest themselves
+PARTIAL_PREFETCH_DEADLINE = 20
+
 
 def main() -> None:
     """### This is the main function of the Kickbase Insights program.
 
     It performs various tasks related to logging, user login, and data retrieval from the Kickbase API.
     """
+    configure_logging()
+
+    ### Validate START_DATE before doing any work.
+    ## entrypoint.py checks this for Docker runs, but running main.py directly skips
+    ## that check and would only fail minutes later, in turnovers().
+    try:
+        miscellaneous.get_start_datetime()
+    except exceptions.KickbaseException as e:
+        logging.error(f"{e} Exiting...")
+        exit()
+
+    ### Only run some of the stages, e.g. RUN_STAGES=market to refresh the market table within seconds
+    only = tuple(name.strip() for name in getenv("RUN_STAGES", "").split(",") if name.strip()) or None
+
+    worker = Worker()
+    try:
+        worker.run(only)
+    finally:
+        worker.close()
+
+
+def configure_logging() -> None:
+    """### Create the log and data directories and set up logging to the console and the log files."""
     ### Ensure directories exist
     makedirs(LOG_DIR, exist_ok=True)
     makedirs(TIMESTAMP_DIR, exist_ok=True)
@@ -87,73 +124,288 @@ def main() -> None:
     ### Configure logging with the settings from the dictionary
     dictConfig(LOGGING)
 
-    ### Validate START_DATE before doing any work.
-    ## entrypoint.py checks this for Docker runs, but running main.py directly skips
-    ## that check and would only fail minutes later, in turnovers().
-    try:
-        miscellaneous.get_start_datetime()
-    except exceptions.KickbaseException as e:
-        logging.error(f"{e} Exiting...")
-        exit()
 
-    ### Start every run with empty API caches
-    leagues.clear_caches()
+def open_client() -> KickbaseClient:
+    """### Create the API client, with the on-disk HTTP cache unless HTTP_CACHE_MB is 0.
 
-    try:
-        selected_league, user_token, own_user_id = login()
+    Returns:
+        KickbaseClient: The client, not logged in yet.
+    """
+    ### Responses that rarely change (market value histories, profiles) are kept on disk between runs
+    ## HTTP_CACHE_MB=0 turns the cache off
+    http_cache_mb = int(getenv("HTTP_CACHE_MB", 64))
+    http_cache = ResponseCache(path.join(CACHE_DIR, "http_cache.sqlite3"), http_cache_mb * 1024 * 1024) if http_cache_mb > 0 else None
 
-        ### Get the daily login gift in every available league
-        get_gift(user_token)
+    ### One pooled client for the whole run, so every stage reuses the same connections
+    ## The prefetch threads and the team id probes, feed pages and rankings they start can all be in flight at once
+    ## KB_API_URL is only meant for pointing a development run at a local stand-in server
+    return KickbaseClient(base_url=getenv("KB_API_URL", API_BASE_URL),
+                          pool_size=prefetch.MAX_WORKERS + competitions.MAX_TEAM_WORKERS + leagues.FEED_WINDOW
+                                    + ranking_archive.MAX_RANKING_WORKERS,
+                          cache=http_cache)
 
-        market(user_token, selected_league, own_user_id)
-        market_value_changes(user_token, selected_league)
 
-        taken_free_players(user_token, selected_league)
+class Worker:
+    """
+    ### Refreshes all data files, as often as needed, within one process.
 
-        balances(user_token, selected_league)
+    main.py uses a Worker for a single run. entrypoint.py keeps one alive and calls
+    run() on every scheduled tick, so nothing has to start up again: the client keeps
+    its connections and login, and the team id registry, market value histories,
+    profile pictures and fingerprints stay loaded. Only the per-run API caches are
+    emptied before each run, since the data behind them changes.
 
-        turnovers(user_token, selected_league)
+    Args:
+        login_max_age (timedelta): How long a login is reused before logging in again.
+    """
+    def __init__(self, login_max_age: timedelta = LOGIN_MAX_AGE):
+        self.login_max_age: timedelta = login_max_age
+        self.client: KickbaseClient = None
 
-        team_value_per_match_day(user_token, selected_league)
+        self._login = None ### (selected_leagues, own_user_id) of the last login
+        self._logged_in_at = None
+        self._lock = threading.Lock()
 
-        league_user_stats_tables(user_token, selected_league)
+    def run(self, only: tuple = None) -> bool:
+        """### Refresh all data files once.
 
-        # live_points(user_token, selected_league) # needs to be run first to initialize the live_points.json file
-    except exceptions.LoginException as e:
-        print(e)
-        return
-    except exceptions.NotificatonException as e:
-        print(e)
-        return
-    except exceptions.KickbaseException as e:
-        print(e)
-        return
-    
+        Args:
+            only (tuple): The names of the stages to run, e.g. ("market",). The stages they
+                read from run as well. Defaults to all stages.
+
+        Errors are logged, not raised, so a long-running process survives a failed run.
+
+        Returns:
+            bool: False if the previous run is still in progress. This run is skipped then.
+        """
+        if not self._lock.acquire(blocking=False):
+            logging.warning("The previous run is still in progress. Skipping this one.")
+            return False
+
+        try:
+            start_time = time.time()
+
+            self._refresh(only)
+
+            ### Timestamp for frontend, which shows when all files were refreshed
+            if only is None:
+                miscellaneous.write_json_to_file({"time": datetime.now().isoformat()}, "ts_main.json")
+
+            elapsed_time_seconds = time.time() - start_time
+            minutes = int(elapsed_time_seconds // 60)
+            seconds = int(elapsed_time_seconds % 60)
+            logging.info(f"DONE! Execution time: {minutes}m {seconds}s")
+        except Exception as e:
+            ### Anything else only costs this run, the daemon keeps refreshing. Log in again next time
+            self._login = None
+            logging.exception(f"The run failed: {e}")
+        finally:
+            self._lock.release()
+
+        return True
+
+    def _logged_in(self) -> tuple:
+        """### Log in, unless the last login is recent enough to reuse. Returns what login() returns."""
+        if self._login is None or datetime.now() - self._logged_in_at > self.login_max_age:
+            self._login = login(self.client)
+            self._logged_in_at = datetime.now()
+        return self._login
+
+    def _refresh(self, only: tuple = None) -> None:
+        started = time.perf_counter()
+        profiling.clear()
+
+        ### Start every run with empty API caches
+        leagues.clear_caches()
+        competitions.clear_caches()
+        feed_ledger.clear_cache()
+        market_values.clear_cache()
+        ownership.clear_cache()
+        fingerprints.clear_cache()
+
+        if self.client is None:
+            self.client = open_client()
+
+        try:
+            selected_leagues, own_user_id = self._logged_in()
+
+            stages = build_stages(self.client, selected_leagues, own_user_id, only)
+            results = scheduler.run_stages(stages)
+            scheduler.log_report(stages, results)
+            memo.log_stats()
+            profiling.write_report(results, scheduler.critical_path(stages, results), time.perf_counter() - started)
+
+            self._record_events(only)
+
+            ### The token may have expired, log in again next time
+            if any(result.status == scheduler.FAILED for result in results.values()):
+                self._login = None
+        except exceptions.LoginException as e:
+            self._login = None
+            print(e)
+        except exceptions.NotificatonException as e:
+            self._login = None
+            print(e)
+        except exceptions.KickbaseException as e:
+            self._login = None
+            print(e)
+        finally:
+            ### Keep the market value histories and player profiles fetched so far, even if a stage failed
+            market_values.save()
+            player_profiles.save()
+
+    def _record_events(self, only: tuple = None) -> None:
+        """### Remember the market and match day events of this run, so entrypoint.py can plan the next one."""
+        market_value_update, expiries = leagues.market_events()
+
+        ### A partial run keeps the match days of the last full run, it writes no other files
+        match_days = []
+        if only is None:
+            try:
+                _, match_days = competitions.match_days(self.client)
+            except Exception as e:
+                logging.warning(f"Couldn't get the match days to plan the next refresh: {e}")
+
+        refresh_planner.record(market_value_update, expiries, match_days, fingerprints.changed())
+
+    def close(self) -> None:
+        """### Close the client and its HTTP cache."""
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+
+def build_stages(client: KickbaseClient, selected_leagues: list, own_user_id: str, only: tuple = None) -> list:
+    """### Declare the stages of a run and the files they read and write.
+
+    The scheduler runs every stage as soon as the files it reads were written, so the
+    order here is only the order of the log. The first league is the one shown in the
+    frontend and writes to DATA_DIR. Every other league writes to its own directory
+    below LEAGUES_DIR, and its stage and file names are prefixed with its ID.
+
+    Args:
+        client (KickbaseClient): The logged in API client.
+        selected_leagues (list): The leagues to get data for, the one shown in the frontend first.
+        own_user_id (str): The logged in user's ID, to identify their own bids.
+        only (tuple): The names of the stages to run, without the league prefix, e.g.
+            ("market",). The stages they read from, and a prefetch for just them, run as
+            well. Defaults to all stages.
+
+    Raises:
+        ValueError: If `only` names an unknown stage.
+
+    Returns:
+        list: The scheduler.Stage objects of a run.
+    """
+    league_dirs = {league.id: DATA_DIR if league is selected_leagues[0] else league_data_dir(league.id)
+                   for league in selected_leagues}
+
+    stages = [
+        ### Get the daily login gift in every available league
+        scheduler.Stage("get_gift", get_gift, client),
+        ### Fetch the data of all stages and leagues concurrently first, the stages below then mostly read from the caches
+        scheduler.Stage("prefetch", prefetch.run, client, league_dirs, only,
+                        None if only is None else PARTIAL_PREFETCH_DEADLINE),
+    ]
 
-def login() -> tuple:
+    prefixes = ["" if league is selected_leagues[0] else f"{league.id}/" for league in selected_leagues]
+    for league, prefix in zip(selected_leagues, prefixes):
+        stages += league_stages(client, league, own_user_id, league_dirs[league.id], prefix)
+
+    if only is None:
+        return stages
+
+    ### Run the given stages in every league
+    league_stage_names = {stage.name for stage in stages} - {"get_gift", "prefetch"}
+    return scheduler.select(stages, [prefix + name if prefix + name in league_stage_names else name
+                                     for name in only for prefix in prefixes])
+
+
+def league_stages(client: KickbaseClient, selected_league: object, own_user_id: str, directory: str, prefix: str) -> list:
+    """### Declare the stages that build the data files of one league.
+
+    Args:
+        client (KickbaseClient): The logged in API client.
+        selected_league (object): The league to get data for.
+        own_user_id (str): The logged in user's ID, to identify their own bids.
+        directory (str): The data directory the league's files are written to.
+        prefix (str): Put in front of the stage and file names, to tell the leagues apart.
+
+    Returns:
+        list: The scheduler.Stage objects of the league.
+    """
+    league_id = selected_league.id
+
+    def stage(name: str, func, *args, inputs: tuple = (), outputs: tuple = ()) -> scheduler.Stage:
+        ### The prefetch only fills the caches, so the stages wait for it but also run if it failed
+        ## Without waiting they would send the same requests a second time
+        return scheduler.Stage(prefix + name, run_in_data_dir, directory, func, *args,
+                               inputs=[prefix + artifact for artifact in inputs],
+                               outputs=[prefix + artifact for artifact in outputs],
+                               after=("prefetch",))
+
+    return [
+        ### Shared files other stages read back
+        stage("users", leagues.get_users, client, league_id,
+              outputs=("STATIC_users.json",)),
+        stage("teams", competitions.get_team_overview, client,
+              outputs=("STATIC_teams.json",)),
+        stage("transfers", feed_ledger.sync_transfers, client, league_id,
+              outputs=(feed_ledger.LEDGER_FILE,)),
+
+        stage("market", market, client, selected_league, own_user_id,
+              outputs=("market.json",)),
+        stage("market_value_changes", market_value_changes, client, selected_league,
+              inputs=("STATIC_users.json", "STATIC_teams.json", feed_ledger.LEDGER_FILE),
+              outputs=("market_value_changes.json",)),
+        stage("taken_free_players", taken_free_players, client, selected_league,
+              inputs=("STATIC_users.json", "STATIC_teams.json", feed_ledger.LEDGER_FILE),
+              outputs=("taken_players.json", "free_players.json")),
+        stage("balances", balances, client, selected_league,
+              inputs=("STATIC_users.json", feed_ledger.LEDGER_FILE),
+              outputs=("balances.json",)),
+        stage("turnovers", turnovers, client, selected_league,
+              inputs=("STATIC_users.json", feed_ledger.LEDGER_FILE),
+              outputs=("turnovers.json", "revenue_sum.json")),
+        stage("team_value_per_match_day", team_value_per_match_day, client, selected_league,
+              inputs=("STATIC_users.json",),
+              outputs=("team_values.json",)),
+        stage("league_user_stats_tables", league_user_stats_tables, client, selected_league,
+              inputs=("STATIC_users.json",),
+              outputs=("league_user_stats.json",)),
+
+        # stage("live_points", live_points, client, selected_league, outputs=("live_points.json",)), # needs to be run first to initialize the live_points.json file
+    ]
+
+
+def login(client: KickbaseClient) -> tuple:
     """### Logs in to Kickbase and gathers various information.
 
+    Args:
+        client (KickbaseClient): The API client to log in with. It holds the token afterwards.
+
     Returns:
         tuple: A tuple containing the following elements:
-            -- selected_league (object): The league the user wants to get data from for the frontend.
-            -- user_token (str): User token for authentication.
+            -- selected_leagues (list): The leagues to get data for. The first one is the
+               league the user wants to see in the frontend.
             -- own_user_id (str): The logged in user's ID. market() needs it to tell the
                user's own bids apart from anyone else's.
     """
     logging.info("Logging in...")
 
     ### Login to Kickbase using the credentials from the environment variables
-    user_info, user_token = user.login(kb_mail, kb_password, discord_webhook)
+    user_info, _ = user.login(client, kb_mail, kb_password, discord_webhook)
     logging.info(f"Successfully logged in as {user_info.name}")
 
     ### Get all leagues the user is in
-    league_list = leagues.get_league_list(user_token)
+    league_list = leagues.get_league_list(client)
     if not league_list:
-        logging.error("No leagues found. Exiting...")
-        exit()
+        raise exceptions.KickbaseException("No leagues found.")
     logging.info(f"Available leagues: {', '.join([league.name for league in league_list])}") # Print all available leagues the user is in
 
-    return select_league(league_list), user_token, user_info.id
+    selected_league = select_league(league_list)
+
+    return [selected_league, *select_extra_leagues(league_list, selected_league)], user_info.id
 
 
 def select_league(league_list: list) -> object:
@@ -192,13 +444,46 @@ def select_league(league_list: list) -> object:
     return selected_league
 
 
-def get_gift(user_token: str) -> None:
+def select_extra_leagues(league_list: list, selected_league: object) -> list:
+    """### Picks the leagues to get data for besides the one shown in the frontend.
+
+    Uses the `KB_LEAGUES` environment variable: "all" for every league the user is in,
+    or a comma separated list of league names. Unset means no extra leagues.
+
+    Args:
+        league_list (list): All leagues the user is in.
+        selected_league (object): The league shown in the frontend, see select_league().
+
+    Returns:
+        list: The extra leagues, in the order the user is in them.
+    """
+    wanted = (getenv("KB_LEAGUES") or "").strip()
+    if not wanted:
+        return []
+
+    others = [league for league in league_list if league.id != selected_league.id]
+    if wanted.lower() == "all":
+        extra_leagues = others
+    else:
+        names = {name.strip() for name in wanted.split(",") if name.strip()}
+        extra_leagues = [league for league in others if league.name in names]
+
+        missing = names - {league.name for league in league_list}
+        if missing:
+            logging.warning(f"League(s) {', '.join(sorted(missing))} from KB_LEAGUES not found. Ignoring them.")
+
+    if extra_leagues:
+        logging.info(f"Also getting data for: {', '.join(league.name for league in extra_leagues)}")
+    return extra_leagues
+
+
+def get_gift(client: KickbaseClient) -> None:
     """### Collect the daily login gift in every available league.
 
     Args:
-        user_token (str): The user's kkstrauth token.
+        client (KickbaseClient): The logged in API client.
     """
-    gift = user.collect_gift(user_token)
+    gift = user.collect_gift(client)
 
     ### Check if response["it"] is not empty:
     if gift["it"]:
@@ -208,18 +493,35 @@ def get_gift(user_token: str) -> None:
         logging.info("Gift has already been collected!")
 
 
-def market(user_token: str, selected_league: object, own_user_id: str) -> None:
+def market(client: KickbaseClient, selected_league: object, own_user_id: str) -> None:
     """### Retrieves all players listed on the transfer market.
 
     Args:
-        user_token (str): The user's kkstrauth token.
+        client (KickbaseClient): The logged in API client.
         selected_league (object): The league the user wants to get data from for the frontend.
         own_user_id (str): The logged in user's ID, to identify their own bids.
     """
     logging.info("Getting players listed on transfer market...")
 
     ### Get all players on the market
-    players_on_market = leagues.get_market(user_token, selected_league.id)
+    players_on_market = leagues.get_market(client, selected_league.id)
+
+    ### Fetch the profiles and market values of all listed players at once. After a full prefetch they are all cached already
+    player_ids = [player.id for player in players_on_market]
+    leagues.prefetch_players(client, selected_league.id, player_ids)
+    market_values.prefetch(client, player_ids)
+
+    ### Skip the rest if nothing on the market changed since the last run
+    ## The expiry is sent as seconds left, so it is compared as the minute the listing ends
+    fingerprint = fingerprints.of(
+        own_user_id,
+        [{**player.to_dict(), "expiry": None if player.expiry is None else int(time.time() + player.expiry) // 60}
+         for player in players_on_market],
+        [leagues.player_statistics(client, selected_league.id, player.id).statusText for player in players_on_market],
+        [market_values.history(client, player.id)[-31:] for player in players_on_market],
+    )
+    if fingerprints.skip_unchanged(selected_league.id, "market", fingerprint, ("market.json",)):
+        return
 
     players_on_the_market = []
 
@@ -229,10 +531,10 @@ def market(user_token: str, selected_league: object, own_user_id: str) -> None:
             player.position = 1 ### Default to "Torwart" (Goalkeeper)
 
         ### The status note only exists on the player profile, not on the market entry
-        player_stats = leagues.player_statistics(user_token, selected_league.id, player.id)
-        status_text = (player_stats.get("stxt") or "").strip() or None
+        player_stats = leagues.player_statistics(client, selected_league.id, player.id)
+        status_text = (player_stats.statusText or "").strip() or None
 
-        deltas = miscellaneous.market_value_deltas(leagues.player_marketvalue(user_token, player.id))
+        deltas = miscellaneous.market_value_deltas(market_values.history(client, player.id))
 
         own_bid = player.own_offer(own_user_id)
 
@@ -271,41 +573,56 @@ def market(user_token: str, selected_league: object, own_user_id: str) -> None:
     ### Save to file + timestamp
     miscellaneous.write_json_to_file(players_on_the_market, "market.json")
     miscellaneous.write_json_to_file({"time": datetime.now().isoformat()}, "ts_market.json")
+    fingerprints.record(selected_league.id, "market", fingerprint)
 
 
-def market_value_changes(user_token: str, selected_league: object) -> None:
+def market_value_changes(client: KickbaseClient, selected_league: object) -> None:
     """### Retrieves the market value changes for all players in the league.
 
     Args:
-        user_token (str): The user's kkstrauth token.
+        client (KickbaseClient): The logged in API client.
         selected_league (object): The league the user wants to get data from for the frontend.
     """
     logging.info("Getting market value changes for all players...")
 
     players_LIST = []
 
-    user_list = leagues.get_users(user_token, selected_league.id)
+    user_list = leagues.get_users(client, selected_league.id)
     ### Create a dictionary to map user IDs to user names
     user_id_to_name = {user["i"]: user["n"] for user in user_list}
 
-    all_teams_in_competition = competitions.get_team_overview(user_token)
+    all_teams_in_competition = competitions.get_team_overview(client)
 
     ### Fetch every player's statistics and market value history up front
     ## The loop below needs two requests per player
     all_player_ids = [player["i"] for team in all_teams_in_competition for player in team["players"]]
-    leagues.prefetch_players(user_token, selected_league.id, all_player_ids)
+    leagues.prefetch_players(client, selected_league.id, all_player_ids)
+    market_values.prefetch(client, all_player_ids)
+
+    ### Who owns which player, kept up to date from the transfer ledger
+    owners = ownership.sync(client, selected_league.id, all_player_ids)
+
+    ### Skip the rest if no player's statistics, owner or recent market values changed since the last run
+    fingerprint = fingerprints.of(
+        user_id_to_name,
+        all_teams_in_competition,
+        owners,
+        [leagues.player_statistics(client, selected_league.id, player_id).to_dict() for player_id in all_player_ids],
+        [market_values.history(client, player_id)[-31:] for player_id in all_player_ids],
+    )
+    if fingerprints.skip_unchanged(selected_league.id, "market_value_changes", fingerprint, ("market_value_changes.json",)):
+        return
 
     ### Loop through all teams
     for team in all_teams_in_competition:
         ### Loop through all players in the team
         for player in team["players"]:
             ### Get the market value changes for the player
-            player_stats = leagues.player_statistics(user_token, selected_league.id, player["i"])
-            player_marketvalue = leagues.player_marketvalue(user_token, player["i"])
+            player_stats = leagues.player_statistics(client, selected_league.id, player["i"])
+            player_marketvalue = market_values.history(client, player["i"])
 
             ### Check if player is owned by a user in this league
-            ## Ownership lives in the per-league "opl" list, not in the top level "oui"
-            owner = miscellaneous.get_player_owner(player_stats, selected_league.id)
+            owner = owners[player["i"]]
 
             if owner:
                 manager = owner.get("onm") or user_id_to_name.get(owner["oui"], "Unknown")
@@ -314,33 +631,34 @@ def market_value_changes(user_token: str, selected_league: object) -> None:
                 
             ### Check if position number is valid
             if player["pos"] not in miscellaneous.POSITIONS:
-                logging.warning(f"Invalid position number: {player_stats['pos']} for player {player_stats['fn']} {player_stats['ln']} (PID: {player_stats['i']})")
+                logging.warning(f"Invalid position number: {player_stats.position} for player {player_stats.firstName} {player_stats.lastName} (PID: {player_stats.id})")
                 player["pos"] = 1 # Default to "Torwart" (Goalkeeper)
 
             ### Create a custom json dict for every player
             players_LIST.append({
-                "teamId": player_stats["tid"],
-                "position": miscellaneous.POSITIONS[player_stats["pos"]],
-                "firstName": player_stats.get("fn", None), 
-                "lastName": player_stats["ln"], 
-                "marketValue": player_stats["mv"],
+                "teamId": player_stats.teamId,
+                "position": miscellaneous.POSITIONS[player_stats.position],
+                "firstName": player_stats.firstName,
+                "lastName": player_stats.lastName,
+                "marketValue": player_stats.marketValue,
                 **miscellaneous.market_value_deltas(player_marketvalue),
                 "manager": manager,
             })
-            logging.debug(f"Player {player_stats.get('fn', None)} {player_stats['ln']} has a market value of {player_stats['mv']} and is owned by {manager}.")
+            logging.debug(f"Player {player_stats.firstName} {player_stats.lastName} has a market value of {player_stats.marketValue} and is owned by {manager}.")
 
     logging.info("Got all market value changes for all players.")
 
     ### Save to file + timestamp
     miscellaneous.write_json_to_file(players_LIST, "market_value_changes.json")
     miscellaneous.write_json_to_file({"time": datetime.now().isoformat()}, "ts_market_value_changes.json")
+    fingerprints.record(selected_league.id, "market_value_changes", fingerprint)
 
 
-def taken_free_players(user_token: str, selected_league: object):
+def taken_free_players(client: KickbaseClient, selected_league: object):
     """### Retrieves all taken and free players in the league.
 
     Args:
-        user_token (str): The user's kkstrauth token.
+        client (KickbaseClient): The logged in API client.
         selected_league (object): The league the user wants to get data from for the frontend.
     """
     logging.info("Getting taken and free players...")
@@ -349,71 +667,67 @@ def taken_free_players(user_token: str, selected_league: object):
     free_players = []
 
     ### Get all users in the league
-    with open(path.join(DATA_DIR, "STATIC_users.json"), "r") as f:
-        league_users = json.load(f)
+    directory = user_directory.load()
+    league_users = directory.names
 
     ### Get all transfers in the league
-    all_transfers = leagues.transfers(user_token, selected_league.id)
+    all_transfers = feed_ledger.sync_transfers(client, selected_league.id)
 
-    ### Create a dictionary to store buy prices from transfers
-    buy_prices = {}
-    for transfer in all_transfers:
-        if "byr" in transfer["data"]:
-            user_id = {value: key for key, value in league_users.items()}.get(transfer["data"]["byr"]) # Reverse mapping from user name to user ID
-            player_id = transfer["data"]["pi"]
-            buy_price = transfer["data"]["trp"]
+    ### The day number of START_DATE, for looking up market values of players assigned at the start
+    start_day = miscellaneous.date_to_julian(miscellaneous.get_start_datetime())
+    start_date = miscellaneous.julian_to_date(start_day)
+
+    with open(path.join(data_dir(), "STATIC_teams.json"), "r") as f:
+        all_teams = json.load(f)
+
+    ### Skip the rest if neither the transfers nor any player changed since the last run
+    all_player_ids = [player["i"] for team in all_teams for player in team["players"]]
+    owners = ownership.sync(client, selected_league.id, all_player_ids)
+    fingerprint = fingerprints.of(
+        league_users,
+        all_teams,
+        all_transfers,
+        owners,
+        [leagues.player_statistics(client, selected_league.id, player_id).to_dict() for player_id in all_player_ids],
+        [market_values.value_on(client, player_id, start_day) for player_id in all_player_ids],
+    )
+    if fingerprints.skip_unchanged(selected_league.id, "taken_free_players", fingerprint,
+                                   ("taken_players.json", "free_players.json")):
+        return
 
-            if user_id not in buy_prices:
-                buy_prices[user_id] = []
-            
-            buy_prices[user_id].append((player_id, buy_price))
+    ### What every manager last paid for every player, so the owners' buy prices are a lookup
+    buy_prices = feed_ledger.last_buy_prices(all_transfers, directory)
 
     ### Cycle through all teams
-    with open(path.join(DATA_DIR, "STATIC_teams.json"), "r") as f:
-        all_teams = json.load(f)
     for team in all_teams:
         ### Cycle through all players of the team
         for player in team["players"]:
 
             ### Search the stats of the given player ID to fill the missing attributes for the player
-            player_stats = leagues.player_statistics(user_token, selected_league.id, player["i"])
+            player_stats = leagues.player_statistics(client, selected_league.id, player["i"])
 
             ### Check if the player is owned by a user in this league
-            ### Ownership lives in the per-league "opl" list, not in the top level "oui".
-            owner = miscellaneous.get_player_owner(player_stats, selected_league.id)
+            owner = owners[player["i"]]
 
             if owner:
-                logging.debug(f"Player {player_stats.get('fn', None)} {player['n']} is owned by user {owner.get('onm', 'Unknown')}!")
+                logging.debug(f"Player {player_stats.firstName} {player['n']} is owned by user {owner.get('onm', 'Unknown')}!")
 
                 ### Check if position number is valid
                 if player["pos"] not in miscellaneous.POSITIONS:
-                    logging.warning(f"Invalid position number: {player['pos']} for player {player_stats.get('fn', None)} {player['n']} (PID: {player['i']})")
+                    logging.warning(f"Invalid position number: {player['pos']} for player {player_stats.firstName} {player['n']} (PID: {player['i']})")
                     player["pos"] = 1 ### Default to "Torwart" (Goalkeeper)
 
                 ### Determine the buy price
-                current_user_id = owner["oui"]
-                buy_price = 0
-                if current_user_id in buy_prices:
-                    for pid, price in buy_prices[current_user_id]:
-                        if pid == player["i"]:
-                            buy_price = price
-                            break
+                buy_price = buy_prices.get((owner["oui"], player["i"]), 0)
 
                 if buy_price == 0:
-                    ### Set the buyPrice to the START_DATE value in the player_marketvalues list
+                    ### Set the buyPrice to the START_DATE value in the player's market value history
                     ### Do this because the player was assigned at the start of the season
-                    start_date = miscellaneous.get_start_datetime().strftime("%d.%m.%Y")
-
-                    player_marketvalues = leagues.player_marketvalue(user_token, player["i"])
-
-                    for marketValue in player_marketvalues:
-                        ### Convert the Julian date to a standard date
-                        market_value_date = miscellaneous.julian_to_date(marketValue["dt"])
+                    start_value = market_values.value_on(client, player["i"], start_day)
 
-                        if market_value_date == start_date:
-                            buy_price = marketValue["mv"]
-                            logging.debug(f"Player {player_stats.get('fn', None)} {player['n']} was assigned at the start of the season. Market value on START_DATE {start_date}: {buy_price}€.")
-                            break
+                    if start_value is not None:
+                        buy_price = start_value
+                        logging.debug(f"Player {player_stats.firstName} {player['n']} was assigned at the start of the season. Market value on START_DATE {start_date}: {buy_price}€.")
 
                 ### Create a custom json dict for every taken player. This will be passed to the frontend later.
                 taken_players.append({
@@ -421,7 +735,7 @@ def taken_free_players(user_token: str, selected_league: object):
                     "playerId": player["i"],
                     "teamId": player["tid"],
                     "position": miscellaneous.POSITIONS[player["pos"]],
-                    "firstName": player_stats.get("fn", None),
+                    "firstName": player_stats.firstName,
                     "lastName": player["n"],
                     "buyPrice": buy_price,
                     "marketValue": player["mv"],
@@ -434,10 +748,10 @@ def taken_free_players(user_token: str, selected_league: object):
                     "playerId": player["i"],
                     "teamId": player["tid"],
                     "position": miscellaneous.POSITIONS[player["pos"]],
-                    "firstName": player_stats.get("fn", None),
+                    "firstName": player_stats.firstName,
                     "lastName": player["n"],
                     "marketValue": player["mv"],
-                    "points": player_stats.get("tp", 0),
+                    "points": player_stats.totalPoints or 0,
                     "status": player["st"],
                     "trend": player["mvt"],
                 })
@@ -451,63 +765,39 @@ def taken_free_players(user_token: str, selected_league: object):
     ### Save to file + timestamp
     miscellaneous.write_json_to_file(free_players, "free_players.json")
     miscellaneous.write_json_to_file({"time": datetime.now().isoformat()}, "ts_free_players.json")
+    fingerprints.record(selected_league.id, "taken_free_players", fingerprint)
 
 
-def turnovers(user_token: str, selected_league: object) -> None:
+def turnovers(client: KickbaseClient, selected_league: object) -> None:
     """### Retrieves all turnovers in the league.
 
     Args:
-        user_token (str): The user's kkstrauth token.
+        client (KickbaseClient): The logged in API client.
         selected_league (object): The league the user wants to get data from for the frontend.
     """
     logging.info("Getting turnovers...")
 
     final_turnovers = []
 
-    ### Load existing transfers from all_transfers.json which were saved in earlier runs
-    all_transfers_path = path.join(DATA_DIR, "all_transfers.json")
-
-    all_transfers = [] # Initialize as empty list first
-
-    ### Check if all_transfers.json exists and load it
-    if path.exists(all_transfers_path):
-        try:
-            with open(all_transfers_path, "r") as f:
-                all_transfers = json.load(f)
-            logging.debug(f"Loaded {len(all_transfers)} existing transfers from all_transfers.json")
-        except json.JSONDecodeError:
-            logging.warning(f"The file {all_transfers_path} is empty or contains invalid JSON. Initializing all_transfers as an empty list.")
-    else:
-        logging.debug(f"The file {all_transfers_path} does not exist. Initializing all_transfers as an empty list.")
-
-    ### Get new transfers from the API
-    new_transfers = leagues.transfers(user_token, selected_league.id)
-    logging.debug(f"Found {len(new_transfers)} current transfers from the API")
-
-    ### Append only new transfers (ignoring duplicates)
-    current_transfer_ids = {item["i"] for item in all_transfers}  # Set of existing transfer IDs
-    for transfer in new_transfers:
-        if transfer["i"] not in current_transfer_ids:  # Check if the transfer is new
-            all_transfers.append(transfer)
-            current_transfer_ids.add(transfer["i"])  # Update the set to include the new transfer
-
-    ### Sort transfers by date after appending new ones
-    all_transfers.sort(key=lambda x: datetime.fromisoformat(x["dt"].replace("Z", "")))
-
-    logging.debug(f"Total transfers after appending new ones: {len(all_transfers)}")
-
-    ### Drop everything from before the season start or league reset
+    ### All transfers from START_DATE on, merged with the ones saved in earlier runs
+    all_transfers = feed_ledger.sync_transfers(client, selected_league.id)
     start_datetime = miscellaneous.get_start_datetime()
-    transfer_count = len(all_transfers)
-    all_transfers = miscellaneous.filter_transfers_from(all_transfers, start_datetime)
-
-    dropped = transfer_count - len(all_transfers)
-    if dropped:
-        logging.info(f"Ignored {dropped} transfer(s) from before START_DATE ({start_datetime.isoformat()}).")
+    start_day = miscellaneous.date_to_julian(start_datetime)
 
-    ### Save updated transfers back to all_transfers.json
-    miscellaneous.write_json_to_file(all_transfers, "all_transfers.json")
-    logging.debug("Updated all_transfers.json with new transfers")
+    ### Skip the rest if no transfer happened since the last run
+    ## The revenue graph ends today, so it changes with the date as well
+    with open(path.join(data_dir(), "STATIC_users.json"), "r") as f:
+        league_users = json.load(f)
+    sold_player_ids = sorted({item["data"]["pi"] for item in all_transfers if "slr" in item["data"]})
+    fingerprint = fingerprints.of(
+        league_users,
+        all_transfers,
+        start_datetime,
+        datetime.now(timezone.utc).date(),
+        [market_values.value_on(client, player_id, start_day) for player_id in sold_player_ids],
+    )
+    if fingerprints.skip_unchanged(selected_league.id, "turnovers", fingerprint, ("turnovers.json", "revenue_sum.json")):
+        return
 
     ### Process the transfers as usual
     transfers = []
@@ -534,7 +824,7 @@ def turnovers(user_token: str, selected_league: object) -> None:
             transfer_type = "unknown"
 
         ### Search the stats of the given player ID to fill the missing attributes for the player
-        player_stats = leagues.player_statistics(user_token, selected_league.id, item["data"]["pi"])
+        player_stats = leagues.player_statistics(client, selected_league.id, item["data"]["pi"])
 
         ### Create a custom json dict for every transfer
         transfers.append({
@@ -545,82 +835,48 @@ def turnovers(user_token: str, selected_league: object) -> None:
             "price": item["data"]["trp"],
             "playerId": item["data"]["pi"],
             "teamId": item["data"]["tid"],
-            "firstName": player_stats.get("fn", None),
-            "lastName": player_stats["ln"],
+            "firstName": player_stats.firstName,
+            "lastName": player_stats.lastName,
         })
 
     ### Removes duplicates given by the API (probably not needed since v4)
     transfers = list({frozenset(item.items()): item for item in transfers}.values())
 
-    turnovers = []
-
-    ### Iterate over every element in the "transfers" list (where "i" is the index) and save it to "buy_transfer"
-    for i, buy_transfer in enumerate(transfers):
-        ### Skip if the transfer is type "sell"
-        if buy_transfer["type"] == "sell":
-            continue
-
-        ### This nested loop iterates over the remaining transfers (starting from the current buy transfer).
-        ### It compares each of these transfers with the current buy transfer
-        for sell_transfer in transfers[i:]:
-            if sell_transfer["type"] == "buy":
-                continue
-
-            ### This condition checks if the player ID of the current sell transfer matches the player ID of the current buy transfer. 
-            ### If there is a match, it means a corresponding buy-sell pair is found.
-            if sell_transfer["playerId"] == buy_transfer["playerId"]:
-                turnovers.append((buy_transfer, sell_transfer))
-                break
+    ### Pair every buy with the next sell of the player
+    turnovers, unpaired_sells = miscellaneous.pair_transfers(transfers)
 
     ### Revenue generated by randomly assigned players
-    for transfer in transfers:
-        ### Skip buy transfers
-        if transfer["type"] == "buy":
+    ## A sell without a buy before it is a player the user was assigned at the start of the season
+    start_date = start_datetime.strftime("%d.%m.%Y")
+    for transfer in unpaired_sells:
+        ### Set the price to the START_DATE value in the player's market value history
+        ### Do this because the player was assigned at the start of the season
+        price = market_values.value_on(client, transfer["playerId"], start_day)
+
+        if price is not None:
+            logging.debug(f"Starter player {transfer['firstName']} {transfer['lastName']} was sold! Market value on START_DATE {start_date}: {price}€.")
+
+        ### Without a market value on START_DATE there is no buy price to work with
+        ## Skip the transfer instead of reusing the previous player's price, which
+        ## would silently distort the revenue numbers.
+        if price is None:
+            logging.warning(f"No market value found for {transfer['firstName']} {transfer['lastName']} on START_DATE {start_date}. Skipping this sell transfer.")
             continue
 
-        ### This condition checks if the current sell transfer is not already part of a buy-sell pair in the turnovers list.
-        if transfer not in [turnover[1] for turnover in turnovers]:
-
-            ### Loop through all marketValues of the player until the "day" matches the START_DATE
-            start_date = start_datetime.strftime("%d.%m.%Y")
-
-            ### Search the stats of the given player ID to fill the missing attributes for the player
-            player_marketvalues = leagues.player_marketvalue(user_token, transfer["playerId"])
-
-            ### Set the price to the START_DATE value in the player_marketvalues list
-            ### Do this because the player was assigned at the start of the season
-            price = None
-
-            for marketValue in player_marketvalues:
-                ### Convert the Julian date to a standard date
-                market_value_date = miscellaneous.julian_to_date(marketValue["dt"])
-
-                if market_value_date == start_date:
-                    price = marketValue["mv"]
-                    logging.debug(f"Starter player {transfer['firstName']} {transfer['lastName']} was sold! Market value on START_DATE {start_date}: {price}€.")
-                    break
-
-            ### Without a market value on START_DATE there is no buy price to work with
-            ## Skip the transfer instead of reusing the previous player's price, which
-            ## would silently distort the revenue numbers.
-            if price is None:
-                logging.warning(f"No market value found for {transfer['firstName']} {transfer['lastName']} on START_DATE {start_date}. Skipping this sell transfer.")
-                continue
-
-            ### If an unmatched sell transfer is found, a simulated buy transfer is created with some default values
-            date = start_datetime.isoformat()
-            buy_transfer = {"date": date,
-                            "type": "assigned_at_start",
-                            "user": transfer["user"],
-                            "tradePartner": "Kickbase",
-                            "price": price,
-                            "playerId": transfer["playerId"],
-                            "teamId": transfer["teamId"],
-                            "firstName": transfer["firstName"],
-                            "lastName": transfer["lastName"],
-                        }
-
-            turnovers.append((buy_transfer, transfer))
+        ### If an unmatched sell transfer is found, a simulated buy transfer is created with some default values
+        date = start_datetime.isoformat()
+        buy_transfer = {"date": date,
+                        "type": "assigned_at_start",
+                        "user": transfer["user"],
+                        "tradePartner": "Kickbase",
+                        "price": price,
+                        "playerId": transfer["playerId"],
+                        "teamId": transfer["teamId"],
+                        "firstName": transfer["firstName"],
+                        "lastName": transfer["lastName"],
+                    }
+
+        turnovers.append((buy_transfer, transfer))
 
     final_turnovers += turnovers
 
@@ -632,46 +888,46 @@ def turnovers(user_token: str, selected_league: object) -> None:
 
     ### Calculate revenue data for the graph
     miscellaneous.calculate_revenue_data_daily(final_turnovers)
+    fingerprints.record(selected_league.id, "turnovers", fingerprint)
 
 
-def team_value_per_match_day(user_token: str, selected_league: object) -> None:
+def team_value_per_match_day(client: KickbaseClient, selected_league: object) -> None:
     """### Calculates the team value per match day for all users in the league.
 
     Args:
-        user_token (str): The user's kkstrauth token.
+        client (KickbaseClient): The logged in API client.
         selected_league (object): The league the user wants to get data from for the frontend.
     """
     logging.info("Calculating team value per match day...")
 
     final_team_value = {}
 
-    ### Get all match days of the season
-    current_match_day, match_days_list = competitions.match_days(user_token)
-    
-    ### Loop through all users in the league
-    with open(path.join(DATA_DIR, "STATIC_users.json"), "r") as f:
+    ### Get the current match day of the season
+    current_match_day, _ = competitions.match_days(client)
+
+    ### Finished match days come from the archive, so usually only the current one is fetched
+    rankings = ranking_archive.sync(client, selected_league.id)
+    team_values_by_user = ranking_archive.team_values_by_user(rankings)
+
+    with open(path.join(data_dir(), "STATIC_users.json"), "r") as f:
         league_users = json.load(f)
+
+    ### Skip the rest if no ranking changed since the last run
+    fingerprint = fingerprints.of(league_users, current_match_day, rankings)
+    if fingerprints.skip_unchanged(selected_league.id, "team_value_per_match_day", fingerprint, ("team_values.json",)):
+        return
+
+    ### Loop through all users in the league
     for user_id, user_name in league_users.items():
         ### Get the team value for each match day
         team_value = {match_day: 0 for match_day in range(1, current_match_day + 1)}
-    
-        ### Loop through all match days
-        for match_day in match_days_list:
-            ### Skip processing if the match day is in the future
-            if match_day["day"] > current_match_day:
-                continue
-        
-            ranking_data = leagues.ranking(user_token, selected_league.id, match_day["day"])
-            team_value_on_match_day = None
-
-            for real_user in ranking_data["us"]:
-                if real_user["i"] == user_id:
-                    team_value_on_match_day = real_user["tv"]
-                    break
-        
-            if len(team_value) >= match_day["day"]:
-                team_value[match_day["day"]] = team_value_on_match_day
-        
+        user_team_values = team_values_by_user.get(user_id, {})
+
+        ### Match days the user has no ranking entry for stay None
+        for match_day in rankings:
+            if len(team_value) >= match_day:
+                team_value[match_day] = user_team_values.get(match_day)
+
         final_team_value[user_name] = team_value
 
     logging.info("Calculated team value per match day.")
@@ -679,13 +935,14 @@ def team_value_per_match_day(user_token: str, selected_league: object) -> None:
     ### Save to file + timestamp
     miscellaneous.write_json_to_file(final_team_value, "team_values.json")
     miscellaneous.write_json_to_file({"time": datetime.now().isoformat()}, "ts_team_values.json")
+    fingerprints.record(selected_league.id, "team_value_per_match_day", fingerprint)
 
 
-def league_user_stats_tables(user_token: str, selected_league: object) -> None:
+def league_user_stats_tables(client: KickbaseClient, selected_league: object) -> None:
     """### Retrieves the statistics for all users in the league.
 
     Args:
-        user_token (str): The user's kkstrauth token.
+        client (KickbaseClient): The logged in API client.
         selected_league (object): The league the user wants to get data from for the frontend.
     """
     logging.info("Getting league user stats...")
@@ -693,30 +950,40 @@ def league_user_stats_tables(user_token: str, selected_league: object) -> None:
     final_user_stats = []
 
     ### Loop through all users in the league
-    with open(path.join(DATA_DIR, "STATIC_users.json"), "r") as f:
+    with open(path.join(data_dir(), "STATIC_users.json"), "r") as f:
         league_users = json.load(f)
 
-    ### Normally a no-op, since balances() runs first and fills the cache
-    #miscellaneous.prefetch_profilepics(league_users.keys())
+    ### Normally answered from the cache, since balances() runs first and fills it
+    profile_pictures = profile_pics.resolve(league_users.keys())
+
+    ### Fetch every dashboard and battle at once, then look the points up by user
+    leagues.prefetch_dashboards(client, selected_league.id, league_users.keys())
+    battle_points = leagues.battle_index(client, selected_league.id)
+
+    ### Skip the rest if no dashboard or battle changed since the last run
+    fingerprint = fingerprints.of(
+        league_users,
+        profile_pictures,
+        [leagues.user_stats(client, selected_league.id, user_id) for user_id in league_users],
+        battle_points,
+    )
+    if fingerprints.skip_unchanged(selected_league.id, "league_user_stats_tables", fingerprint, ("league_user_stats.json",)):
+        return
 
     for user_id, user_name in league_users.items():
         ### Get stats for each user
-        user_stats = leagues.user_stats(user_token, selected_league.id, user_id)
+        user_stats = leagues.user_stats(client, selected_league.id, user_id)
 
         ### Find the user's points in the specific battle
         def get_user_points(battle_type):
-            battles_data = leagues.battles(user_token, selected_league.id, battle_type)
-            for entry in battles_data["us"]:
-                if entry["u"]["i"] == user_id:
-                    return entry["v"]
-            return 0
+            return battle_points[battle_type].get(user_id, 0)
 
         ### Create a custom json list for every user
         final_user_stats.append({
             ### Shared stats 
             "userId": user_id,
             "userName": user_name,
-            "profilePic": miscellaneous.get_profilepic(user_id),
+            "profilePic": profile_pictures[user_id],
             "mdWins": user_stats["mdw"],
             "maxPoints": get_user_points(8),
             ### Stats for "Liga -> Tabelle" ONLY
@@ -751,13 +1018,14 @@ def league_user_stats_tables(user_token: str, selected_league: object) -> None:
     ### Save to file + timestamp
     miscellaneous.write_json_to_file(final_user_stats, "league_user_stats.json")
     miscellaneous.write_json_to_file({"time": datetime.now().isoformat()}, "ts_league_user_stats.json")
+    fingerprints.record(selected_league.id, "league_user_stats_tables", fingerprint)
 
 
-def live_points(user_token: str, selected_league: object) -> list:
+def live_points(client: KickbaseClient, selected_league: object) -> list:
     """### Retrieves the live points for the players in a users team.
 
     Args:
-        user_token (str): The user's kkstrauth token.
+        client (KickbaseClient): The logged in API client.
         selected_league (object): The league the user wants to get data from for the frontend.
 
     Returns:
@@ -766,7 +1034,7 @@ def live_points(user_token: str, selected_league: object) -> list:
     logging.info("Getting live points...")
 
     ### Get the current live points
-    live_points = leagues.live_points(user_token, selected_league.id)
+    live_points = leagues.live_points(client, selected_league.id)
 
     ### Create a custom json dict for every user and his players
     final_live_points = []
@@ -809,11 +1077,11 @@ def live_points(user_token: str, selected_league: object) -> list:
     return final_live_points
 
 
-def balances(user_token: str, selected_league: object) -> None:
+def balances(client: KickbaseClient, selected_league: object) -> None:
     """### Retrieves the estiamted balances for all users in the league. Daily login bonus and money from achievements are not considered.
 
     Args:
-        user_token (str): The user's kkstrauth token.
+        client (KickbaseClient): The logged in API client.
         selected_league (object): The league the user wants to get data from for the frontend.
     """
     logging.info("Getting balances...")
@@ -821,52 +1089,41 @@ def balances(user_token: str, selected_league: object) -> None:
     initial_balance = float(getenv("START_MONEY", 50000000))
     final_balances = []
 
-    ### Get all transfers from the API
-    all_transfers = leagues.transfers(user_token, selected_league.id)
+    ### Get all transfers from the ledger
+    all_transfers = feed_ledger.sync_transfers(client, selected_league.id)
     logging.debug(f"Found {len(all_transfers)} transfers in total")
 
-    ### Initialize user balances
-    with open(path.join(DATA_DIR, "STATIC_users.json"), "r") as f:
-        league_users = json.load(f)
-        user_balances = {user_id: initial_balance for user_id, user_name in league_users.items()}
+    ### The managers, looked up by ID and by the names the feed uses
+    directory = user_directory.load()
+    league_users = directory.names
 
     ### Look the profile pictures up all at once. A user without one costs a full
     ### timeout, so doing them one by one dominated the runtime of this function.
-    #miscellaneous.prefetch_profilepics(league_users.keys())
+    profile_pictures = profile_pics.resolve(league_users.keys())
+
+    ### The same goes for the dashboards, which hold the team values
+    leagues.prefetch_dashboards(client, selected_league.id, league_users.keys(), battle_types=())
+
+    ### Skip the rest if no transfer happened and no team value changed since the last run
+    fingerprint = fingerprints.of(
+        initial_balance,
+        league_users,
+        all_transfers,
+        profile_pictures,
+        [leagues.user_stats(client, selected_league.id, user_id)["tv"] for user_id in league_users],
+    )
+    if fingerprints.skip_unchanged(selected_league.id, "balances", fingerprint, ("balances.json",)):
+        return
 
-    ### Loop through all users in the league
-    for user_id, user_name in league_users.items():
-        balance = user_balances.get(user_id, initial_balance)
+    ### Book every transfer onto the balances of its buyer and seller, in one pass
+    ledger = balance_ledger.BalanceLedger(directory, initial_balance).apply(all_transfers)
 
-        logging.debug(f"User: {user_name}; Starter balance: {balance}")
+    for user_id, user_name in league_users.items():
+        balance = ledger.balances[user_id]
 
-        user_stats = leagues.user_stats(user_token, selected_league.id, user_id)
+        user_stats = leagues.user_stats(client, selected_league.id, user_id)
         team_value = user_stats["tv"]
-        logging.debug(f"Team value of {user_name}: {team_value}")
-
-        ### Check every item in the all_transfers list if it belongs to the current user
-        for item in all_transfers:
-            ### Check if item is a buy or sell transfer
-            if item["t"] == 15:
-                transfer_amount = item["data"]["trp"]
-
-                if "byr" in item["data"] and {value: key for key, value in league_users.items()}.get(item["data"]["byr"]) == user_id:
-                    ### User bought a player
-                    balance -= transfer_amount
-
-                    player_last_name = item["data"]["pn"]
-                    logging.debug(f"{user_name} bought {player_last_name} for {transfer_amount}€")
-                    logging.debug(f"New balance: {balance}")
-                elif "slr" in item["data"] and {value: key for key, value in league_users.items()}.get(item["data"]["slr"]) == user_id:
-                    ### User sold a player
-                    balance += transfer_amount
-
-                    player_last_name = item["data"]["pn"]
-                    logging.debug(f"{user_name} sold {player_last_name} for {transfer_amount}€")
-                    logging.debug(f"New balance: {balance}")
-
-        ### Update the user balance
-        user_balances[user_id] = balance
+        logging.debug(f"{user_name}: balance {balance}, team value {team_value}")
 
         ### Calculate the adjusted team value
         adjusted_team_value = team_value + balance
@@ -887,7 +1144,7 @@ def balances(user_token: str, selected_league: object) -> None:
         final_balances.append({
             "userId": user_id,
             "username": user_name,
-            "profilePic": miscellaneous.get_profilepic(user_id),
+            "profilePic": profile_pictures[user_id],
             "teamValue": team_value,
             "balance": round(balance, 0),
             "maxBid": round(maxbid, 0),
@@ -898,31 +1155,15 @@ def balances(user_token: str, selected_league: object) -> None:
     ### Save to file + timestamp
     miscellaneous.write_json_to_file(final_balances, "balances.json")
     miscellaneous.write_json_to_file({"time": datetime.now().isoformat()}, "ts_balances.json")
+    fingerprints.record(selected_league.id, "balances", fingerprint)
 
 ### -------------------------------------------------------------------
 ### -------------------------------------------------------------------
 ### -------------------------------------------------------------------
 
 if __name__ == "__main__":
-    ### Try to get the logins and Discord URL from the environment variables (Docker)
-    kb_mail = getenv("KB_MAIL")
-    kb_password = getenv("KB_PASSWORD")
-    discord_webhook = getenv("DISCORD_WEBHOOK")
-
-    ### -------------------------------------------------------------------
-
     tprint("\n\nKB-Insights")
     print("\x1B[3mby casudo\x1B[0m")
     print(f"\x1B[3m{__version__}\x1B[0m\n\n")    
 
-    start_time = time.time()
-
-    main()
-
-    ### Timestamp for frontend
-    miscellaneous.write_json_to_file({"time": datetime.now().isoformat()}, "ts_main.json")
-
-    elapsed_time_seconds = time.time() - start_time
-    minutes = int(elapsed_time_seconds // 60)
-    seconds = int(elapsed_time_seconds % 60)
-    logging.info(f"DONE! Execution time: {minutes}m {seconds}s")
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,80 @@
+"""
+### This script times miscellaneous.pair_transfers() against the nested loop turnovers() used before.
+
+It generates random buys and sells of a pool of players, checks that both pair the
+same transfers (the same dicts, not just equal ones) and prints how long each takes.
+
+Run it from the repository root: `python scripts/benchmark_pair_transfers.py`
+"""
+
+import sys
+import random
+import timeit
+
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from backend.miscellaneous import pair_transfers
+
+### -------------------------------------------------------------------
+
+### (transfers, players) per run
+SIZES = ((1000, 300), (10000, 600))
+REPEAT = 3
+
+
+def random_transfers(count: int, players: int, seed: int = 0) -> list:
+    """### Generate `count` buys and sells of random players, oldest first, with a few of unknown type.
+
+    Like the deduplicated transfers in turnovers(), no two are equal.
+    """
+    rng = random.Random(seed)
+    return [{"date": index,
+             "type": rng.choices(("buy", "sell", "unknown"), weights=(49, 49, 2))[0],
+             "playerId": str(rng.randrange(players)),
+             "price": rng.randrange(100_000, 20_000_000, 10_000)}
+            for index in range(count)]
+
+
+def nested_loop_pairs(transfers: list) -> tuple:
+    """### The pairing turnovers() did before: scan the later transfers for every buy, then search the paired sells."""
+    turnovers = []
+    for i, buy_transfer in enumerate(transfers):
+        if buy_transfer["type"] == "sell":
+            continue
+        for sell_transfer in transfers[i:]:
+            if sell_transfer["type"] == "buy":
+                continue
+            if sell_transfer["playerId"] == buy_transfer["playerId"]:
+                turnovers.append((buy_transfer, sell_transfer))
+                break
+
+    unpaired_sells = []
+    for transfer in transfers:
+        if transfer["type"] == "buy":
+            continue
+        if transfer not in [turnover[1] for turnover in turnovers]:
+            unpaired_sells.append(transfer)
+
+    return turnovers, unpaired_sells
+
+
+def identities(result: tuple) -> tuple:
+    pairs, unpaired_sells = result
+    return [(id(buy), id(sell)) for buy, sell in pairs], [id(sell) for sell in unpaired_sells]
+
+
+def main() -> None:
+    for count, players in SIZES:
+        transfers = random_transfers(count, players)
+        assert identities(pair_transfers(transfers)) == identities(nested_loop_pairs(transfers)), "The pairs differ"
+
+        before = min(timeit.repeat(lambda: nested_loop_pairs(transfers), number=1, repeat=REPEAT))
+        after = min(timeit.repeat(lambda: pair_transfers(transfers), number=1, repeat=REPEAT))
+        print(f"{count:>6} transfers / {players} players: nested loop {before * 1000:8.1f} ms, "
+              f"pair_transfers {after * 1000:6.2f} ms (same pairs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+### This script times miscellaneous.daily_cumulative_revenue() against the pandas aggregation it replaced.
+
+It generates random sales for a few users since a start date, checks that both give the
+same series and prints how long each takes, plus how long importing pandas takes. pandas
+isn't a dependency anymore; without it only the current function is timed.
+
+Run it from the repository root: `python scripts/benchmark_revenue.py`
+"""
+
+import sys
+import random
+import timeit
+import subprocess
+
+from os import path
+from datetime import date, datetime, time, timedelta, timezone
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from backend.miscellaneous import daily_cumulative_revenue
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+### -------------------------------------------------------------------
+
+USERS = [f"User {i}" for i in range(12)]
+FIRST_DAY = date(2025, 7, 1)
+LAST_DAY = date(2026, 5, 31)
+SIZES = (200, 10000)
+REPEAT = 5
+
+
+def random_turnovers(count: int, seed: int = 0) -> list:
+    """### Generate `count` buy-sell pairs of random users, sold on random days between FIRST_DAY and LAST_DAY."""
+    rng = random.Random(seed)
+    days = (LAST_DAY - FIRST_DAY).days
+    turnovers = []
+    for _ in range(count):
+        sold = datetime.combine(FIRST_DAY, time(), timezone.utc) + timedelta(days=rng.randrange(days), seconds=rng.randrange(86400))
+        buy = {"user": rng.choice(USERS), "price": rng.randrange(100_000, 20_000_000, 10_000)}
+        sell = {"date": sold.strftime("%Y-%m-%dT%H:%M:%SZ"), "price": rng.randrange(100_000, 20_000_000, 10_000)}
+        turnovers.append((buy, sell))
+    return turnovers
+
+
+def pandas_cumulative_revenue(turnovers: list, user_names, first_day: date, last_day: date) -> dict:
+    """### The pandas aggregation calculate_revenue_data_daily() used before, with the start and end points fixed."""
+    user_transfer_revenue = {user_name: [] for user_name in user_names}
+    for buy, sell in turnovers:
+        if buy["user"] in user_transfer_revenue:
+            user_transfer_revenue[buy["user"]].append((sell["price"] - buy["price"], sell["date"]))
+
+    for data in user_transfer_revenue.values():
+        data.append((0, datetime.combine(first_day, time(), timezone.utc)))
+        data.append((0, datetime.combine(last_day, time(), timezone.utc)))
+
+    data = {}
+    for user, revenue in user_transfer_revenue.items():
+        df = pd.DataFrame(revenue, columns=["revenue", "date"])
+        df["date"] = pd.to_datetime(df["date"], utc=True, format="mixed")
+        df = df.groupby(pd.Grouper(key="date", freq="D"))["revenue"] \
+            .sum().reset_index().sort_values("date")
+        df["revenue"] = df["revenue"].cumsum()
+        df["date"] = df["date"].dt.strftime("%Y-%m-%d")
+        data[user] = [(entry[0], entry[1]) for entry in df.to_numpy().tolist()]
+
+    return data
+
+
+def import_seconds(module: str) -> float:
+    """### How much longer a fresh interpreter takes to start when it imports `module`."""
+    def start(code: str) -> float:
+        return min(timeit.repeat(lambda: subprocess.run([sys.executable, "-c", code], check=True),
+                                 number=1, repeat=REPEAT))
+    return start(f"import {module}") - start("pass")
+
+
+def main() -> None:
+    if pd is None:
+        print("pandas is not installed, only timing daily_cumulative_revenue().")
+    else:
+        print(f"Importing pandas: {import_seconds('pandas') * 1000:.0f} ms")
+
+    for size in SIZES:
+        turnovers = random_turnovers(size)
+        current = min(timeit.repeat(lambda: daily_cumulative_revenue(turnovers, USERS, FIRST_DAY, LAST_DAY),
+                                    number=1, repeat=REPEAT))
+        line = f"{size:>6} turnovers: new {current * 1000:8.1f} ms"
+
+        if pd is not None:
+            expected = pandas_cumulative_revenue(turnovers, USERS, FIRST_DAY, LAST_DAY)
+            assert daily_cumulative_revenue(turnovers, USERS, FIRST_DAY, LAST_DAY) == expected, "The series differ"
+            before = min(timeit.repeat(lambda: pandas_cumulative_revenue(turnovers, USERS, FIRST_DAY, LAST_DAY),
+                                       number=1, repeat=REPEAT))
+            line += f", pandas {before * 1000:8.1f} ms (same output)"
+
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
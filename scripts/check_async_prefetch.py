@@ -0,0 +1,167 @@
+"""
+### This script checks the AsyncKickbaseClient the prefetch runs on against a local stand-in server.
+
+It starts a small HTTP server on a free port, points a KickbaseClient at it (the same
+way KB_API_URL does for main.py) and checks that:
+
+- the same call made many times at once is only sent once (single-flight),
+- no more calls of one endpoint run at once than its limit allows,
+- a call that failed is sent again the next time it is asked for,
+- a deadline stops the prefetch without waiting for the calls still running.
+
+Run it from the repository root: `python scripts/check_async_prefetch.py`
+"""
+
+import sys
+import time
+import json
+import asyncio
+import threading
+
+from os import path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from backend.kickbase.client import AsyncKickbaseClient, KickbaseClient
+
+### -------------------------------------------------------------------
+
+### How long the stand-in server takes per request, in seconds
+RESPONSE_DELAY = 0.2
+### The concurrency limit the checks give the endpoint
+ENDPOINT_LIMIT = 2
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """
+    ### Answers every GET after RESPONSE_DELAY and counts the requests per path.
+
+    Paths starting with `/flaky/` fail the first time they are asked for.
+    """
+    lock = threading.Lock()
+    requests = {}
+    running = 0
+    max_running = 0
+
+    def do_GET(self):
+        with StandIn.lock:
+            StandIn.requests[self.path] = StandIn.requests.get(self.path, 0) + 1
+            attempt = StandIn.requests[self.path]
+            StandIn.running += 1
+            StandIn.max_running = max(StandIn.max_running, StandIn.running)
+
+        time.sleep(RESPONSE_DELAY)
+
+        with StandIn.lock:
+            StandIn.running -= 1
+
+        status = 500 if self.path.startswith("/flaky/") and attempt == 1 else 200
+        body = json.dumps({"path": self.path}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.requests = {}
+            cls.running = 0
+            cls.max_running = 0
+
+
+def endpoint(client: KickbaseClient, key: str) -> dict:
+    """### An endpoint function like the ones in backend.kickbase.v4."""
+    response = client.get(f"/endpoint/{key}")
+    response.raise_for_status()
+    return response.json()
+
+
+def flaky(client: KickbaseClient, key: str) -> dict:
+    """### An endpoint function whose first request fails."""
+    response = client.get(f"/flaky/{key}")
+    response.raise_for_status()
+    return response.json()
+
+
+def new_client(client: KickbaseClient) -> AsyncKickbaseClient:
+    StandIn.reset()
+    return AsyncKickbaseClient(client, limits={"endpoint": ENDPOINT_LIMIT, "flaky": ENDPOINT_LIMIT})
+
+
+async def check_single_flight(client: KickbaseClient) -> None:
+    aclient = new_client(client)
+    try:
+        await asyncio.gather(*(aclient.call(endpoint, "same") for _ in range(10)))
+    finally:
+        aclient.close()
+    assert StandIn.requests == {"/endpoint/same": 1}, f"Expected one request, got {StandIn.requests}"
+
+
+async def check_endpoint_limit(client: KickbaseClient) -> None:
+    aclient = new_client(client)
+    try:
+        await asyncio.gather(*(aclient.call(endpoint, str(key)) for key in range(8)))
+    finally:
+        aclient.close()
+    assert len(StandIn.requests) == 8, f"Expected 8 requests, got {StandIn.requests}"
+    assert StandIn.max_running <= ENDPOINT_LIMIT, f"{StandIn.max_running} requests ran at once, the limit is {ENDPOINT_LIMIT}"
+
+
+async def check_failed_call_retried(client: KickbaseClient) -> None:
+    aclient = new_client(client)
+    try:
+        try:
+            await aclient.call(flaky, "a")
+            raise AssertionError("The first flaky call should have failed")
+        except Exception as e:
+            if isinstance(e, AssertionError):
+                raise
+        result = await aclient.call(flaky, "a")
+    finally:
+        aclient.close()
+    assert result == {"path": "/flaky/a"}, f"Unexpected result {result}"
+    assert StandIn.requests == {"/flaky/a": 2}, f"Expected the failed call to be sent again, got {StandIn.requests}"
+
+
+async def check_deadline(client: KickbaseClient) -> None:
+    """### The same shape as prefetch.prefetch_all(): wait_for() with a deadline, then close() without waiting."""
+    aclient = new_client(client)
+    deadline = RESPONSE_DELAY / 2
+
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(asyncio.gather(*(aclient.call(endpoint, str(key)) for key in range(20))), timeout=deadline)
+        raise AssertionError("The calls should not have finished before the deadline")
+    except asyncio.TimeoutError:
+        aclient.close(wait=False)
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < RESPONSE_DELAY, f"Stopping took {elapsed:.2f}s, longer than one request ({RESPONSE_DELAY}s)"
+    ### Only the calls running at the deadline were sent, the queued ones were dropped
+    time.sleep(RESPONSE_DELAY * 2)
+    assert len(StandIn.requests) <= ENDPOINT_LIMIT, f"Expected at most {ENDPOINT_LIMIT} requests, got {len(StandIn.requests)}"
+
+
+def main() -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = KickbaseClient(base_url=f"http://127.0.0.1:{server.server_port}")
+
+    checks = (check_single_flight, check_endpoint_limit, check_failed_call_retried, check_deadline)
+    try:
+        for check in checks:
+            asyncio.run(check(client))
+            print(f"OK   {check.__name__}")
+    finally:
+        client.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()